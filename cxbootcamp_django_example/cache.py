@@ -0,0 +1,73 @@
+import time
+
+from django.core.cache import cache
+
+LOCK_TIMEOUT = 10
+LOCK_WAIT_TIMEOUT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_generation(name):
+    """Get the current generation of the cached data group.
+
+    Generation is a part of each cache key in the group, so bumping it
+    invalidates the whole group at once without searching for keys
+    """
+    key = f'generation:{name}'
+    generation = cache.get(key)
+    if generation is None:
+        # If generation is lost (i. e. evicted), start from the value which is
+        # bigger than any previous one, so we never meet old entries again
+        cache.add(key, round(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(name):
+    """Invalidate the cached data group.
+
+    Old entries are not deleted, they can't be found anymore
+    and die by their TTL
+    """
+    key = f'generation:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, round(time.time() * 1000), timeout=None)
+
+
+def get_or_set_locked(key, build, timeout):
+    """Get value from cache or build and cache it.
+
+    When the popular entry expires, many workers miss it at the same time.
+    Only the one that acquires the lock calls ``build``, the others
+    wait for the value to appear in the cache instead of hitting the DB too.
+
+    :param key: cache key
+    :param build: callable without arguments which returns the value to cache
+    :param timeout: TTL of cache entry in seconds
+    :return: cached or built value
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            value = build()
+            cache.set(key, value, timeout=timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + LOCK_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        # Under gevent workers sleep is cooperative, so we don't block other requests
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    # The lock owner is too slow or failed. Serve the request anyway
+    return build()
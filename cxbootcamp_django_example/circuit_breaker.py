@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """Stop calling the failing service for a while.
+
+    Outcomes of the calls for the last ``window`` seconds are kept in memory of the process.
+    Calls slower than ``slow_call_seconds`` count as failed. When there are at least ``min_calls``
+    and the share of failed ones reaches ``failure_rate``, the breaker opens: ``allow`` returns
+    ``False`` and callers use their fallback without waiting for the service.
+
+    After ``cooldown`` seconds one trial call is allowed (half-open state).
+    Its success closes the breaker, its failure opens it again.
+
+    Every allowed call must be recorded, whatever it raises. Otherwise the trial call
+    is never resolved and the breaker stays half-open for good. Usage::
+
+        if breaker.allow():
+            start = time.monotonic()
+            failed = True
+            try:
+                result = call_service()
+                failed = False
+            except ServiceError:
+                result = fallback()
+            finally:
+                breaker.record(time.monotonic() - start, failed=failed)
+        else:
+            result = fallback()
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_rate=0.5, slow_call_seconds=1, window=30, min_calls=10, cooldown=15):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.window = window
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._trial or time.monotonic() - self._opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Whether the service may be called now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, seconds, failed=False):
+        """Record the outcome of the allowed call
+
+        :param seconds: how long the call took
+        :param failed: whether the call raised an error
+        """
+        failed = failed or seconds > self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                # Only the trial call decides, late calls started before opening are ignored
+                if self._trial:
+                    self._trial = False
+                    self._opened_at = now if failed else None
+                return
+
+            self._calls.append((now, failed))
+            while self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+
+            failures = sum(1 for _, call_failed in self._calls if call_failed)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self._opened_at = now
+                self._calls.clear()
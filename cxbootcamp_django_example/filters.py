@@ -0,0 +1,30 @@
+from rest_framework.filters import OrderingFilter
+
+
+class AliasOrderingFilter(OrderingFilter):
+    """Ordering filter that accepts only named orderings.
+
+    View defines ``ordering_aliases`` dict with the query parameter value
+    as a key and the tuple of fields to order by as a value, i. e.::
+
+        ordering_aliases = {
+            'premier_at': ('premier_at', 'id'),
+        }
+
+    This way clients can't order by fields that are not backed by DB index,
+    and each ordering has a unique tiebreaker (which cursor pagination needs).
+    Unknown values fall back to view's ``ordering``.
+
+    View may define ``get_ordering_aliases(request)`` to offer different
+    orderings depending on request, i. e. pagination mode
+    """
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, 'get_ordering_aliases'):
+            aliases = view.get_ordering_aliases(request)
+        else:
+            aliases = getattr(view, 'ordering_aliases', {})
+        value = request.query_params.get(self.ordering_param)
+        if value in aliases:
+            return aliases[value]
+        return self.get_default_ordering(view)
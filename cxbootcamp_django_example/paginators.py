@@ -1,7 +1,46 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class ResultSetPagination(PageNumberPagination):
     page_size = 20
     max_page_size = 100
     page_size_query_param = 'page_size'
+
+
+class ResultSetCursorPagination(CursorPagination):
+    """Keyset pagination. Instead of ``COUNT(*)`` and ``OFFSET`` it filters
+    by the ordering field value of the last seen object, so the cost of the page
+    doesn't depend on how deep it is.
+
+    The ordering must be unique or nearly unique and backed by DB index
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    ordering = '-id'
+
+
+class SwitchablePaginationMixin:
+    """Mixin for views that keep page number pagination by default,
+    but let client opt in cursor pagination with query parameter, i. e. ``?pagination=cursor``.
+
+    Cursor mode is also selected when ``cursor`` query parameter is sent,
+    so ``next`` and ``previous`` links always work.
+    """
+    cursor_pagination_class = ResultSetCursorPagination
+    pagination_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            if request is not None and self._is_cursor_mode(request):
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def _is_cursor_mode(self, request):
+        params = request.query_params
+        return params.get(self.pagination_query_param) == 'cursor' or \
+            self.cursor_pagination_class.cursor_query_param in params
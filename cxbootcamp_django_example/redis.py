@@ -0,0 +1,16 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Redis client for data structures the cache API doesn't have (lists, hashes, etc.).
+
+    Client is thread safe and keeps the connection pool,
+    so it is created once per process
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'authentication',
     'notifications',
@@ -158,6 +159,32 @@ MEDIA_URL = '/media/'
 
 IMAGE_DEFAULT_EXTENSION = 'jpeg'
 IMAGE_MAX_SIZE = 1680
+# Uploads with more pixels are rejected by their header, before decoding
+IMAGE_MAX_PIXELS = env.int('IMAGE_MAX_PIXELS', 100_000_000)
+# When enabled, uploaded images are stored as is into ``IMAGE_UPLOADS_DIR``
+# and processed by Celery on ``images`` queue, otherwise right in the request
+IMAGE_PROCESSING_ASYNC = env.bool('IMAGE_PROCESSING_ASYNC', False)
+IMAGE_UPLOADS_DIR = 'uploads'
+# Responsive variants of every image. Formats Pillow can't save (i. e. AVIF without plugin) are skipped.
+# When not precomputed on upload, a variant is generated on the first request
+IMAGE_VARIANT_WIDTHS = env.list('IMAGE_VARIANT_WIDTHS', [320, 640, 1280], subcast=int)
+IMAGE_VARIANT_FORMATS = env.list('IMAGE_VARIANT_FORMATS', ['jpeg', 'webp'])
+IMAGE_VARIANTS_PRECOMPUTE = env.bool('IMAGE_VARIANTS_PRECOMPUTE', True)
+# Batch upload processes images by the pool of each web worker, 0 means the number of available cores.
+# With several web workers per host, set it to cores / workers to not oversubscribe CPU
+IMAGE_BATCH_WORKERS = env.int('IMAGE_BATCH_WORKERS', 0)
+IMAGE_BATCH_MAX_FILES = env.int('IMAGE_BATCH_MAX_FILES', 100)
+IMAGE_BATCH_MAX_SIZE = env.int('IMAGE_BATCH_MAX_SIZE_MB', 200) * 1024 * 1024
+# Direct upload of raw images to the storage by signed URL, see ``static_content.direct_upload``
+IMAGE_DIRECT_UPLOAD_BACKEND = env.str('IMAGE_DIRECT_UPLOAD_BACKEND',
+                                      'static_content.direct_upload.LocalDirectUploadBackend')
+IMAGE_DIRECT_UPLOAD_EXPIRES = env.int('IMAGE_DIRECT_UPLOAD_EXPIRES_SEC', 15 * 60)
+IMAGE_DIRECT_UPLOAD_MAX_SIZE = env.int('IMAGE_DIRECT_UPLOAD_MAX_SIZE_MB', 50) * 1024 * 1024
+# Uploads not completed for this time after their URL expired are failed and their raw files are deleted.
+# The grace lets the uploads started right before the expiration finish
+IMAGE_DIRECT_UPLOAD_GRACE = env.int('IMAGE_DIRECT_UPLOAD_GRACE_SEC', 5 * 60)
+# Media files absent in the manifest and in the storage are not requested from the storage again for this time
+MEDIA_MISSING_CACHE_TIMEOUT = env.int('MEDIA_MISSING_CACHE_TIMEOUT_SEC', 60)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -277,16 +304,59 @@ CORS_ORIGIN_WHITELIST = env.list('CORS_ORIGINS', [])
 # CELERY
 CELERY_BROKER_URL = env.str('BROKER_URL')
 CELERY_TASK_DEFAULT_QUEUE = "django"
+# Image processing is CPU-bound, it's run by a separate prefork worker
+CELERY_TASK_ROUTES = {
+    'static_content.tasks.process_image': {'queue': 'images'},
+}
 
 CELERY_TASK_SOFT_TIME_LIMIT = env.int('CELERY_TASK_SOFT_TIME_LIMIT_SEC', 40)
 CELERY_WORKER_SEND_TASK_EVENTS = True
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# By default, Redis which already runs as Celery broker is used
+CACHES = {
+    'default': {
+        'BACKEND': env.str('CACHE_BACKEND', 'django_redis.cache.RedisCache'),
+        'LOCATION': env.str('CACHE_URL', CELERY_BROKER_URL),
+    },
+}
+
+# Redis for data structures the cache API doesn't have
+REDIS_URL = env.str('REDIS_URL', CELERY_BROKER_URL)
+
+# When enabled, votes are buffered in Redis and written to DB by batches,
+# otherwise each vote is written right away
+VOTES_BUFFERED = env.bool('VOTES_BUFFERED', False)
+VOTES_BUFFER_BATCH_SIZE = env.int('VOTES_BUFFER_BATCH_SIZE', 500)
+
+# Hot score of premier loses half of its value every ``PREMIERS_HOT_HALF_LIFE`` seconds
+PREMIERS_HOT_HALF_LIFE = env.int('PREMIERS_HOT_HALF_LIFE_HOURS', 12) * 60 * 60
+# Votes are summed from scratch until they are older than the lag, so the votes committed late are counted
+PREMIERS_HOT_SETTLE_LAG = env.int('PREMIERS_HOT_SETTLE_LAG_SEC', 5 * 60)
+
+# Anonymous premiers list is cached. TTL must be short enough
+# to flip ``is_future`` of the premiers in time
+PREMIERS_LIST_CACHE_TIMEOUT = env.int('PREMIERS_LIST_CACHE_TIMEOUT_SEC', 30)
+
 # Settings of Beat scheduler
 CELERY_BEAT_SCHEDULE = {
     'run-tick-tack': {
         'task': 'premiers.tasks.tick_tack',
         'schedule': crontab(minute='*')
     },
+    'flush-votes-buffer': {
+        'task': 'premiers.tasks.flush_votes_buffer',
+        'schedule': datetime.timedelta(seconds=env.int('VOTES_BUFFER_FLUSH_INTERVAL_SEC', 5))
+    },
+    'update-hot-scores': {
+        'task': 'premiers.tasks.update_hot_scores',
+        'schedule': datetime.timedelta(seconds=env.int('PREMIERS_HOT_INTERVAL_SEC', 60))
+    },
+    'expire-direct-uploads': {
+        'task': 'static_content.tasks.expire_direct_uploads',
+        'schedule': datetime.timedelta(seconds=env.int('IMAGE_DIRECT_UPLOAD_CLEANUP_INTERVAL_SEC', 5 * 60))
+    },
 }
 
 # Django Email settings
@@ -312,5 +382,39 @@ ELASTICSEARCH_DSL = {
     },
 }
 
+# Changes are indexed by Celery in background, so requests don't wait for ES
 ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = env.str('ELASTICSEARCH_DSL_SIGNAL_PROCESSOR',
-                                             'django_elasticsearch_dsl.signals.RealTimeSignalProcessor')
+                                             'cxbootcamp_django_example.signals.CelerySignalProcessor')
+
+# ``premiers.search_backends.PostgresSearchBackend`` works without ES
+PREMIERS_SEARCH_BACKEND = env.str('PREMIERS_SEARCH_BACKEND', 'premiers.search_backends.ElasticSearchBackend')
+
+# Search results are cached for a short time, expired ones are still served while search is unavailable
+PREMIERS_SEARCH_CACHE_TIMEOUT = env.int('PREMIERS_SEARCH_CACHE_TIMEOUT_SEC', 30)
+PREMIERS_SEARCH_STALE_TIMEOUT = env.int('PREMIERS_SEARCH_STALE_TIMEOUT_SEC', 600)
+PREMIERS_SEARCH_FALLBACK_BACKEND = env.str('PREMIERS_SEARCH_FALLBACK_BACKEND',
+                                           'premiers.search_backends.PostgresSearchBackend')
+PREMIERS_SEARCH_TIMEOUT = env.float('PREMIERS_SEARCH_TIMEOUT_SEC', 2)
+
+# Search backend is not called for the cooldown time when failure rate in the window reaches the threshold.
+# Calls slower than the slow call time count as failed
+PREMIERS_SEARCH_BREAKER_FAILURE_RATE = env.float('PREMIERS_SEARCH_BREAKER_FAILURE_RATE', 0.5)
+PREMIERS_SEARCH_BREAKER_SLOW_CALL_SEC = env.float('PREMIERS_SEARCH_BREAKER_SLOW_CALL_SEC', 0.5)
+PREMIERS_SEARCH_BREAKER_WINDOW_SEC = env.int('PREMIERS_SEARCH_BREAKER_WINDOW_SEC', 30)
+PREMIERS_SEARCH_BREAKER_MIN_CALLS = env.int('PREMIERS_SEARCH_BREAKER_MIN_CALLS', 10)
+PREMIERS_SEARCH_BREAKER_COOLDOWN_SEC = env.int('PREMIERS_SEARCH_BREAKER_COOLDOWN_SEC', 15)
+
+# Suggestions for prefixes of this length are precomputed in every worker's memory.
+# Workers check whether premiers were changed at most once per refresh interval,
+# and whether their ratings were changed at most once per ratings refresh interval
+PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH = env.int('PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH', 3)
+PREMIERS_SUGGEST_REFRESH_INTERVAL = env.float('PREMIERS_SUGGEST_REFRESH_INTERVAL_SEC', 1)
+PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL = env.float('PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL_SEC', 60)
+# Longer prefixes are suggested by ElasticSearch, the worker doesn't wait for it longer than that
+PREMIERS_SUGGEST_TIMEOUT = env.float('PREMIERS_SUGGEST_TIMEOUT_SEC', 0.2)
+
+# Celery signal processor collects changes for this number of seconds and indexes them by chunks
+SEARCH_INDEX_FLUSH_DELAY = env.int('SEARCH_INDEX_FLUSH_DELAY_SEC', 2)
+SEARCH_INDEX_CHUNK_SIZE = env.int('SEARCH_INDEX_CHUNK_SIZE', 500)
+# Failed flush is retried with exponential backoff up to this delay until ES is back
+SEARCH_INDEX_RETRY_MAX_DELAY = env.int('SEARCH_INDEX_RETRY_MAX_DELAY_SEC', 5 * 60)
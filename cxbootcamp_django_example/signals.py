@@ -1,4 +1,42 @@
+import logging
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.registries import registry
 from django_elasticsearch_dsl.signals import BaseSignalProcessor
+from elasticsearch.helpers import bulk
+
+from cxbootcamp_django_example.redis import get_redis
+
+logger = logging.getLogger("celery")
+
+# Redis sets of ``app_label.Model:pk`` to index and to delete from the index
+INDEX_DIRTY_KEY = 'search:dirty'
+INDEX_DELETED_KEY = 'search:deleted'
+INDEX_FLUSH_SCHEDULED_KEY = 'search:flush-scheduled'
+
+
+def bulk_update_index(model, instances):
+    """Index many instances of the model at once.
+
+    Use it when objects are saved bypassing signals (``bulk_create``, ``update``).
+    If configured signal processor implements ``handle_bulk_save``,
+    it decides what to do. Otherwise, documents are updated with the single bulk request
+    """
+    processor = apps.get_app_config('django_elasticsearch_dsl').signal_processor
+    handler = getattr(processor, 'handle_bulk_save', None)
+    if handler is not None:
+        return handler(model, instances)
+
+    if not DEDConfig.autosync_enabled():
+        return
+
+    for doc in registry.get_documents([model]):
+        if not doc.django.ignore_signals:
+            doc().update(instances)
 
 
 class FakeSignalProcessor(BaseSignalProcessor):
@@ -16,3 +54,117 @@ class FakeSignalProcessor(BaseSignalProcessor):
     def teardown(self):
         # Listen to all model saves.
         pass
+
+    def handle_bulk_save(self, model, instances):
+        pass
+
+
+class CelerySignalProcessor(BaseSignalProcessor):
+    """Asynchronous batched signal processor.
+
+    Saves and deletes only mark ``(model, pk)`` as dirty or deleted in Redis
+    sets after the transaction is committed, so the request doesn't wait for ES and
+    rolled back changes are not indexed. Sets dedupe the changes, and
+    ``flush_search_index`` task sends them to ES with bulk requests a bit later.
+
+    Documents with related models are not supported, as there are none
+    """
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+        if sender in registry.get_models():
+            self._mark(sender, [instance.pk], deleted=False)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if sender in registry.get_models():
+            self._mark(sender, [instance.pk], deleted=True)
+
+    def handle_bulk_save(self, model, instances):
+        if model in registry.get_models():
+            pks = instances.values_list('pk', flat=True) if isinstance(instances, models.QuerySet) \
+                else [instance.pk for instance in instances]
+            self._mark(model, list(pks), deleted=False)
+
+    @staticmethod
+    def _mark(model, pks, deleted):
+        if pks:
+            transaction.on_commit(lambda: mark_for_index(model, pks, deleted))
+
+
+def mark_for_index(model, pks, deleted=False):
+    """Queue objects to be indexed or deleted from index by ``flush_search_index``.
+
+    The flush is scheduled once per ``SEARCH_INDEX_FLUSH_DELAY``,
+    all the changes made meanwhile go to the same bulk requests
+    """
+    members = [f'{model._meta.label}:{pk}' for pk in pks]
+    add_key, remove_key = (INDEX_DELETED_KEY, INDEX_DIRTY_KEY) if deleted else (INDEX_DIRTY_KEY, INDEX_DELETED_KEY)
+    delay = settings.SEARCH_INDEX_FLUSH_DELAY
+
+    pipe = get_redis().pipeline()
+    pipe.sadd(add_key, *members)
+    pipe.srem(remove_key, *members)
+    pipe.set(INDEX_FLUSH_SCHEDULED_KEY, 1, nx=True, ex=delay + 1)
+    *_, scheduled = pipe.execute()
+    if scheduled:
+        flush_search_index.apply_async(countdown=delay)
+
+
+def _group_by_model(members):
+    pks_by_model = {}
+    for member in members:
+        label, pk = member.decode().rsplit(':', 1)
+        pks_by_model.setdefault(apps.get_model(label), []).append(int(pk))
+    return pks_by_model
+
+
+def _delete_from_index(model, pks):
+    for doc in registry.get_documents([model]):
+        actions = [{'_op_type': 'delete', '_index': doc._index._name, '_id': pk} for pk in pks]
+        # Objects may be not indexed yet, so 404 is fine
+        bulk(doc._get_connection(), actions, raise_on_error=False)
+
+
+def _update_index(model, pks):
+    for doc in registry.get_documents([model]):
+        # Object deleted meanwhile is not found here, and its deletion is queued
+        doc().update(doc().get_queryset().filter(pk__in=pks))
+
+
+@shared_task(bind=True, max_retries=None)
+def flush_search_index(self, chunk_size=None):
+    """Apply queued changes to ES. One bulk request is sent per chunk of objects of each document.
+
+    If ES fails, the chunk is returned to the queue and the flush is retried. Nothing else
+    schedules it until the objects are changed again, so it's retried until ES is back
+    """
+    chunk_size = chunk_size or settings.SEARCH_INDEX_CHUNK_SIZE
+    client = get_redis()
+    client.delete(INDEX_FLUSH_SCHEDULED_KEY)
+
+    counts = {}
+    for key, apply in ((INDEX_DELETED_KEY, _delete_from_index), (INDEX_DIRTY_KEY, _update_index)):
+        counts[key] = 0
+        while True:
+            members = client.spop(key, chunk_size)
+            if not members:
+                break
+            try:
+                for model, pks in _group_by_model(members).items():
+                    apply(model, pks)
+            except Exception as e:
+                client.sadd(key, *members)
+                countdown = min(settings.SEARCH_INDEX_FLUSH_DELAY * 2 ** self.request.retries,
+                                settings.SEARCH_INDEX_RETRY_MAX_DELAY)
+                raise self.retry(exc=e, countdown=countdown)
+            counts[key] += len(members)
+
+    if any(counts.values()):
+        logger.info(f"Indexed {counts[INDEX_DIRTY_KEY]} and deleted {counts[INDEX_DELETED_KEY]} objects")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PremiersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'premiers'
+
+    def ready(self):
+        # Connect signal receivers
+        from premiers import signals  # noqa: F401
@@ -0,0 +1,62 @@
+import hashlib
+
+from cxbootcamp_django_example.cache import get_generation, bump_generation
+
+PREMIER_LIST_CACHE = 'premiers:list'
+
+
+def get_premier_list_cache_key(request):
+    """Cache key of premiers list response.
+
+    It depends on API version, absolute url (links in response are absolute)
+    and query params regardless of their order
+    """
+    query = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    url = request.build_absolute_uri(request.path)
+    digest = hashlib.md5(f'{url}?{query}'.encode()).hexdigest()  # nosec
+    return f'{PREMIER_LIST_CACHE}:{request.version}:{get_generation(PREMIER_LIST_CACHE)}:{digest}'
+
+
+def invalidate_premier_list_cache():
+    bump_generation(PREMIER_LIST_CACHE)
+
+
+PREMIER_SUGGEST_CACHE = 'premiers:suggest'
+
+
+def get_premier_suggest_generation():
+    return get_generation(PREMIER_SUGGEST_CACHE)
+
+
+def invalidate_premier_suggestions():
+    """In-process prefix indices of all the workers are rebuilt on the next suggestion"""
+    bump_generation(PREMIER_SUGGEST_CACHE)
+
+
+PREMIER_SUGGEST_RATINGS_CACHE = 'premiers:suggest:ratings'
+
+
+def get_premier_suggest_ratings_generation():
+    return get_generation(PREMIER_SUGGEST_RATINGS_CACHE)
+
+
+def invalidate_premier_suggest_ratings():
+    """Ratings order the suggestions, but change on every vote. So prefix indices
+    are rebuilt for them at most once per ``PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL``
+    """
+    bump_generation(PREMIER_SUGGEST_RATINGS_CACHE)
+
+
+PREMIER_SEARCH_CACHE = 'premiers:search'
+
+
+def get_search_cache_key(phrase, params):
+    """Phrases which differ in case and spaces only share the cache entry"""
+    phrase = ' '.join(phrase.casefold().split())
+    digest = hashlib.md5(f'{phrase}:{sorted(params.items())}'.encode()).hexdigest()  # nosec
+    return f'{PREMIER_SEARCH_CACHE}:{get_generation(PREMIER_SEARCH_CACHE)}:{digest}'
+
+
+def invalidate_search_cache():
+    """Called when the whole index is rebuilt"""
+    bump_generation(PREMIER_SEARCH_CACHE)
@@ -1,4 +1,4 @@
-from django_elasticsearch_dsl import Index, Document
+from django_elasticsearch_dsl import Document, Index, fields
 
 from premiers.models import Premier
 
@@ -9,7 +9,31 @@ premiers.settings(number_of_shards=1, number_of_replicas=0)
 
 @premiers.doc_type
 class ItemDocument(Document):
+    """Document carries everything search results are filtered, sorted and rendered by,
+    so search doesn't touch the DB.
+
+    Rating is changed by votes bypassing model signals, so premier
+    is reindexed by ``Premier.ratings_changed`` as well
+    """
+    # Search results are read from the index, id is also the sort tiebreaker
+    id = fields.IntegerField()
+    user_id = fields.IntegerField()
+    rating = fields.IntegerField(attr='rating_sum')
+    # Typeahead, see ``ElasticSearchBackend.suggest``
+    name_suggest = fields.CompletionField()
 
     class Django:
         model = Premier
-        fields = ('name', 'description')
+        fields = ('name', 'description', 'is_active', 'premier_at', 'url')
+
+    def prepare_name_suggest(self, instance):
+        """Every word of the name starts an input, so ``mat`` suggests ``The Matrix``.
+        Inactive premiers are not suggested, the top rated ones go first
+        """
+        if not instance.is_active:
+            return None
+        words = instance.name.split()
+        return {
+            'input': [' '.join(words[i:]) for i in range(len(words))],
+            'weight': max(instance.rating_sum, 0),
+        }
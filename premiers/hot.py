@@ -0,0 +1,126 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cxbootcamp_django_example.redis import get_redis
+from premiers.cache import invalidate_premier_list_cache
+from premiers.models import Premier
+
+HOT_SCORE_KEY = 'premiers:hot'
+
+# Votes older than this number of half-lives add less than 1 / 2^20 of their rating
+HORIZON_HALF_LIVES = 20
+
+# Scores double every half-life after the epoch. When the epoch is that number of half-lives old,
+# scores are rescaled to the new epoch, so they never overflow
+REBASE_HALF_LIVES = 64
+
+# Scores that decayed below it are set to 0 on rebase
+ZERO_THRESHOLD = 1e-6
+
+# Every vote adds ``rating * 2 ^ ((created_at - epoch) / half_life)``. It's the vote decayed
+# by its age ``2 ^ (-age / half_life)`` times ``2 ^ ((now - epoch) / half_life)``, which is the same
+# for all premiers. So the scores are ordered as the decayed ones, but don't change as time goes,
+# and only premiers with new votes are updated.
+# Votes are read by ``created_at``, which is set when the voting transaction starts, so a vote may
+# appear some time after its ``created_at``. Votes older than ``settled_until`` are added
+# to ``hot_score_base`` once and for all, the newer (fresh) ones are summed from scratch on each run
+# on top of it. So the vote committed late, but before ``created_at`` becomes settled, is counted
+# exactly once. Only votes after the previous ``settled_until`` are read.
+# Premiers that got new votes are marked as updated, so the premiers list ETag changes.
+UPDATE_HOT_SCORES_SQL = """
+WITH new_votes AS (
+    SELECT object_id,
+           COALESCE(SUM(rating * POWER(2, EXTRACT(EPOCH FROM created_at - %(epoch)s) / %(half_life)s))
+               FILTER (WHERE created_at < %(settled_until)s), 0) AS settled,
+           COALESCE(SUM(rating * POWER(2, EXTRACT(EPOCH FROM created_at - %(epoch)s) / %(half_life)s))
+               FILTER (WHERE created_at >= %(settled_until)s), 0) AS fresh
+    FROM votes
+    WHERE content_type_id = %(content_type_id)s
+      AND created_at >= %(settled_since)s
+    GROUP BY object_id
+)
+UPDATE premiers
+SET hot_score_base = premiers.hot_score_base + new_votes.settled,
+    hot_score = premiers.hot_score_base + new_votes.settled + new_votes.fresh,
+    last_updated_at = NOW()
+FROM new_votes
+WHERE premiers.id = new_votes.object_id AND premiers.is_active
+"""
+
+REBASE_HOT_SCORES_SQL = """
+UPDATE premiers
+SET hot_score = CASE WHEN ABS(hot_score * %(factor)s) < %(threshold)s THEN 0 ELSE hot_score * %(factor)s END,
+    hot_score_base = CASE
+        WHEN ABS(hot_score_base * %(factor)s) < %(threshold)s THEN 0 ELSE hot_score_base * %(factor)s
+    END
+WHERE hot_score != 0 OR hot_score_base != 0
+"""
+
+RESET_HOT_SCORES_SQL = """
+UPDATE premiers SET hot_score = 0, hot_score_base = 0 WHERE hot_score != 0 OR hot_score_base != 0
+"""
+
+
+def update_hot_scores(now=None):
+    """Add the votes since the last run to ``Premier.hot_score`` of active premiers.
+
+    The watermark (the epoch of the scores and the time votes are settled until) is kept in Redis.
+    Without it the scores are recalculated from scratch with all the votes within the horizon.
+    Votes newer than ``PREMIERS_HOT_SETTLE_LAG`` are recomputed on each run, so running
+    the update twice gives the same scores. Changed votes keep their ``created_at``,
+    so re-voting doesn't affect the hot score.
+
+    :return: the number of updated premiers or ``None`` if another update is running
+    """
+    now = now or timezone.now()
+    half_life = settings.PREMIERS_HOT_HALF_LIFE
+    horizon = now - datetime.timedelta(seconds=half_life * HORIZON_HALF_LIVES)
+    client = get_redis()
+
+    lock = client.lock(f'{HOT_SCORE_KEY}:lock', timeout=60)
+    if not lock.acquire(blocking=False):
+        return None
+
+    try:
+        watermark = client.hgetall(HOT_SCORE_KEY)
+        with transaction.atomic(), connection.cursor() as cursor:
+            if b'epoch' in watermark:
+                epoch = datetime.datetime.fromtimestamp(float(watermark[b'epoch']), datetime.timezone.utc)
+                settled_since = max(horizon, datetime.datetime.fromtimestamp(float(watermark[b'settled_until']),
+                                                                             datetime.timezone.utc))
+            else:
+                cursor.execute(RESET_HOT_SCORES_SQL)
+                epoch, settled_since = now, horizon
+
+            age = (now - epoch).total_seconds()
+            if age >= half_life * REBASE_HALF_LIVES:
+                cursor.execute(REBASE_HOT_SCORES_SQL, {'factor': 2 ** (-age / half_life), 'threshold': ZERO_THRESHOLD})
+                epoch = now
+
+            # Settled time never goes back, even if the lag is increased
+            settled_until = max(now - datetime.timedelta(seconds=settings.PREMIERS_HOT_SETTLE_LAG), settled_since)
+            cursor.execute(UPDATE_HOT_SCORES_SQL, {
+                'epoch': epoch,
+                'half_life': half_life,
+                'content_type_id': ContentType.objects.get_for_model(Premier).id,
+                'settled_since': settled_since,
+                'settled_until': settled_until,
+            })
+            updated = cursor.rowcount
+
+        client.hset(HOT_SCORE_KEY, mapping={'epoch': epoch.timestamp(), 'settled_until': settled_until.timestamp()})
+    finally:
+        lock.release()
+
+    if updated:
+        invalidate_premier_list_cache()
+    return updated
+
+
+def reset_hot_scores():
+    """Drop the watermark, so the next update recalculates scores from scratch"""
+    get_redis().delete(HOT_SCORE_KEY)
@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch.helpers import bulk
+
+from premiers.documents import ItemDocument, premiers
+from premiers.models import Premier
+from premiers.search_backends import ElasticSearchBackend, PostgresSearchBackend
+
+WORDS = (
+    'matrix', 'revolution', 'galaxy', 'love', 'night', 'shadow', 'empire', 'dragon', 'river', 'storm',
+    'winter', 'secret', 'king', 'queen', 'city', 'ghost', 'ocean', 'fire', 'dream', 'legend',
+    'hunter', 'star', 'war', 'island', 'machine', 'garden', 'heart', 'mountain', 'silence', 'journey',
+)
+
+
+class Command(BaseCommand):
+    help = "Compare latency of ElasticSearch and Postgres search backends on the same synthetic premiers. " \
+           "Synthetic data is rolled back and the temporary index is deleted after the run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--premiers', type=int, default=10000, help="The number of synthetic premiers")
+        parser.add_argument('--queries', type=int, default=200, help="The number of search queries per backend")
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        random.seed(42)
+        phrases = [' '.join(random.sample(WORDS, random.randint(1, 2))) for _ in range(options['queries'])]  # nosec
+
+        with transaction.atomic():
+            objs = Premier.objects.bulk_create((self._make_premier(i) for i in range(options['premiers'])),
+                                               batch_size=1000, index=False)
+            self.stdout.write(f"Created {len(objs)} premiers")
+
+            self._run('Postgres', PostgresSearchBackend(), phrases, options['page_size'])
+
+            index_name = f'benchmark-{premiers._name}-{timezone.now():%Y%m%d%H%M%S}'
+            try:
+                self._create_index(index_name, objs)
+            except ESConnectionError:
+                self.stdout.write(self.style.WARNING("ElasticSearch is not available, skipped"))
+            else:
+                try:
+                    self._run('ElasticSearch', ElasticSearchBackend(index=index_name), phrases, options['page_size'])
+                finally:
+                    ItemDocument._get_connection().indices.delete(index=index_name)
+
+            transaction.set_rollback(True)
+
+    def _make_premier(self, i):
+        name = ' '.join(random.sample(WORDS, 3)).title()  # nosec
+        description = ' '.join(random.choices(WORDS, k=30))  # nosec
+        return Premier(name=f'{name} {i}', description=description, is_active=True, premier_at=timezone.now())
+
+    def _create_index(self, index_name, objs):
+        client = ItemDocument._get_connection()
+        premiers.clone(index_name).create(using=client)
+        actions = ({**action, '_index': index_name} for action in ItemDocument()._get_actions(objs, 'index'))
+        bulk(client, actions, chunk_size=1000)
+        client.indices.refresh(index=index_name)
+
+    def _run(self, title, backend, phrases, page_size):
+        timings = []
+        for phrase in phrases:
+            start = time.perf_counter()
+            backend.search(phrase, limit=page_size)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f"{title:<15} p50 {percentiles[49]:7.2f} ms, p95 {percentiles[94]:7.2f} ms, "
+            f"p99 {percentiles[98]:7.2f} ms, {len(timings) / (sum(timings) / 1000):7.0f} queries/sec"
+        )
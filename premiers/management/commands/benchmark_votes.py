@@ -0,0 +1,79 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from authentication.models import User
+from cxbootcamp_django_example.redis import get_redis
+from premiers.models import Premier
+from premiers.votes import VoteBuffer, upsert_votes
+
+
+class Command(BaseCommand):
+    help = "Compare throughput of writing votes directly to DB and through Redis buffer. " \
+           "Synthetic data is rolled back after the run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votes', type=int, default=5000, help="The number of votes to write")
+        parser.add_argument('--premiers', type=int, default=10, help="The number of premiers to vote for")
+        parser.add_argument('--batch-size', type=int, default=settings.VOTES_BUFFER_BATCH_SIZE,
+                            help="The number of votes flushed by one query")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            votes = self._create_votes(options['votes'], options['premiers'])
+
+            savepoint = transaction.savepoint()
+            self._report('Direct (upsert_votes per vote)', len(votes), self._write_directly(votes))
+            transaction.savepoint_rollback(savepoint)
+
+            buffer = VoteBuffer(prefix='benchmark:premiers:votes')
+            try:
+                push_time = self._push(buffer, votes)
+                self._report('Buffered: push to Redis (request path)', len(votes), push_time)
+
+                start = time.perf_counter()
+                buffer.flush(batch_size=options['batch_size'])
+                flush_time = time.perf_counter() - start
+                self._report('Buffered: flush to DB', len(votes), flush_time)
+                self._report('Buffered: total', len(votes), push_time + flush_time)
+            finally:
+                get_redis().delete(buffer.queue_key, buffer.pending_key)
+
+            transaction.set_rollback(True)
+
+    def _create_votes(self, votes_count, premiers_count):
+        """Create users and premiers. Every user votes for every premier once"""
+        users_count = -(-votes_count // premiers_count)
+        users = User.objects.bulk_create(
+            User(email=f'benchmark-{i}@example.com', password='!') for i in range(users_count)  # nosec
+        )
+        premiers = Premier.objects.bulk_create(
+            (Premier(name=f'Benchmark {i}', is_active=True, premier_at=timezone.now()) for i in range(premiers_count)),
+            index=False
+        )
+        content_type_id = ContentType.objects.get_for_model(Premier).id
+
+        votes = [(user.id, content_type_id, premier.id, random.choice((-1, 1)))  # nosec
+                 for user in users for premier in premiers][:votes_count]
+        random.shuffle(votes)
+        return votes
+
+    def _write_directly(self, votes):
+        start = time.perf_counter()
+        for user_id, _, object_id, rating in votes:
+            upsert_votes(Premier, [(user_id, object_id, rating)])
+        return time.perf_counter() - start
+
+    def _push(self, buffer, votes):
+        start = time.perf_counter()
+        for vote in votes:
+            buffer.push(*vote)
+        return time.perf_counter() - start
+
+    def _report(self, title, count, seconds):
+        self.stdout.write(f"{title:<45} {count / seconds:>10.0f} votes/sec ({seconds:.2f} sec)")
@@ -0,0 +1,24 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from rest_framework.exceptions import ValidationError
+
+from premiers.models import Premier
+from static_content.utils import resize_image, save_variants
+
+
+class Command(BaseCommand):
+    help = "Generate responsive variants of premiers logos uploaded before variants were precomputed"
+
+    def handle(self, *args, **options):
+        names = Premier.objects.exclude(logo='').exclude(logo__isnull=True).values_list('logo', flat=True).distinct()
+        generated = 0
+        for name in names.iterator():
+            try:
+                with default_storage.open(name) as f:
+                    save_variants(resize_image(f), name)
+            except (OSError, ValidationError) as e:
+                self.stderr.write(f"Skipped {name}: {e}")
+            else:
+                generated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Generated variants of {generated} logos"))
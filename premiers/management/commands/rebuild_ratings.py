@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from premiers.models import Premier, Comment
+
+
+class Command(BaseCommand):
+    help = "Recalculate denormalized rating counters of premiers and comments from votes"
+
+    def handle(self, *args, **options):
+        for model in (Premier, Comment):
+            updated = model.rebuild_ratings()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings of {updated} {model._meta.verbose_name_plural}"))
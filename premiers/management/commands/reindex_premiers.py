@@ -0,0 +1,150 @@
+import itertools
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from elasticsearch.helpers import bulk, parallel_bulk, scan
+
+from cxbootcamp_django_example.redis import get_redis
+from premiers.cache import invalidate_search_cache
+from premiers.documents import ItemDocument, premiers
+
+CHECKPOINT_KEY = 'search:reindex:premiers'
+
+
+class Command(BaseCommand):
+    help = "Rebuild premiers index without downtime. New timestamped index is filled " \
+           "by parallel bulk requests, then the alias is switched to it in one request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="The number of documents in bulk request")
+        parser.add_argument('--workers', type=int, default=4, help="The number of parallel bulk requests")
+        parser.add_argument('--shards', type=int, help="The number of shards of the new index")
+        parser.add_argument('--replicas', type=int, help="The number of replicas of the new index")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue interrupted reindex from the last indexed premier")
+        parser.add_argument('--keep-old', action='store_true', help="Don't delete previous indices")
+
+    def handle(self, *args, **options):
+        self.client = ItemDocument._get_connection()
+        alias = premiers._name
+
+        if options['resume']:
+            index_name, last_pk, started_at = self._load_checkpoint()
+            self.stdout.write(f"Resuming {index_name} from premier {last_pk}")
+        else:
+            index_name, last_pk, started_at = f'{alias}-{timezone.now():%Y%m%d%H%M%S}', 0, timezone.now()
+            self._create_index(index_name, options['shards'], options['replicas'])
+            self._save_checkpoint(index_name, last_pk, started_at)
+
+        # Refresh and replicas are expensive during bulk load, they are set after it
+        self.client.indices.put_settings(index=index_name, body={'refresh_interval': '-1', 'number_of_replicas': 0})
+
+        start = time.perf_counter()
+        queryset = ItemDocument().get_queryset().filter(pk__gt=last_pk).order_by('pk')
+        indexed = self._index(queryset, index_name, started_at, options['chunk_size'], options['workers'])
+        seconds = time.perf_counter() - start
+
+        replicas = options['replicas']
+        self.client.indices.put_settings(index=index_name, body={
+            'refresh_interval': premiers._settings.get('refresh_interval', '1s'),
+            'number_of_replicas': premiers._settings.get('number_of_replicas', 1) if replicas is None else replicas,
+        })
+        self.client.indices.refresh(index=index_name)
+
+        old_indices = self._switch_alias(alias, index_name)
+        invalidate_search_cache()
+
+        # Premiers changed during reindex could be indexed into the old index only
+        changed = ItemDocument().get_queryset().filter(last_updated_at__gte=started_at)
+        self._bulk(ItemDocument()._get_actions(changed.iterator(), 'index'), index_name, options['workers'],
+                   options['chunk_size'])
+        deleted = self._delete_missing(index_name, options['chunk_size'])
+
+        if not options['keep_old'] and old_indices:
+            self.client.indices.delete(index=','.join(old_indices))
+        get_redis().delete(CHECKPOINT_KEY)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} premiers into {index_name} in {seconds:.1f} sec "
+            f"({indexed / max(seconds, 0.001):.0f} docs/sec), {deleted} deleted meanwhile, alias {alias} switched"
+        ))
+
+    def _create_index(self, index_name, shards, replicas):
+        index = premiers.clone(index_name)
+        index_settings = {}
+        if shards is not None:
+            index_settings['number_of_shards'] = shards
+        if replicas is not None:
+            index_settings['number_of_replicas'] = replicas
+        index.settings(**index_settings)
+        index.create(using=self.client)
+
+    def _index(self, queryset, index_name, started_at, chunk_size, workers):
+        """Rows are streamed with server-side cursor. After every round of ``workers`` chunks
+        the last indexed pk is saved, so crashed reindex is resumed from it
+        """
+        doc = ItemDocument()
+        rows = queryset.iterator(chunk_size=chunk_size)
+        indexed = 0
+        while True:
+            batch = list(itertools.islice(rows, chunk_size * workers))
+            if not batch:
+                return indexed
+
+            self._bulk(doc._get_actions(batch, 'index'), index_name, workers, chunk_size)
+            indexed += len(batch)
+            self._save_checkpoint(index_name, batch[-1].pk, started_at)
+            self.stdout.write(f"Indexed {indexed} premiers, the last one is {batch[-1].pk}")
+
+    def _bulk(self, actions, index_name, workers, chunk_size):
+        actions = ({**action, '_index': index_name} for action in actions)
+        for ok, info in parallel_bulk(self.client, actions, thread_count=workers, chunk_size=chunk_size):
+            if not ok:
+                raise CommandError(f"Failed to index premier: {info}")
+
+    def _delete_missing(self, index_name, chunk_size):
+        """Premiers deleted during reindex were deleted from the old index only. Their documents
+        are found by the diff of indexed ids with the DB. Ids are scanned before the DB is read,
+        so premiers created meanwhile are not deleted
+        """
+        indexed = {int(hit['_id']) for hit in scan(self.client, index=index_name, query={'_source': False},
+                                                   size=chunk_size)}
+        existing = set(ItemDocument().get_queryset().values_list('pk', flat=True).iterator(chunk_size=chunk_size))
+        missing = sorted(indexed - existing)
+
+        # Deletions flushed after the alias switch may be ahead of us, so 404 is fine
+        actions = ({'_op_type': 'delete', '_index': index_name, '_id': pk} for pk in missing)
+        bulk(self.client, actions, chunk_size=chunk_size, raise_on_error=False)
+        return len(missing)
+
+    def _switch_alias(self, alias, index_name):
+        """Alias is moved in one request, so search never sees missing or half-filled index.
+
+        If old index has the same name as alias (created by ``search_index``), it's removed
+        in the same request
+        """
+        old_indices = [name for name in self.client.indices.get(index=alias, ignore_unavailable=True)
+                       if name != index_name]
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        if alias in old_indices:
+            actions.insert(0, {'remove_index': {'index': alias}})
+            old_indices.remove(alias)
+        else:
+            actions.extend({'remove': {'index': name, 'alias': alias}} for name in old_indices)
+
+        self.client.indices.update_aliases(body={'actions': actions})
+        return old_indices
+
+    def _save_checkpoint(self, index_name, last_pk, started_at):
+        get_redis().hset(CHECKPOINT_KEY, mapping={
+            'index': index_name, 'last_pk': last_pk, 'started_at': started_at.isoformat(),
+        })
+
+    def _load_checkpoint(self):
+        checkpoint = get_redis().hgetall(CHECKPOINT_KEY)
+        if not checkpoint:
+            raise CommandError("There is no interrupted reindex to resume")
+        return (checkpoint[b'index'].decode(), int(checkpoint[b'last_pk']),
+                datetime.fromisoformat(checkpoint[b'started_at'].decode()))
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_counters(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Vote = apps.get_model('premiers', 'Vote')
+
+    for model_name in ('premier', 'comment'):
+        content_type = ContentType.objects.filter(app_label='premiers', model=model_name).first()
+        if content_type is None:
+            continue
+
+        votes = Vote.objects.filter(
+            content_type=content_type, object_id=OuterRef('pk')
+        ).order_by().values('object_id')
+        apps.get_model('premiers', model_name).objects.update(
+            rating_sum=Coalesce(Subquery(votes.annotate(total=Sum('rating')).values('total')), 0),
+            vote_count=Coalesce(Subquery(votes.annotate(total=Count('id')).values('total')), 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('premiers', '0003_comment_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False, help_text='The total sum of votes ratings'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of votes'),
+        ),
+        migrations.AddField(
+            model_name='premier',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False, help_text='The total sum of votes ratings'),
+        ),
+        migrations.AddField(
+            model_name='premier',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of votes'),
+        ),
+        migrations.AddIndex(
+            model_name='premier',
+            index=models.Index(fields=['rating_sum'], name='premiers_rating__24ad35_idx'),
+        ),
+        migrations.RunPython(fill_rating_counters, migrations.RunPython.noop),
+    ]
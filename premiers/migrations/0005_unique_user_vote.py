@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:08
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Duplicated votes are recalculated the same way as counters were filled
+fill_rating_counters = import_module('premiers.migrations.0004_rating_counters').fill_rating_counters
+
+# Keep the latest vote of the user for the object
+DELETE_DUPLICATED_VOTES = """
+DELETE FROM votes USING votes AS newer
+WHERE votes.user_id = newer.user_id
+  AND votes.content_type_id = newer.content_type_id
+  AND votes.object_id = newer.object_id
+  AND votes.id < newer.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('premiers', '0004_rating_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATED_VOTES, migrations.RunSQL.noop),
+        migrations.RunPython(fill_rating_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='unique_user_vote'),
+        ),
+    ]
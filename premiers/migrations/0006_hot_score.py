@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('premiers', '0005_unique_user_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='premier',
+            name='hot_score',
+            field=models.FloatField(default=0, editable=False, help_text='Time-decayed sum of votes, see ``premiers.hot.update_hot_scores``'),
+        ),
+        migrations.AddIndex(
+            model_name='premier',
+            index=models.Index(fields=['hot_score', 'id'], name='premiers_hot_sco_aa8c28_idx'),
+        ),
+    ]
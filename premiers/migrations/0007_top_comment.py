@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:16
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_top_comment(apps, schema_editor):
+    Premier = apps.get_model('premiers', 'Premier')
+    Comment = apps.get_model('premiers', 'Comment')
+
+    top_comment = Comment.objects.filter(premier_id=OuterRef('pk')).order_by('-rating_sum', '-id').values('id')
+    Premier.objects.update(top_comment=Subquery(top_comment[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('premiers', '0006_hot_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='premier',
+            name='top_comment',
+            field=models.ForeignKey(blank=True, editable=False, help_text='The comment with the highest rating, see ``refresh_top_comment``', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='premiers.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['premier', 'rating_sum'], name='premier_com_premier_9e9cf0_idx'),
+        ),
+        migrations.RunPython(fill_top_comment, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:25
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Name matches weigh more than description ones. Trigger fires only when these columns are written
+CREATE_SEARCH_VECTOR_TRIGGER = """
+CREATE FUNCTION premiers_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('pg_catalog.english', COALESCE(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('pg_catalog.english', COALESCE(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER premiers_search_vector_update
+BEFORE INSERT OR UPDATE OF name, description ON premiers
+FOR EACH ROW EXECUTE PROCEDURE premiers_search_vector_update();
+
+UPDATE premiers SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER premiers_search_vector_update ON premiers;
+DROP FUNCTION premiers_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('premiers', '0007_top_comment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='premier',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Weighted name and description, maintained by DB trigger', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='premier',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='premiers_search__9bb8d0_gin'),
+        ),
+        migrations.RunSQL(CREATE_SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
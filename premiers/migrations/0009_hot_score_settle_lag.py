@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('premiers', '0008_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='premier',
+            name='hot_score_base',
+            field=models.FloatField(default=0, editable=False, help_text='Part of ``hot_score`` made by settled votes'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['content_type', 'created_at'], name='votes_content_d37766_idx'),
+        ),
+    ]
@@ -1,11 +1,17 @@
-import uuid
-
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Now
 from django.utils.text import slugify
 
+from cxbootcamp_django_example.signals import bulk_update_index
+from premiers.cache import (
+    invalidate_premier_list_cache, invalidate_premier_suggest_ratings, invalidate_premier_suggestions
+)
 from static_content.utils import upload_to
 
 
@@ -24,12 +30,157 @@ class Vote(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, editable=False)
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    _tracked_fields = ('content_type_id', 'object_id', 'rating')
+
     class Meta:
         db_table = 'votes'
         ordering = ('-id',)
+        constraints = [
+            # User votes for the object only once, then the vote can be changed
+            models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='unique_user_vote'),
+        ]
+        indexes = [
+            # New votes are read by hot score update
+            models.Index(fields=['content_type', 'created_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded values. When vote is changed or deleted
+        we need to know what exactly to subtract from rating counters
+        """
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if all(name in loaded for name in cls._tracked_fields):
+            instance._loaded_values = {name: loaded[name] for name in cls._tracked_fields}
+        return instance
+
+
+class RatedModel(models.Model):
+    """Abstract model for objects users can vote for.
+
+    Rating counters are denormalized from ``Vote`` table, so reading
+    the rating is just a column read. Subclasses must have ``last_updated_at`` field. Counters are maintained
+    by signals in ``premiers.signals`` and can be repaired with
+    ``python manage.py rebuild_ratings``
+    """
+    rating_sum = models.IntegerField(default=0, editable=False, help_text="The total sum of votes ratings")
+    vote_count = models.PositiveIntegerField(default=0, editable=False, help_text="The number of votes")
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def apply_votes(cls, object_id, rating_delta, count_delta):
+        """Atomically shift rating counters of the object.
+
+        F-expressions make the DB do the math, so concurrent votes
+        do not overwrite each other. As rating is the part of object,
+        ``last_updated_at`` is touched the same way ``auto_now`` does on save
+        """
+        updated = cls.objects.filter(pk=object_id).update(
+            rating_sum=F('rating_sum') + rating_delta,
+            vote_count=F('vote_count') + count_delta,
+            last_updated_at=Now(),
+        )
+        cls.ratings_changed([object_id])
+        return updated
+
+    @classmethod
+    def rebuild_ratings(cls, queryset=None):
+        """Recalculate rating counters from ``Vote`` table.
+
+        This is the only place where votes are aggregated, it's done
+        for all the objects in one UPDATE query with subqueries
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        votes = Vote.objects.filter(
+            content_type=ContentType.objects.get_for_model(cls),
+            object_id=OuterRef('pk')
+        ).order_by().values('object_id')
+
+        updated = queryset.update(
+            rating_sum=Coalesce(Subquery(votes.annotate(total=Sum('rating')).values('total')), 0),
+            vote_count=Coalesce(Subquery(votes.annotate(total=Count('id')).values('total')), 0),
+        )
+        cls.ratings_changed(queryset.values('pk'))
+        return updated
+
+    @classmethod
+    def get_votable_queryset(cls):
+        """Objects users can vote for, votes for the others are skipped by ``upsert_votes``"""
+        return cls._default_manager.all()
+
+    @classmethod
+    def ratings_changed(cls, object_ids):
+        """Hook to update data which depends on the rating of the objects
+
+        :param object_ids: list or queryset of the changed objects ids
+        """
+
 
+class PremierQuerySet(models.QuerySet):
 
-class Premier(models.Model):
+    def reserve_ids(self, count):
+        """Take ``count`` ids from the table's sequence in one query.
+
+        Knowing the id before INSERT we can build the slug url
+        and write the row only once
+        """
+        table = self.model._meta.db_table
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [table, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def bulk_create(self, objs, *args, index=True, **kwargs):
+        """Create premiers with 2 queries no matter how many of them are there.
+
+        Ids for the new premiers are reserved in advance, so urls are built before insert.
+        As ``bulk_create`` doesn't send signals, premiers are indexed
+        in ElasticSearch with one bulk request as well (unless ``index=False``),
+        and cached list is invalidated here
+        """
+        objs = list(objs)
+        new_objs = [obj for obj in objs if obj.id is None]
+        if new_objs:
+            for obj, reserved_id in zip(new_objs, self.reserve_ids(len(new_objs))):
+                obj.id = reserved_id
+                obj.url = obj._build_url()
+                obj._loaded_name = obj.name
+
+        created = super().bulk_create(objs, *args, **kwargs)
+        if index:
+            bulk_update_index(self.model, created)
+        invalidate_premier_list_cache()
+        invalidate_premier_suggestions()
+        return created
+
+    def refresh_top_comment(self):
+        """Set the comment with the highest rating as the premier's top comment.
+
+        This is the only place where premier's comments are sorted. It's one UPDATE with
+        correlated subquery for the given premiers only, which is called when their comments
+        or comments' ratings are changed. Premiers are marked as updated, as they are listed with top comment
+        """
+        top_comment = Comment.objects.filter(premier_id=OuterRef('pk')).order_by('-rating_sum', '-id').values('id')
+        return self.update(top_comment=Subquery(top_comment[:1]), last_updated_at=Now())
+
+
+class PremierManager(models.Manager.from_queryset(PremierQuerySet)):
+
+    def get_queryset(self):
+        """``search_vector`` is read only by the DB (see ``PostgresSearchBackend``),
+        so it's not loaded with premiers
+        """
+        return super().get_queryset().defer('search_vector')
+
+
+class Premier(RatedModel):
     user = models.ForeignKey('authentication.User', models.CASCADE, null=True, blank=True,
                              help_text="The user that added the premier")
     name = models.CharField(max_length=255, help_text="The name of the Premier")
@@ -38,6 +189,15 @@ class Premier(models.Model):
     logo = models.ImageField(upload_to=upload_to, null=True, blank=True, help_text="The logo of the Premier")
 
     is_active = models.BooleanField(default=False, help_text="Designates whether to display Premier on web-site or not")
+    top_comment = models.ForeignKey('premiers.Comment', models.SET_NULL, null=True, blank=True, editable=False,
+                                    related_name='+',
+                                    help_text="The comment with the highest rating, see ``refresh_top_comment``")
+    hot_score = models.FloatField(default=0, editable=False,
+                                  help_text="Time-decayed sum of votes, see ``premiers.hot.update_hot_scores``")
+    hot_score_base = models.FloatField(default=0, editable=False,
+                                       help_text="Part of ``hot_score`` made by settled votes")
+    search_vector = SearchVectorField(null=True, editable=False,
+                                      help_text="Weighted name and description, maintained by DB trigger")
 
     premier_at = models.DateTimeField(help_text="The time when the premier is released")
     last_updated_at = models.DateTimeField(auto_now=True)
@@ -45,24 +205,56 @@ class Premier(models.Model):
 
     votes = GenericRelation(Vote, related_query_name='premiers')
 
+    objects = PremierManager()
+
     class Meta:
         db_table = 'premiers'
         indexes = [
-            models.Index(fields=['premier_at'])
+            models.Index(fields=['premier_at']),
+            models.Index(fields=['rating_sum']),
+            models.Index(fields=['hot_score', 'id']),
+            GinIndex(fields=['search_vector']),
         ]
         ordering = ('-id',)
 
-    def save(self, *args, **kwargs):
-        if self.id:
-            self.url = self._build_url()
-        else:
-            self.url = f"rand:{uuid.uuid4()}"
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded name to rebuild url only when name is changed"""
+        instance = super().from_db(db, field_names, values)
+        if 'name' in field_names:
+            instance._loaded_name = instance.name
+        return instance
 
-        super().save(*args, **kwargs)
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """The url is built from id and name (i. e. ``42-the-matrix``).
 
-        if self.url.startswith("rand:"):
+        For the new premier we reserve the id before INSERT, so the row is written once.
+        For the existing one, url is rebuilt only if name was changed
+        """
+        if self._state.adding and self.id is None:
+            self.id = type(self).objects.db_manager(using).reserve_ids(1)[0]
+            self.url = self._build_url()
+            # We know the row doesn't exist, so don't let Django try UPDATE first
+            force_insert = True
+        elif self.name != getattr(self, '_loaded_name', None) and (update_fields is None or 'name' in update_fields):
             self.url = self._build_url()
-            self.save()
+            if update_fields is not None:
+                update_fields = {*update_fields, 'url'}
+
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if update_fields is None or 'name' in update_fields:
+            self._loaded_name = self.name
+
+    @classmethod
+    def get_votable_queryset(cls):
+        """Users vote only for premiers displayed on web-site"""
+        return cls.objects.filter(is_active=True)
+
+    @classmethod
+    def ratings_changed(cls, object_ids):
+        """Rating is indexed in ElasticSearch and orders suggestions"""
+        bulk_update_index(cls, cls.objects.filter(pk__in=object_ids))
+        invalidate_premier_suggest_ratings()
 
     def __str__(self):
         return f"{self.id}, {self.name}"
@@ -71,7 +263,7 @@ class Premier(models.Model):
         return f"{self.id}-{slugify(self.name)}"
 
 
-class Comment(models.Model):
+class Comment(RatedModel):
     user = models.ForeignKey('authentication.User', models.CASCADE,
                              help_text="The user who added a comment")
     premier = models.ForeignKey(Premier, models.CASCADE, help_text="The Premier to add comment to")
@@ -84,3 +276,15 @@ class Comment(models.Model):
     class Meta:
         db_table = 'premier_comments'
         ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['premier', 'rating_sum']),
+        ]
+
+    @classmethod
+    def get_votable_queryset(cls):
+        return cls.objects.filter(premier__is_active=True)
+
+    @classmethod
+    def ratings_changed(cls, object_ids):
+        """Top comment of the premier may be changed"""
+        Premier.objects.filter(pk__in=cls.objects.filter(pk__in=object_ids).values('premier_id')).refresh_top_comment()
@@ -0,0 +1,230 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import DatabaseError, DataError
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+from elasticsearch.exceptions import ElasticsearchException, RequestError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from cxbootcamp_django_example.circuit_breaker import CircuitBreaker
+from premiers.documents import ItemDocument
+from premiers.models import Premier
+from premiers.suggest import SUGGEST_MAX_LIMIT, normalize, prefix_index
+
+logger = logging.getLogger("django")
+
+# Search backend is not called while it's failing or slow, see ``premiers.utils.search``
+# and ``ElasticSearchBackend.suggest``
+search_breaker = CircuitBreaker(
+    failure_rate=settings.PREMIERS_SEARCH_BREAKER_FAILURE_RATE,
+    slow_call_seconds=settings.PREMIERS_SEARCH_BREAKER_SLOW_CALL_SEC,
+    window=settings.PREMIERS_SEARCH_BREAKER_WINDOW_SEC,
+    min_calls=settings.PREMIERS_SEARCH_BREAKER_MIN_CALLS,
+    cooldown=settings.PREMIERS_SEARCH_BREAKER_COOLDOWN_SEC,
+)
+
+# Orderings of search results every backend supports
+SEARCH_ORDERINGS = ('relevance', 'premier_at', '-premier_at', 'rating')
+
+# Fields of search results, see ``PremierSearchSerializer``
+SEARCH_RESULT_FIELDS = ('id', 'url', 'name', 'description', 'user_id', 'rating', 'premier_at')
+
+
+class SearchUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Search is temporarily unavailable, try again later"
+    default_code = 'search_unavailable'
+
+
+class SearchBadRequest(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Search query is invalid"
+    default_code = 'search_bad_request'
+
+
+def get_search_backend():
+    """Backend is selected by ``PREMIERS_SEARCH_BACKEND`` setting"""
+    return import_string(settings.PREMIERS_SEARCH_BACKEND)()
+
+
+def get_search_query(phrase, user_id=None, index=None):
+    """Only the phrase affects the score. Filters go to the filter context,
+    so ES doesn't score them and caches their results
+    """
+    filters = [{"term": {"is_active": True}}]
+    if user_id is not None:
+        filters.append({"term": {"user_id": user_id}})
+
+    query = {
+        "bool": {
+            "must": [
+                {
+                    "multi_match": {
+                        "query": phrase,
+                        "fields": ["name", "description"],
+                        "analyzer": "standard"
+                    }
+                }
+            ],
+            "filter": filters,
+        }
+    }
+    return ItemDocument.search(index=index).query(query)
+
+
+class BaseSearchBackend:
+    """Backend searches active premiers by phrase page by page.
+
+    The first pages are selected with ``offset``, deeper ones with ``search_after`` -
+    sort values of the last result on the previous page, which backend returns.
+    Results are dicts with the fields of ``PremierSearchSerializer``
+    """
+    # Errors which mean the backend is not available
+    errors = ()
+    # Errors caused by the query, the backend is fine. They are checked before ``errors``
+    client_errors = ()
+
+    def search(self, phrase, limit=20, offset=0, search_after=None, ordering='relevance', user_id=None):
+        """:return: dict with total ``count``, ``results`` and ``search_after`` of the next page
+        (``None`` if it's the last page)
+        """
+        raise NotImplementedError
+
+    def suggest(self, prefix, limit=SUGGEST_MAX_LIMIT):
+        """Names of active premiers starting with the prefix, from in-process index (``premiers.suggest``)
+
+        :return: list of ``{'id', 'name', 'url'}``
+        """
+        return prefix_index.suggest(prefix, limit)
+
+
+class ElasticSearchBackend(BaseSearchBackend):
+    """Results are taken from the indexed ``_source``, so the DB is not queried at all"""
+    errors = (ElasticsearchException,)
+    client_errors = (RequestError,)
+
+    # Each sort ends with the unique tiebreaker for ``search_after``
+    orderings = {
+        'relevance': ('_score', {'id': 'desc'}),
+        'premier_at': ({'premier_at': 'asc'}, {'id': 'asc'}),
+        '-premier_at': ({'premier_at': 'desc'}, {'id': 'desc'}),
+        'rating': ({'rating': 'desc'}, {'id': 'desc'}),
+    }
+
+    def __init__(self, index=None):
+        self.index = index
+
+    def search(self, phrase, limit=20, offset=0, search_after=None, ordering='relevance', user_id=None):
+        query = get_search_query(phrase, user_id=user_id, index=self.index).sort(*self.orderings[ordering])
+        # Indexed fields like ``name_suggest`` are not fetched
+        query = query.source(list(SEARCH_RESULT_FIELDS))
+        # Worker doesn't hang on ES longer than that
+        query = query.params(request_timeout=settings.PREMIERS_SEARCH_TIMEOUT)
+        if search_after:
+            query = query.extra(search_after=search_after)[:limit]
+        else:
+            query = query[offset:offset + limit]
+
+        response = query.execute()
+        hits = list(response)
+        return {
+            'count': response.hits.total.value,
+            'results': [hit.to_dict() for hit in hits],
+            'search_after': list(hits[-1].meta.sort) if len(hits) == limit else None,
+        }
+
+    def suggest(self, prefix, limit=SUGGEST_MAX_LIMIT):
+        """Short prefixes are answered from memory. Longer ones - by completion suggester,
+        which knows changes in no time. If ES fails or ``search_breaker`` is open,
+        in-process index is the fallback
+        """
+        prefix = normalize(prefix)
+        if len(prefix) <= settings.PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH or not search_breaker.allow():
+            return super().suggest(prefix, limit)
+
+        query = ItemDocument.search(index=self.index).source(['id', 'name', 'url']).suggest(
+            'names', prefix, completion={'field': 'name_suggest', 'size': limit, 'skip_duplicates': True}
+        )[:0].params(request_timeout=settings.PREMIERS_SUGGEST_TIMEOUT)
+        start = time.monotonic()
+        failed = True
+        try:
+            response = query.execute()
+            failed = False
+        except ElasticsearchException:
+            logger.exception("Suggestions fall back to in-process index")
+            return super().suggest(prefix, limit)
+        finally:
+            search_breaker.record(time.monotonic() - start, failed=failed)
+        return [option._source.to_dict() for option in response.suggest.names[0].options]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Full-text search by ``Premier.search_vector``, which is maintained by DB trigger
+    and backed by GIN index. Needs no ES, i. e. for CI and edge deployments.
+
+    Name matches weigh more than description ones (see migration ``0008_search_vector``)
+    """
+    errors = (DatabaseError,)
+    client_errors = (DataError,)
+    config = 'english'
+
+    # Each ordering ends with the unique tiebreaker for ``search_after``
+    orderings = {
+        'relevance': ('-rank', '-id'),
+        'premier_at': ('premier_at', 'id'),
+        '-premier_at': ('-premier_at', '-id'),
+        'rating': ('-rating', '-id'),
+    }
+
+    def search(self, phrase, limit=20, offset=0, search_after=None, ordering='relevance', user_id=None):
+        query = SearchQuery(phrase, config=self.config, search_type='websearch')
+        queryset = Premier.objects.filter(is_active=True, search_vector=query)
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+
+        count = queryset.count()
+        fields = self.orderings[ordering]
+        # ``ts_rank`` is ``real``, as double it survives the round trip through ``search_after`` token exactly
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        queryset = queryset.annotate(rank=rank, rating=F('rating_sum')).values(
+            *SEARCH_RESULT_FIELDS, 'rank'
+        ).order_by(*fields)
+
+        if search_after:
+            queryset = queryset.filter(self._keyset_filter(fields, search_after))[:limit]
+        else:
+            queryset = queryset[offset:offset + limit]
+
+        results = list(queryset)
+        next_search_after = None
+        if len(results) == limit:
+            last = results[-1]
+            next_search_after = [self._serialize(last[field.lstrip('-')]) for field in fields]
+        for result in results:
+            del result['rank']
+
+        return {'count': count, 'results': results, 'search_after': next_search_after}
+
+    @staticmethod
+    def _keyset_filter(fields, values):
+        """Rows after the given sort values: ``(a, b) > (x, y)`` is ``a > x OR (a = x AND b > y)``"""
+        condition = None
+        for field, value in reversed(list(zip(fields, values))):
+            name = field.lstrip('-')
+            # Dates sorted by ElasticSearch are epoch millis
+            if name == 'premier_at' and not isinstance(value, str):
+                value = datetime.datetime.fromtimestamp(value / 1000, datetime.timezone.utc)
+            after = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+            condition = after if condition is None else after | (Q(**{name: value}) & condition)
+        return condition
+
+    @staticmethod
+    def _serialize(value):
+        # Sort values go to the client in JSON token
+        return value.isoformat() if hasattr(value, 'isoformat') else value
@@ -1,9 +1,14 @@
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Sum
 from rest_framework import serializers
 
 from authentication.models import User
 from premiers import models
+from premiers.search_backends import SEARCH_ORDERINGS
+from premiers.suggest import SUGGEST_MAX_LIMIT
+from premiers.utils import decode_search_after
+from static_content.serializers import ImageFileSerializer
+
+# ElasticSearch ``index.max_result_window``, deeper pages are reached with ``search_after``
+SEARCH_MAX_RESULT_WINDOW = 10000
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,31 +19,92 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class TopCommentSerializer(serializers.ModelSerializer):
+    rating = serializers.IntegerField(source='rating_sum', read_only=True)
+
+    class Meta:
+        model = models.Comment
+        fields = ('id', 'text', 'rating', 'created_at')
+        read_only_fields = fields
+
+
 class PremierSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    rating = serializers.SerializerMethodField()
+
+    # Top comment is maintained by ``PremierQuerySet.refresh_top_comment``, view selects it with premier
+    top_comment = TopCommentSerializer(read_only=True)
+
+    # Rating is denormalized into ``rating_sum`` column, see ``RatedModel``
+    rating = serializers.IntegerField(source='rating_sum', read_only=True)
 
     # But annotated fields should be explicitly set!
     is_future = serializers.BooleanField(read_only=True)
 
+    # Logo with URLs of its responsive variants
+    logo = ImageFileSerializer(read_only=True)
+
     class Meta:
         model = models.Premier
 
         # is_future is our annotated in get_queryset method field
-        fields = ('id', 'url', 'name', 'description', 'user', 'rating', 'is_future', 'premier_at', 'created_at')
-        read_only_fields = ('id', 'url', 'user', 'is_future', 'created_at')
-
-    def get_rating(self, obj: models.Premier) -> float:
-        """This is how aggregation works. In this example
-        we need to calculate and return the total sum of votes of
-        the premier.
-
-        Obviously, we do it using DB aggregation.
-        """
-        obj_type = ContentType.objects.get_for_model(obj)
-        rating = models.Vote.objects.filter(
-            content_type=obj_type,
-            object_id=obj.id
-        ).aggregate(sum=Sum('rating'))['sum']
-
-        return rating
+        fields = ('id', 'url', 'name', 'description', 'logo', 'user', 'rating', 'top_comment', 'is_future',
+                  'premier_at', 'created_at')
+        read_only_fields = ('id', 'url', 'logo', 'user', 'top_comment', 'is_future', 'created_at')
+
+
+class VoteSerializer(serializers.Serializer):
+    rating = serializers.IntegerField(min_value=-1, max_value=1, help_text="The user's vote: -1, 0 or 1")
+
+    # Counters are returned by the same query which writes the vote
+    total_rating = serializers.IntegerField(read_only=True, help_text="The new rating of the voted object")
+    vote_count = serializers.IntegerField(read_only=True, help_text="The new number of votes for the voted object")
+
+
+class PremierSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(help_text="The phrase to search premiers by")
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    offset = serializers.IntegerField(min_value=0, default=0, help_text="The number of results to skip")
+    search_after = serializers.CharField(required=False, help_text="The token from `next` link to get the next page")
+    ordering = serializers.ChoiceField(choices=SEARCH_ORDERINGS, default='relevance')
+    user = serializers.IntegerField(required=False, help_text="Search only premiers added by the user")
+
+    def validate(self, attrs):
+        if attrs['offset'] + attrs['page_size'] > SEARCH_MAX_RESULT_WINDOW:
+            raise serializers.ValidationError(
+                f"Only first {SEARCH_MAX_RESULT_WINDOW} results can be reached by offset, follow `next` links instead"
+            )
+        # Sort values of the token depend on the ordering
+        if 'search_after' in attrs:
+            try:
+                attrs['search_after'] = decode_search_after(attrs['search_after'], attrs['ordering'])
+            except ValueError as e:
+                raise serializers.ValidationError({'search_after': str(e)})
+        return attrs
+
+
+class PremierSearchSerializer(serializers.Serializer):
+    """Search result is built from ElasticSearch document, not from the model"""
+    id = serializers.IntegerField()
+    url = serializers.CharField()
+    name = serializers.CharField()
+    description = serializers.CharField(allow_null=True, required=False)
+    user_id = serializers.IntegerField(allow_null=True, required=False)
+    rating = serializers.IntegerField()
+    premier_at = serializers.DateTimeField()
+
+
+class PremierSearchPageSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    next = serializers.URLField(allow_null=True)
+    results = PremierSearchSerializer(many=True)
+
+
+class PremierSuggestQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(help_text="The beginning of premier name or any of its words")
+    limit = serializers.IntegerField(min_value=1, max_value=SUGGEST_MAX_LIMIT, default=SUGGEST_MAX_LIMIT)
+
+
+class PremierSuggestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    url = serializers.CharField()
@@ -0,0 +1,76 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from premiers.cache import invalidate_premier_list_cache, invalidate_premier_suggestions
+from premiers.models import Vote, RatedModel, Premier, Comment
+
+
+def _get_rated_model(content_type_id):
+    """ContentType caches the lookups, so it doesn't cost a query per vote"""
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model is None or not issubclass(model, RatedModel):
+        return None
+    return model
+
+
+def _apply_votes(content_type_id, object_id, rating_delta, count_delta):
+    model = _get_rated_model(content_type_id)
+    if model is not None:
+        model.apply_votes(object_id, rating_delta, count_delta)
+
+
+@receiver(post_save, sender=Vote)
+def update_rating_on_vote_save(sender, instance: Vote, created, **kwargs):
+    """Keep denormalized rating counters of the voted object up to date"""
+    loaded = getattr(instance, '_loaded_values', None)
+
+    if created:
+        _apply_votes(instance.content_type_id, instance.object_id, instance.rating, 1)
+    elif loaded is None:
+        # We don't know what was stored before, so recalculate the object from scratch
+        model = _get_rated_model(instance.content_type_id)
+        if model is not None:
+            model.rebuild_ratings(model.objects.filter(pk=instance.object_id))
+    elif (loaded['content_type_id'], loaded['object_id']) == (instance.content_type_id, instance.object_id):
+        _apply_votes(instance.content_type_id, instance.object_id, instance.rating - loaded['rating'], 0)
+    else:
+        _apply_votes(loaded['content_type_id'], loaded['object_id'], -loaded['rating'], -1)
+        _apply_votes(instance.content_type_id, instance.object_id, instance.rating, 1)
+
+    instance._loaded_values = {name: getattr(instance, name) for name in Vote._tracked_fields}
+
+
+@receiver(post_delete, sender=Vote)
+def update_rating_on_vote_delete(sender, instance: Vote, **kwargs):
+    """Subtract deleted vote from the rating counters.
+
+    If the vote was changed before deletion, we subtract what was stored in DB
+    """
+    stored = getattr(instance, '_loaded_values', None) or {
+        name: getattr(instance, name) for name in Vote._tracked_fields
+    }
+    _apply_votes(stored['content_type_id'], stored['object_id'], -stored['rating'], -1)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def refresh_top_comment(sender, instance: Comment, **kwargs):
+    """New comment may become the top one, deleted one is replaced by the next.
+    If comment is moved to another premier, the previous premier is refreshed too
+    """
+    Premier.objects.filter(Q(pk=instance.premier_id) | Q(top_comment_id=instance.id)).refresh_top_comment()
+
+
+@receiver([post_save, post_delete], sender=Premier)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Vote)
+def invalidate_premier_list(sender, **kwargs):
+    """Premiers list is cached, so we drop it when premiers or their ratings change"""
+    invalidate_premier_list_cache()
+
+
+@receiver([post_save, post_delete], sender=Premier)
+def invalidate_suggestions(sender, **kwargs):
+    """Names and activity of premiers are in the suggestions index"""
+    invalidate_premier_suggestions()
@@ -0,0 +1,126 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+
+from premiers.cache import get_premier_suggest_generation, get_premier_suggest_ratings_generation
+from premiers.models import Premier
+
+logger = logging.getLogger("django")
+
+# The max number of suggestions for one prefix
+SUGGEST_MAX_LIMIT = 10
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """In-process index of active premier names for typeahead.
+
+    Every word of the name starts a key, so ``mat`` finds ``The Matrix``.
+    Keys are kept sorted, and the keys with the prefix are found by ``bisect``.
+    Top suggestions of the short prefixes (up to ``PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH``
+    chars), which match too many keys, are precomputed.
+
+    Index is rebuilt when the premiers generation is bumped (see ``invalidate_premier_suggestions``),
+    the generation is checked at most once per ``PREMIERS_SUGGEST_REFRESH_INTERVAL`` seconds.
+    Ratings generation (see ``invalidate_premier_suggest_ratings``) is bumped by every vote,
+    so it's checked at most once per ``PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL`` seconds.
+    Only the first index is built by the request, the next ones are built by background thread,
+    while the previous index is served
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = 0
+        self._ratings_checked_at = 0
+        # Sorted keys, ids of their premiers, premiers by id and top suggestions of the short prefixes.
+        # They are replaced together, so readers never see the half-built index
+        self._state = ([], [], {}, {})
+
+    def suggest(self, prefix, limit=SUGGEST_MAX_LIMIT):
+        """:return: list of ``{'id', 'name', 'url'}`` of the top rated premiers matching the prefix"""
+        self._refresh()
+        keys, ids, premiers, short = self._state
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= settings.PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH:
+            return short.get(prefix, [])[:limit]
+
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\uffff', start)
+        return self._top(premiers, {ids[i] for i in range(start, end)}, limit)
+
+    @staticmethod
+    def _top(premiers, ids, limit):
+        top = heapq.nlargest(limit, ids, key=lambda pk: (premiers[pk][0], pk))
+        return [premiers[pk][1] for pk in top]
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._generation is not None and now - self._checked_at < settings.PREMIERS_SUGGEST_REFRESH_INTERVAL:
+            return
+
+        self._checked_at = now
+        ratings_due = now - self._ratings_checked_at >= settings.PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL
+        if self._generation is None or ratings_due:
+            ratings_generation = get_premier_suggest_ratings_generation()
+            self._ratings_checked_at = now
+        else:
+            ratings_generation = self._generation[1]
+        generation = (get_premier_suggest_generation(), ratings_generation)
+        if generation == self._generation:
+            return
+
+        if self._generation is None:
+            # Nothing to serve yet
+            with self._lock:
+                if self._generation is None:
+                    self._rebuild(generation)
+        elif self._lock.acquire(blocking=False):
+            # Only one rebuild runs at a time, the lock is released by the thread
+            threading.Thread(target=self._rebuild_in_background, args=(generation,), daemon=True).start()
+
+    def _rebuild(self, generation):
+        self._state = self._build()
+        self._generation = generation
+
+    def _rebuild_in_background(self, generation):
+        """If the rebuild fails, the previous index is served until the next try"""
+        try:
+            self._rebuild(generation)
+        except Exception:
+            logger.exception("Failed to rebuild suggestions index")
+        finally:
+            # The thread has its own DB connection
+            connection.close()
+            self._lock.release()
+
+    def _build(self):
+        premiers = {}
+        entries = []
+        rows = Premier.objects.filter(is_active=True).values_list('id', 'name', 'url', 'rating_sum')
+        for pk, name, url, rating in rows.iterator():
+            premiers[pk] = (rating, {'id': pk, 'name': name, 'url': url})
+            words = normalize(name).split()
+            entries.extend((' '.join(words[i:]), pk) for i in range(len(words)))
+        entries.sort()
+
+        candidates = {}
+        for key, pk in entries:
+            for length in range(1, min(len(key), settings.PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH) + 1):
+                candidates.setdefault(key[:length], set()).add(pk)
+        short = {prefix: self._top(premiers, ids, SUGGEST_MAX_LIMIT) for prefix, ids in candidates.items()}
+
+        return [key for key, _ in entries], [pk for _, pk in entries], premiers, short
+
+
+prefix_index = PrefixIndex()
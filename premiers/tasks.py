@@ -1,6 +1,32 @@
+import logging
+
 from celery import shared_task
 
+from premiers import hot
+from premiers.votes import vote_buffer
+
+logger = logging.getLogger("celery")
+
 
 @shared_task
 def tick_tack():
     print("Tick Tack")
+
+
+@shared_task
+def flush_votes_buffer():
+    """Write buffered votes to DB by batches.
+
+    It runs periodically by Celery Beat and when the buffer grows up to the batch size
+    """
+    flushed = vote_buffer.flush()
+    if flushed:
+        logger.info(f"Flushed {flushed} votes")
+
+
+@shared_task
+def update_hot_scores():
+    """Add new votes to the premiers hot scores. It runs periodically by Celery Beat"""
+    updated = hot.update_hot_scores()
+    if updated:
+        logger.info(f"Updated hot score of {updated} premiers")
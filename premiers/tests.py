@@ -1,18 +1,58 @@
+import io
+import threading
+import time
+
+from PIL import Image
+from celery.exceptions import Retry
 from dateutil.relativedelta import relativedelta
+from django.apps import apps
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from elasticsearch.exceptions import ConnectionError as ESConnectionError, RequestError
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response as SearchResponse
 from mixer.backend.django import mixer
+from unittest.mock import MagicMock, patch
 from rest_framework.reverse import reverse
 from rest_framework import status
 
+from authentication.models import User
+from cxbootcamp_django_example.circuit_breaker import CircuitBreaker
+from cxbootcamp_django_example.redis import get_redis
+from cxbootcamp_django_example.signals import (
+    INDEX_DELETED_KEY, INDEX_DIRTY_KEY, INDEX_FLUSH_SCHEDULED_KEY, CelerySignalProcessor, flush_search_index
+)
 from cxbootcamp_django_example.tests import BaseAPITest
+from premiers.hot import HOT_SCORE_KEY, REBASE_HALF_LIVES, reset_hot_scores, update_hot_scores
 from premiers.models import Premier, Comment, Vote
-from premiers.utils import subquery_example
+from premiers.cache import get_premier_suggest_generation, invalidate_premier_suggestions, invalidate_search_cache
+from premiers.suggest import PrefixIndex
+from premiers.utils import decode_search_after, encode_search_after, search, subquery_example
+from premiers.votes import VoteBuffer, upsert_votes, vote_buffer
+from static_content.utils import record_media, variant_name
+
+# Mixer can't generate ``SearchVectorField``, DB trigger fills it anyway
+mixer.register(Premier, search_vector=None)
+
+
+def patch_bulk_save():
+    """Patch the signal processor ``bulk_update_index`` calls, whichever is configured"""
+    processor = apps.get_app_config('django_elasticsearch_dsl').signal_processor
+    return patch.object(processor, 'handle_bulk_save', create=True)
 
 
 class TestPremierViewSet(BaseAPITest):
 
     def setUp(self) -> None:
+        cache.clear()
         self.user = self.create_and_login()
 
         premier_at = timezone.now() + relativedelta(years=2)
@@ -36,6 +76,38 @@ class TestPremierViewSet(BaseAPITest):
 
         self.assertFalse(resp.data['results'][1]['is_future'])
 
+    @override_settings(IMAGE_VARIANTS_PRECOMPUTE=True, IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'])
+    def test_list_logo(self):
+        Premier.objects.filter(pk=self.premier.pk).update(logo='logo.jpeg')
+        Premier.objects.filter(pk=self.premier_happened.pk).update(logo='')
+        # Only variants in the manifest are linked directly
+        record_media('logo_320w.jpeg')
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.data['results'][0]['logo'], {
+            'name': 'logo.jpeg',
+            'url': '/media/logo.jpeg',
+            'variants': [{'width': 320, 'format': 'jpeg', 'url': '/media/logo_320w.jpeg'}],
+        })
+        self.assertIsNone(resp.data['results'][1]['logo'])
+
+    @override_settings(IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'])
+    def test_generate_logo_variants(self):
+        with io.BytesIO() as output:
+            Image.new('RGB', (1000, 500)).save(output, format='jpeg')
+            name = default_storage.save('logo.jpeg', ContentFile(output.getvalue()))
+        self.addCleanup(default_storage.delete, name)
+        Premier.objects.filter(pk=self.premier.pk).update(logo=name)
+        Premier.objects.filter(pk=self.premier_happened.pk).update(logo='absent.jpeg')
+
+        stderr = io.StringIO()
+        call_command('generate_logo_variants', stdout=io.StringIO(), stderr=stderr)
+        self.addCleanup(default_storage.delete, variant_name(name, 320, 'jpeg'))
+
+        with default_storage.open(variant_name(name, 320, 'jpeg')) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+        self.assertIn('absent.jpeg', stderr.getvalue())
+
     def test_list_unauthorized(self):
         self.logout()
 
@@ -45,6 +117,78 @@ class TestPremierViewSet(BaseAPITest):
         self.assertEqual(len(resp.data['results']), 2)
         self.assertEqual(resp.data['results'][0]['id'], self.premier.id)
 
+    def test_list_rating(self):
+        ct = ContentType.objects.get_for_model(Premier)
+        mixer.blend(Vote, user=self.user, content_type=ct, object_id=self.premier.id, rating=1)
+        mixer.blend(Vote, user=self.create('second@mail.com'), content_type=ct, object_id=self.premier.id, rating=1)
+        mixer.blend(Vote, user=self.user, content_type=ct, object_id=self.premier_happened.id, rating=-1)
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(resp.data['results'][0]['rating'], 2)
+        self.assertEqual(resp.data['results'][1]['rating'], -1)
+
+    def test_list_search_vector_not_loaded(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'search_vector' in query['sql']])
+        self.assertIn('search_vector', Premier.objects.get(pk=self.premier.pk).get_deferred_fields())
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        ct = ContentType.objects.get_for_model(Premier)
+        for premier in mixer.cycle(20).blend(Premier, is_active=True, premier_at=timezone.now(), user=self.user):
+            mixer.blend(Vote, user=self.user, content_type=ct, object_id=premier.id, rating=1)
+
+        with CaptureQueriesContext(connection) as small_page:
+            resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'page_size': 2})
+        self.assertEqual(len(resp.data['results']), 2)
+
+        with CaptureQueriesContext(connection) as big_page:
+            resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'page_size': 20})
+        self.assertEqual(len(resp.data['results']), 20)
+
+        self.assertEqual(len(small_page), len(big_page))
+
+    def test_list_cursor_pagination(self):
+        mixer.cycle(5).blend(Premier, is_active=True, premier_at=timezone.now())
+        expected = list(Premier.objects.filter(is_active=True).order_by('-id').values_list('id', flat=True))
+
+        ids = []
+        url = reverse('v1:premiers:premiers-list') + '?pagination=cursor&page_size=3'
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', resp.data)
+            ids += [p['id'] for p in resp.data['results']]
+            url = resp.data['next']
+
+        self.assertEqual(ids, expected)
+
+    def test_list_cursor_pagination_ordering(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'),
+                               data={'pagination': 'cursor', 'ordering': 'premier_at', 'page_size': 1})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['results'][0]['id'], self.premier_happened.id)
+
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual(resp.data['results'][0]['id'], self.premier.id)
+        self.assertIsNone(resp.data['next'])
+
+    def test_list_cursor_pagination_does_not_count(self):
+        mixer.cycle(10).blend(Premier, is_active=True, premier_at=timezone.now())
+
+        with CaptureQueriesContext(connection) as first_page:
+            resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'pagination': 'cursor', 'page_size': 2})
+
+        with CaptureQueriesContext(connection) as deep_page:
+            resp = self.client.get(resp.data['next'])
+            for _ in range(3):
+                resp = self.client.get(resp.data['next'])
+
+        self.assertFalse([q for q in first_page.captured_queries if 'COUNT(' in q['sql']])
+        self.assertEqual(len(deep_page), len(first_page) * 4)
+
     def test_create(self):
         resp = self.client.post(reverse('v1:premiers:premiers-list'), data=self.data)
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
@@ -71,6 +215,647 @@ class TestPremierViewSet(BaseAPITest):
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class TestPremierListConditionalGet(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = self.create_and_login()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now() + relativedelta(days=1))
+
+    def get_with_etag(self, **data):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), data=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return self.client.get(reverse('v1:premiers:premiers-list'), data=data, HTTP_IF_NONE_MATCH=resp['ETag'])
+
+    def test_not_modified(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertIn('Last-Modified', resp)
+
+        # Authentication and validators only
+        with self.assertNumQueries(2):
+            resp = self.client.get(reverse('v1:premiers:premiers-list'), HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.content, b'')
+
+    def test_not_modified_since(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_modified_anonymous(self):
+        self.logout()
+        resp = self.get_with_etag()
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_modified_on_vote(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+
+        ct = ContentType.objects.get_for_model(Premier)
+        mixer.blend(Vote, user=self.user, content_type=ct, object_id=self.premier.id, rating=1)
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['results'][0]['rating'], 1)
+
+    def test_modified_on_release(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+
+        # Update doesn't touch last_updated_at, but is_future is flipped
+        Premier.objects.filter(id=self.premier.id).update(premier_at=timezone.now())
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_page(self):
+        first = self.client.get(reverse('v1:premiers:premiers-list'), data={'page_size': 1})
+        second = self.client.get(reverse('v1:premiers:premiers-list'), data={'page_size': 2})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+
+class TestPremierListCache(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = self.create()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+
+    def test_anonymous_list_cached(self):
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(cached.data, resp.data)
+
+    def test_cache_key_depends_on_query_params(self):
+        mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.client.get(reverse('v1:premiers:premiers-list'))
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'page_size': 1})
+        self.assertEqual(len(resp.data['results']), 1)
+
+    def test_invalidated_on_premier_save(self):
+        self.client.get(reverse('v1:premiers:premiers-list'))
+
+        self.premier.name = 'Changed'
+        self.premier.save()
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.data['results'][0]['name'], 'Changed')
+
+    def test_invalidated_on_vote(self):
+        self.client.get(reverse('v1:premiers:premiers-list'))
+
+        ct = ContentType.objects.get_for_model(Premier)
+        mixer.blend(Vote, user=self.user, content_type=ct, object_id=self.premier.id, rating=1)
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.data['results'][0]['rating'], 1)
+
+    def test_authenticated_list_not_cached(self):
+        self.client.get(reverse('v1:premiers:premiers-list'))
+        Premier.objects.filter(id=self.premier.id).update(name='Changed')
+
+        self.authorize(self.user)
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.data['results'][0]['name'], 'Changed')
+
+
+class TestPremierUrl(BaseAPITest):
+    def setUp(self) -> None:
+        self.premier_at = timezone.now()
+
+    def test_create_writes_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            premier = Premier.objects.create(name='The Matrix', premier_at=self.premier_at)
+
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(premier.url, f'{premier.id}-the-matrix')
+        self.assertEqual(Premier.objects.get(id=premier.id).url, premier.url)
+
+    def test_url_rebuilt_when_name_changed(self):
+        premier = Premier.objects.create(name='The Matrix', premier_at=self.premier_at)
+
+        premier = Premier.objects.get(id=premier.id)
+        premier.name = 'The Matrix Reloaded'
+        premier.save(update_fields=['name'])
+
+        self.assertEqual(Premier.objects.get(id=premier.id).url, f'{premier.id}-the-matrix-reloaded')
+
+    def test_url_kept_when_name_not_changed(self):
+        premier = Premier.objects.create(name='The Matrix', premier_at=self.premier_at)
+        Premier.objects.filter(id=premier.id).update(url='custom-url')
+
+        premier = Premier.objects.get(id=premier.id)
+        premier.description = 'Wake up, Neo'
+        premier.save()
+
+        self.assertEqual(Premier.objects.get(id=premier.id).url, 'custom-url')
+
+    def test_bulk_create(self):
+        premiers = [Premier(name=f'Premier {i}', premier_at=self.premier_at) for i in range(10)]
+
+        with patch_bulk_save() as handle_bulk_save, CaptureQueriesContext(connection) as queries:
+            created = Premier.objects.bulk_create(premiers)
+
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(Premier.objects.count(), 10)
+        for premier in Premier.objects.all():
+            self.assertEqual(premier.url, f'{premier.id}-{premier.name.lower().replace(" ", "-")}')
+        handle_bulk_save.assert_called_once_with(Premier, created)
+
+
+class TestRatingCounters(BaseAPITest):
+    def setUp(self) -> None:
+        self.user = self.create()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.comment = mixer.blend(Comment, premier=self.premier)
+        self.ct = ContentType.objects.get_for_model(Premier)
+
+    def test_vote_created(self):
+        mixer.blend(Vote, user=self.user, content_type=self.ct, object_id=self.premier.id, rating=1)
+        mixer.blend(Vote, user=self.create('second@mail.com'), content_type=self.ct, object_id=self.premier.id,
+                    rating=1)
+
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.rating_sum, 2)
+        self.assertEqual(self.premier.vote_count, 2)
+
+    def test_vote_changed(self):
+        vote = mixer.blend(Vote, user=self.user, content_type=self.ct, object_id=self.premier.id, rating=1)
+
+        vote = Vote.objects.get(id=vote.id)
+        vote.rating = -1
+        vote.save()
+
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.rating_sum, -1)
+        self.assertEqual(self.premier.vote_count, 1)
+
+    def test_vote_moved_to_another_object(self):
+        vote = mixer.blend(Vote, user=self.user, content_type=self.ct, object_id=self.premier.id, rating=1)
+
+        vote.content_type = ContentType.objects.get_for_model(Comment)
+        vote.object_id = self.comment.id
+        vote.save()
+
+        self.premier.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (0, 0))
+        self.assertEqual((self.comment.rating_sum, self.comment.vote_count), (1, 1))
+
+    def test_vote_deleted(self):
+        vote = mixer.blend(Vote, user=self.user, content_type=self.ct, object_id=self.premier.id, rating=-1)
+        vote.delete()
+
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.rating_sum, 0)
+        self.assertEqual(self.premier.vote_count, 0)
+
+    def test_rebuild_ratings(self):
+        mixer.blend(Vote, user=self.user, content_type=self.ct, object_id=self.premier.id, rating=1)
+        Premier.objects.update(rating_sum=100, vote_count=100)
+        Comment.objects.update(rating_sum=100, vote_count=100)
+
+        call_command('rebuild_ratings', stdout=io.StringIO())
+
+        self.premier.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (1, 1))
+        self.assertEqual((self.comment.rating_sum, self.comment.vote_count), (0, 0))
+
+
+class TestVoteViewSet(BaseAPITest):
+    def setUp(self) -> None:
+        self.user = self.create_and_login()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.comment = mixer.blend(Comment, premier=self.premier)
+        self.premier_ct = ContentType.objects.get_for_model(Premier)
+
+    def tearDown(self) -> None:
+        get_redis().delete(vote_buffer.queue_key, vote_buffer.pending_key)
+
+    def test_vote(self):
+        resp = self.client.post(reverse('v1:premiers:premiers-vote', args=[self.premier.id]), data={'rating': 1})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data, {'rating': 1, 'total_rating': 1, 'vote_count': 1})
+
+        vote = Vote.objects.get()
+        self.assertEqual((vote.user, vote.content_object, vote.rating), (self.user, self.premier, 1))
+
+    def test_revote_changes_rating_in_place(self):
+        url = reverse('v1:premiers:premiers-vote', args=[self.premier.id])
+        self.client.post(url, data={'rating': 1})
+        resp = self.client.post(url, data={'rating': -1})
+
+        self.assertEqual(resp.data, {'rating': -1, 'total_rating': -1, 'vote_count': 1})
+        self.assertEqual(Vote.objects.get().rating, -1)
+
+    def test_vote_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(reverse('v1:premiers:premiers-vote', args=[self.premier.id]), data={'rating': 1})
+
+        # INSERT of the new vote and UPDATE of the changed one, the premier is not fetched
+        queries = [query['sql'] for query in context.captured_queries if 'votes' in query['sql']]
+        self.assertEqual(len(queries), 2)
+        self.assertIn('INSERT INTO votes', queries[0])
+        self.assertIn('UPDATE votes', queries[1])
+
+    def test_vote_for_comment(self):
+        resp = self.client.post(reverse('v1:premiers:comments-vote', args=[self.comment.id]), data={'rating': -1})
+        self.assertEqual(resp.data, {'rating': -1, 'total_rating': -1, 'vote_count': 1})
+
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.rating_sum, self.comment.vote_count), (-1, 1))
+
+    def test_vote_not_found(self):
+        resp = self.client.post(reverse('v1:premiers:premiers-vote', args=[0]), data={'rating': 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_vote_validation_error(self):
+        resp = self.client.post(reverse('v1:premiers:premiers-vote', args=[self.premier.id]), data={'rating': 2})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_vote_unauthorized(self):
+        self.logout()
+        resp = self.client.post(reverse('v1:premiers:premiers-vote', args=[self.premier.id]), data={'rating': 1})
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(VOTES_BUFFERED=True, VOTES_BUFFER_BATCH_SIZE=2)
+    @patch('premiers.tasks.flush_votes_buffer.delay')
+    def test_vote_buffered(self, delay):
+        url = reverse('v1:premiers:premiers-vote', args=[self.premier.id])
+        resp = self.client.post(url, data={'rating': 1})
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(resp.data, {'rating': 1})
+        self.assertFalse(Vote.objects.exists())
+        delay.assert_not_called()
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.data, {'rating': 1, 'total_rating': 1, 'vote_count': 1})
+
+        self.client.post(url, data={'rating': -1})
+        delay.assert_called_once()
+
+    def test_get_vote(self):
+        url = reverse('v1:premiers:premiers-vote', args=[self.premier.id])
+        resp = self.client.get(url)
+        self.assertEqual(resp.data, {'rating': None, 'total_rating': 0, 'vote_count': 0})
+
+        self.client.post(url, data={'rating': 1})
+        with override_settings(VOTES_BUFFERED=True):
+            self.client.post(url, data={'rating': -1})
+            resp = self.client.get(url)
+        self.assertEqual(resp.data, {'rating': -1, 'total_rating': -1, 'vote_count': 1})
+
+        self.assertEqual(self.client.get(reverse('v1:premiers:premiers-vote', args=[0])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_vote_inactive(self):
+        Premier.objects.filter(pk=self.premier.pk).update(is_active=False)
+        for buffered in (False, True):
+            with override_settings(VOTES_BUFFERED=buffered):
+                for url in (reverse('v1:premiers:premiers-vote', args=[self.premier.id]),
+                            reverse('v1:premiers:comments-vote', args=[self.comment.id])):
+                    resp = self.client.post(url, data={'rating': 1})
+                    self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(len(vote_buffer), 0)
+        self.assertFalse(Vote.objects.exists())
+        self.premier.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (0, 0))
+        self.assertEqual((self.comment.rating_sum, self.comment.vote_count), (0, 0))
+
+    @override_settings(VOTES_BUFFERED=True)
+    def test_vote_buffered_not_found(self):
+        resp = self.client.post(reverse('v1:premiers:premiers-vote', args=[0]), data={'rating': 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(vote_buffer), 0)
+
+
+class TestHotScore(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        reset_hot_scores()
+        self.user = self.create()
+        self.second_user = self.create('second@mail.com')
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.hot_premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.cold_premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+
+        upsert_votes(Premier, [
+            (self.user.id, self.hot_premier.id, 1),
+            (self.second_user.id, self.hot_premier.id, 1),
+            (self.user.id, self.cold_premier.id, -1),
+        ])
+
+    def tearDown(self) -> None:
+        reset_hot_scores()
+
+    def decayed(self, premier, now):
+        """Scores are anchored to the epoch, the value at the time is the sum of votes decayed by their age"""
+        premier.refresh_from_db()
+        epoch = float(get_redis().hget(HOT_SCORE_KEY, 'epoch'))
+        return premier.hot_score * 2 ** (-(now.timestamp() - epoch) / settings.PREMIERS_HOT_HALF_LIFE)
+
+    def test_update(self):
+        now = timezone.now()
+        self.assertEqual(update_hot_scores(now), 2)
+
+        self.assertAlmostEqual(self.decayed(self.hot_premier, now), 2, places=2)
+        self.assertAlmostEqual(self.decayed(self.cold_premier, now), -1, places=2)
+
+    @override_settings(PREMIERS_HOT_SETTLE_LAG=0)
+    def test_only_voted_updated(self):
+        now = timezone.now()
+        update_hot_scores(now)
+        self.hot_premier.refresh_from_db()
+
+        self.assertEqual(update_hot_scores(now + relativedelta(hours=1)), 0)
+        self.assertEqual(Premier.objects.get(pk=self.hot_premier.pk).hot_score, self.hot_premier.hot_score)
+
+    def test_inactive_skipped(self):
+        Premier.objects.filter(pk=self.hot_premier.pk).update(is_active=False)
+        self.assertEqual(update_hot_scores(), 1)
+        self.hot_premier.refresh_from_db()
+        self.assertEqual(self.hot_premier.hot_score, 0)
+
+    @override_settings(PREMIERS_HOT_HALF_LIFE=60 * 60, PREMIERS_HOT_SETTLE_LAG=0)
+    def test_rebase(self):
+        now = timezone.now()
+        update_hot_scores(now)
+        upsert_votes(Premier, [(self.user.id, self.premier.id, 1)])
+        Vote.objects.filter(object_id=self.premier.id).update(created_at=now + relativedelta(hours=REBASE_HALF_LIVES))
+
+        later = now + relativedelta(hours=REBASE_HALF_LIVES + 1)
+        update_hot_scores(later)
+        self.assertEqual(float(get_redis().hget(HOT_SCORE_KEY, 'epoch')), later.timestamp())
+        self.assertAlmostEqual(self.decayed(self.premier, later), 0.5, places=4)
+        # Decayed below the threshold
+        self.hot_premier.refresh_from_db()
+        self.assertEqual(self.hot_premier.hot_score, 0)
+
+    @override_settings(PREMIERS_HOT_HALF_LIFE=60 * 60, PREMIERS_HOT_SETTLE_LAG=0)
+    def test_update_is_incremental(self):
+        now = timezone.now()
+        update_hot_scores(now)
+
+        # Already processed votes are not read again
+        Vote.objects.filter(object_id=self.hot_premier.id).delete()
+        upsert_votes(Premier, [(self.user.id, self.premier.id, 1)])
+        # NOW() is the start of the test transaction
+        Vote.objects.filter(object_id=self.premier.id).update(created_at=now)
+        self.assertEqual(update_hot_scores(now + relativedelta(hours=1)), 1)
+
+        # Half-life later every vote costs half
+        later = now + relativedelta(hours=1)
+        self.assertAlmostEqual(self.decayed(self.hot_premier, later), 1, places=2)
+        self.assertAlmostEqual(self.decayed(self.premier, later), 0.5, places=2)
+
+    @override_settings(PREMIERS_HOT_HALF_LIFE=60 * 60, PREMIERS_HOT_SETTLE_LAG=5 * 60)
+    def test_vote_committed_late(self):
+        now = timezone.now()
+        update_hot_scores(now)
+
+        # The vote was created before the update, but committed after it
+        upsert_votes(Premier, [(self.user.id, self.premier.id, 1)])
+        Vote.objects.filter(object_id=self.premier.id).update(created_at=now - relativedelta(minutes=1))
+
+        # It's counted while fresh, then settles and is counted only once
+        for minutes in (1, 10, 20):
+            update_hot_scores(now + relativedelta(minutes=minutes))
+        self.assertEqual(update_hot_scores(now + relativedelta(minutes=20)), 0)
+
+        self.assertAlmostEqual(self.decayed(self.premier, now + relativedelta(minutes=20)), 2 ** (-21 / 60), places=4)
+        self.assertAlmostEqual(self.premier.hot_score_base, self.premier.hot_score)
+
+    def test_update_from_scratch(self):
+        update_hot_scores()
+        Vote.objects.filter(object_id=self.hot_premier.id).delete()
+        reset_hot_scores()
+        update_hot_scores()
+
+        self.hot_premier.refresh_from_db()
+        self.assertEqual(self.hot_premier.hot_score, 0)
+
+    def test_list_ordering(self):
+        update_hot_scores()
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'ordering': 'hot'})
+        self.assertEqual([premier['id'] for premier in resp.data['results']],
+                         [self.hot_premier.id, self.premier.id, self.cold_premier.id])
+
+    def test_list_ordering_not_available_with_cursor(self):
+        update_hot_scores()
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'), data={'ordering': 'hot', 'pagination': 'cursor'})
+        self.assertEqual([premier['id'] for premier in resp.data['results']],
+                         [self.cold_premier.id, self.hot_premier.id, self.premier.id])
+
+
+class TestUpsertVotes(BaseAPITest):
+    def setUp(self) -> None:
+        self.user = self.create()
+        self.second_user = self.create('second@mail.com')
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.other_premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+
+    def test_insert(self):
+        counters = upsert_votes(Premier, [
+            (self.user.id, self.premier.id, 1),
+            (self.second_user.id, self.premier.id, 1),
+            (self.user.id, self.other_premier.id, -1),
+        ])
+
+        self.assertEqual(counters, {self.premier.id: (2, 2), self.other_premier.id: (-1, 1)})
+        self.assertEqual(Vote.objects.count(), 3)
+
+        self.premier.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (2, 2))
+
+    def test_revote_changes_rating_in_place(self):
+        upsert_votes(Premier, [(self.user.id, self.premier.id, 1)])
+        counters = upsert_votes(Premier, [(self.user.id, self.premier.id, -1)])
+
+        self.assertEqual(counters, {self.premier.id: (-1, 1)})
+        self.assertEqual(Vote.objects.get().rating, -1)
+
+    def test_last_vote_in_batch_wins(self):
+        counters = upsert_votes(Premier, [(self.user.id, self.premier.id, 1), (self.user.id, self.premier.id, -1)])
+
+        self.assertEqual(counters, {self.premier.id: (-1, 1)})
+
+    def test_vote_for_absent_object_is_skipped(self):
+        counters = upsert_votes(Premier, [(self.user.id, 0, 1)])
+
+        self.assertEqual(counters, {})
+        self.assertFalse(Vote.objects.exists())
+
+
+class TestUpsertVotesConcurrency(TransactionTestCase):
+    def setUp(self) -> None:
+        # Transactions are committed here, so the changes would be queued for indexing
+        patcher = patch('cxbootcamp_django_example.signals.mark_for_index')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(email='test@mail.com', password='test_password')  # nosec
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+
+    def vote_in_thread(self, rating, voted=None, commit=None):
+        def vote():
+            try:
+                with transaction.atomic():
+                    upsert_votes(Premier, [(self.user.id, self.premier.id, rating)])
+                    if voted is not None:
+                        voted.set()
+                        commit.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=vote)
+        thread.start()
+        return thread
+
+    def race(self, first, second):
+        voted, commit = threading.Event(), threading.Event()
+        threads = [self.vote_in_thread(first, voted, commit)]
+        voted.wait(5)
+        # The second vote starts before the first one is committed
+        threads.append(self.vote_in_thread(second))
+        time.sleep(0.2)
+        commit.set()
+        for thread in threads:
+            thread.join()
+
+        self.premier.refresh_from_db()
+        return Vote.objects.get().rating, self.premier.rating_sum, self.premier.vote_count
+
+    def test_double_vote(self):
+        self.assertEqual(self.race(1, 1), (1, 1, 1))
+
+    def test_changed_vote(self):
+        self.assertEqual(self.race(1, -1), (-1, -1, 1))
+
+
+class TestVoteBuffer(BaseAPITest):
+    def setUp(self) -> None:
+        self.buffer = VoteBuffer(prefix='test:premiers:votes')
+        get_redis().delete(self.buffer.queue_key, self.buffer.pending_key)
+
+        self.user = self.create()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.comment = mixer.blend(Comment, premier=self.premier)
+        self.premier_ct = ContentType.objects.get_for_model(Premier)
+        self.comment_ct = ContentType.objects.get_for_model(Comment)
+
+    def tearDown(self) -> None:
+        get_redis().delete(self.buffer.queue_key, self.buffer.pending_key)
+
+    def test_flush(self):
+        self.assertEqual(self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, 1), 1)
+        self.assertEqual(self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, -1), 2)
+        self.buffer.push(self.user.id, self.comment_ct.id, self.comment.id, 1)
+
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(self.buffer.flush(batch_size=2), 3)
+        self.assertEqual(len(self.buffer), 0)
+
+        self.premier.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (-1, 1))
+        self.assertEqual((self.comment.rating_sum, self.comment.vote_count), (1, 1))
+
+    def test_flush_max_batches(self):
+        for _ in range(3):
+            self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, 1)
+
+        self.assertEqual(self.buffer.flush(batch_size=1, max_batches=2), 2)
+        self.assertEqual(len(self.buffer), 1)
+
+    def test_read_own_vote(self):
+        self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, -1)
+        self.assertEqual(self.buffer.get_user_vote(self.user.id, self.premier_ct.id, self.premier.id), (-1, -1, 1))
+
+        self.buffer.flush()
+        self.premier.refresh_from_db()
+        self.assertIsNone(self.buffer.get_pending_vote(self.user.id, self.premier_ct.id, self.premier.id))
+        self.assertEqual(self.buffer.get_user_vote(self.user.id, self.premier_ct.id, self.premier.id,
+                                                   self.premier.rating_sum, self.premier.vote_count), (-1, -1, 1))
+
+        # Changed vote replaces the flushed one in counters
+        self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, 1)
+        self.assertEqual(self.buffer.get_user_vote(self.user.id, self.premier_ct.id, self.premier.id,
+                                                   self.premier.rating_sum, self.premier.vote_count), (1, 1, 1))
+
+    def test_vote_of_deleted_user_skipped(self):
+        deleted = self.create('deleted@mail.com')
+        self.buffer.push(deleted.id, self.premier_ct.id, self.premier.id, -1)
+        self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, 1)
+        deleted.delete()
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertIsNone(self.buffer.get_pending_vote(deleted.id, self.premier_ct.id, self.premier.id))
+        self.premier.refresh_from_db()
+        self.assertEqual((self.premier.rating_sum, self.premier.vote_count), (1, 1))
+
+    def test_vote_changed_during_flush_stays_pending(self):
+        self.buffer.push(self.user.id, self.premier_ct.id, self.premier.id, 1)
+        get_redis().hset(self.buffer.pending_key, f'{self.user.id}:{self.premier_ct.id}:{self.premier.id}', -1)
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.get_pending_vote(self.user.id, self.premier_ct.id, self.premier.id), -1)
+
+
+class TestTopComment(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = self.create_and_login()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        self.comment = mixer.blend(Comment, premier=self.premier)
+        self.premier_ct = ContentType.objects.get_for_model(Premier)
+        self.comment_ct = ContentType.objects.get_for_model(Comment)
+
+    def test_comment_created(self):
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.top_comment, self.comment)
+
+    def test_comment_voted(self):
+        other = mixer.blend(Comment, premier=self.premier)
+        mixer.blend(Vote, user=self.user, content_type=self.comment_ct, object_id=self.comment.id, rating=1)
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.top_comment, self.comment)
+
+        self.client.post(reverse('v1:premiers:comments-vote', args=[other.id]), data={'rating': 1})
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.top_comment, other)
+
+    def test_comment_deleted(self):
+        other = mixer.blend(Comment, premier=self.premier)
+        other.delete()
+
+        self.premier.refresh_from_db()
+        self.assertEqual(self.premier.top_comment, self.comment)
+
+    def test_only_affected_premier_refreshed(self):
+        other_premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        Premier.objects.filter(pk=other_premier.pk).update(top_comment=self.comment)
+
+        mixer.blend(Comment, premier=self.premier)
+        other_premier.refresh_from_db()
+        self.assertEqual(other_premier.top_comment, self.comment)
+
+    def test_list(self):
+        upsert_votes(Comment, [(self.user.id, self.comment.id, 1)])
+
+        resp = self.client.get(reverse('v1:premiers:premiers-list'))
+        self.assertEqual(resp.data['results'][0]['top_comment'], {
+            'id': self.comment.id, 'text': self.comment.text, 'rating': 1,
+            'created_at': resp.data['results'][0]['top_comment']['created_at'],
+        })
+
+
 class TestSubquery(BaseAPITest):
     def setUp(self) -> None:
         self.user = self.create()
@@ -88,3 +873,539 @@ class TestSubquery(BaseAPITest):
 
         p: Premier = qs.first()
         self.assertEqual(p.top_comment_id, self.comment_top.id)
+
+
+class TestPremierSearch(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.searches = []
+
+    def mock_execute(self, hits, total=None):
+        """Every search gets ES response with the given ``(id, name, score)`` hits"""
+        def execute(search, *args, **kwargs):
+            self.searches.append(search.to_dict())
+            return SearchResponse(search, {
+                'hits': {
+                    'total': {'value': total or len(hits), 'relation': 'eq'},
+                    'hits': [
+                        {'_index': 'premiers', '_id': str(pk), '_score': score, 'sort': [score, pk],
+                         '_source': {'id': pk, 'url': f'{pk}-matrix', 'name': name, 'description': None,
+                                     'user_id': 1, 'rating': 3, 'premier_at': '2021-07-14T11:43:00+00:00',
+                                     'is_active': True}}
+                        for pk, name, score in hits
+                    ],
+                },
+            })
+        return patch.object(Search, 'execute', autospec=True, side_effect=execute)
+
+    def test_search(self):
+        with self.mock_execute([(2, 'Matrix', 1.5), (1, 'Matrix 2', 1.0)]), self.assertNumQueries(0):
+            resp = self.client.get(reverse('v1:premiers:premiers-search'), data={'q': 'matrix'})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['count'], 2)
+        self.assertIsNone(resp.data['next'])
+        self.assertEqual([result['id'] for result in resp.data['results']], [2, 1])
+        self.assertEqual(resp.data['results'][0], {
+            'id': 2, 'url': '2-matrix', 'name': 'Matrix', 'description': None,
+            'user_id': 1, 'rating': 3, 'premier_at': '2021-07-14T11:43:00Z',
+        })
+        self.assertEqual(self.searches[0]['from'], 0)
+        self.assertEqual(self.searches[0]['size'], 20)
+        self.assertEqual(self.searches[0]['query']['bool']['filter'], [{'term': {'is_active': True}}])
+        self.assertEqual(self.searches[0]['_source'],
+                         ['id', 'url', 'name', 'description', 'user_id', 'rating', 'premier_at'])
+
+    def test_search_filter_and_ordering(self):
+        with self.mock_execute([]):
+            self.client.get(reverse('v1:premiers:premiers-search'),
+                            data={'q': 'matrix', 'user': 5, 'ordering': 'rating'})
+
+        self.assertEqual(self.searches[0]['query']['bool']['filter'],
+                         [{'term': {'is_active': True}}, {'term': {'user_id': 5}}])
+        self.assertEqual(self.searches[0]['sort'], [{'rating': 'desc'}, {'id': 'desc'}])
+
+    def test_reindexed_on_vote(self):
+        user = self.create()
+        premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now())
+        with patch_bulk_save() as handle_bulk_save:
+            upsert_votes(Premier, [(user.id, premier.id, 1)])
+
+        model, instances = handle_bulk_save.call_args[0]
+        self.assertEqual(model, Premier)
+        self.assertEqual([(instance, instance.rating_sum) for instance in instances], [(premier, 1)])
+
+    def test_search_next_page(self):
+        with self.mock_execute([(3, 'Matrix', 1.5), (2, 'Matrix 2', 1.0)], total=3):
+            resp = self.client.get(reverse('v1:premiers:premiers-search'),
+                                   data={'q': 'matrix', 'page_size': 2, 'offset': 4})
+        self.assertEqual(self.searches[0]['from'], 4)
+
+        token = encode_search_after([1.0, 2])
+        self.assertIn(f'search_after={token}', resp.data['next'])
+        self.assertNotIn('offset', resp.data['next'])
+
+        with self.mock_execute([(1, 'Matrix 3', 0.5)], total=3):
+            resp = self.client.get(resp.data['next'])
+        self.assertEqual(self.searches[1]['search_after'], [1.0, 2])
+        self.assertEqual(self.searches[1]['from'], 0)
+        self.assertIsNone(resp.data['next'])
+
+    def test_search_validation_error(self):
+        url = reverse('v1:premiers:premiers-search')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, data={'q': 'matrix', 'offset': 10000}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, data={'q': 'matrix', 'search_after': 'invalid'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_search_after_token(self):
+        self.assertEqual(decode_search_after(encode_search_after([1.5, 42])), [1.5, 42])
+        for search_after in ({'id': 1}, [1], [1, 2, 3], [1, 'x'], [1, 1.5], [{'a': 1}, 2], [None, 1], [1, True],
+                             [float('nan'), 1], ['2021-07-14T11:43:00', 42]):
+            with self.assertRaises(ValueError):
+                decode_search_after(encode_search_after(search_after))
+
+    def test_search_after_token_ordering(self):
+        for ordering, valid, invalid in (
+            ('premier_at', ([1626262980000, 1], ['2021-07-14T11:43:00+00:00', 1]),
+             (['abc', 1], ['2021-13-14T11:43:00', 1], [1e300, 1])),
+            ('rating', ([3, 1],), ([1.5, 1], ['x', 1])),
+        ):
+            for search_after in valid:
+                self.assertEqual(decode_search_after(encode_search_after(search_after), ordering), search_after)
+            for search_after in invalid:
+                with self.assertRaises(ValueError):
+                    decode_search_after(encode_search_after(search_after), ordering)
+
+
+class TestCelerySignalProcessor(BaseAPITest):
+    def setUp(self) -> None:
+        get_redis().delete(INDEX_DIRTY_KEY, INDEX_DELETED_KEY, INDEX_FLUSH_SCHEDULED_KEY)
+        self.processor = CelerySignalProcessor(connections)
+
+    def tearDown(self) -> None:
+        self.processor.teardown()
+        get_redis().delete(INDEX_DIRTY_KEY, INDEX_DELETED_KEY, INDEX_FLUSH_SCHEDULED_KEY)
+
+    def get_queued(self, key):
+        return {member.decode() for member in get_redis().smembers(key)}
+
+    @patch('cxbootcamp_django_example.signals.flush_search_index.apply_async')
+    def test_changes_queued_after_commit(self, apply_async):
+        with self.captureOnCommitCallbacks() as callbacks:
+            premier = mixer.blend(Premier, premier_at=timezone.now())
+            premier.save()
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), set())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), {f'premiers.Premier:{premier.id}'})
+        apply_async.assert_called_once()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            premier_id = premier.id
+            premier.delete()
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), set())
+        self.assertEqual(self.get_queued(INDEX_DELETED_KEY), {f'premiers.Premier:{premier_id}'})
+        apply_async.assert_called_once()
+
+    @patch('cxbootcamp_django_example.signals.flush_search_index.apply_async')
+    def test_bulk_save_queued(self, apply_async):
+        config = apps.get_app_config('django_elasticsearch_dsl')
+        with patch.object(config, 'signal_processor', self.processor), self.captureOnCommitCallbacks(execute=True):
+            premiers = Premier.objects.bulk_create(Premier(name=f'Premier {i}', premier_at=timezone.now())
+                                                   for i in range(3))
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), {f'premiers.Premier:{p.id}' for p in premiers})
+
+    @patch('cxbootcamp_django_example.signals.bulk')
+    @patch('django_elasticsearch_dsl.documents.Document.update')
+    @patch('cxbootcamp_django_example.signals.flush_search_index.apply_async')
+    def test_flush(self, apply_async, update, delete_bulk):
+        with self.captureOnCommitCallbacks(execute=True):
+            premiers = mixer.cycle(3).blend(Premier, premier_at=timezone.now())
+            deleted_id = premiers[0].id
+            premiers[0].delete()
+
+        flush_search_index(chunk_size=10)
+
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual({p.id for p in update.call_args[0][0]}, {premiers[1].id, premiers[2].id})
+        self.assertEqual([action['_id'] for action in delete_bulk.call_args[0][1]], [deleted_id])
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), set())
+
+    @patch('django_elasticsearch_dsl.documents.Document.update', side_effect=ConnectionError)
+    @patch('cxbootcamp_django_example.signals.flush_search_index.apply_async')
+    def test_flush_failed(self, apply_async, update):
+        with self.captureOnCommitCallbacks(execute=True):
+            premier = mixer.blend(Premier, premier_at=timezone.now())
+
+        with patch.object(flush_search_index, 'retry', side_effect=Retry) as retry, self.assertRaises(Retry):
+            flush_search_index()
+        self.assertEqual(self.get_queued(INDEX_DIRTY_KEY), {f'premiers.Premier:{premier.id}'})
+        self.assertEqual(retry.call_args[1]['countdown'], settings.SEARCH_INDEX_FLUSH_DELAY)
+        self.assertIsInstance(retry.call_args[1]['exc'], ConnectionError)
+
+
+class TestReindexPremiers(BaseAPITest):
+    def setUp(self) -> None:
+        get_redis().delete('search:reindex:premiers')
+        self.premiers = mixer.cycle(5).blend(Premier, premier_at=timezone.now())
+        self.client_es = MagicMock()
+        self.client_es.indices.get.return_value = {'premiers-20210101000000': {}}
+        self.indexed = []
+
+    def tearDown(self) -> None:
+        get_redis().delete('search:reindex:premiers')
+
+    def parallel_bulk(self, fail_after=None):
+        def bulk(client, actions, **kwargs):
+            for action in actions:
+                if fail_after is not None and len(self.indexed) >= fail_after:
+                    raise ConnectionError
+                self.indexed.append((action['_index'], action['_id']))
+                yield True, {}
+        return patch('premiers.management.commands.reindex_premiers.parallel_bulk', side_effect=bulk)
+
+    def reindex(self, ghosts=(), **options):
+        """``ghosts`` are ids of premiers deleted during reindex, but indexed into the new index"""
+        def scan(client, index, **kwargs):
+            return [{'_id': str(pk)} for pk in {pk for name, pk in self.indexed if name == index} | set(ghosts)]
+
+        with patch('premiers.documents.ItemDocument._get_connection', return_value=self.client_es), \
+                patch('premiers.management.commands.reindex_premiers.scan', side_effect=scan), \
+                patch('premiers.management.commands.reindex_premiers.bulk') as bulk:
+            call_command('reindex_premiers', chunk_size=2, workers=1, stdout=io.StringIO(), **options)
+        return list(bulk.call_args[0][1]) if bulk.called else None
+
+    def test_reindex(self):
+        with self.parallel_bulk(), patch('elasticsearch_dsl.Index.create') as create:
+            self.reindex()
+
+        create.assert_called_once()
+        index_name = self.indexed[0][0]
+        self.assertRegex(index_name, r'^premiers-\d{14}$')
+        # Premiers created just now are indexed again after alias switch
+        self.assertEqual([pk for _, pk in self.indexed[:5]], [p.id for p in self.premiers])
+
+        self.client_es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': index_name, 'alias': 'premiers'}},
+            {'remove': {'index': 'premiers-20210101000000', 'alias': 'premiers'}},
+        ]})
+        self.client_es.indices.delete.assert_called_once_with(index='premiers-20210101000000')
+
+    def test_deleted_during_reindex(self):
+        # The premier was indexed into the new index, then deleted from the old one only
+        deleted_id = self.premiers[0].id
+        self.premiers[0].delete()
+        with self.parallel_bulk(), patch('elasticsearch_dsl.Index.create'):
+            actions = self.reindex(ghosts=[deleted_id, 0])
+
+        index_name = self.indexed[0][0]
+        self.assertEqual(actions, [{'_op_type': 'delete', '_index': index_name, '_id': pk} for pk in (0, deleted_id)])
+
+    def test_replace_concrete_index(self):
+        self.client_es.indices.get.return_value = {'premiers': {}}
+        with self.parallel_bulk(), patch('elasticsearch_dsl.Index.create'):
+            self.reindex()
+
+        actions = self.client_es.indices.update_aliases.call_args[1]['body']['actions']
+        self.assertEqual(actions[0], {'remove_index': {'index': 'premiers'}})
+        self.client_es.indices.delete.assert_not_called()
+
+    def test_resume(self):
+        with self.parallel_bulk(fail_after=3), patch('elasticsearch_dsl.Index.create'), \
+                self.assertRaises(ConnectionError):
+            self.reindex()
+        index_name = self.indexed[0][0]
+
+        # The first chunk is saved in checkpoint, so the second one is indexed again
+        self.indexed = []
+        with self.parallel_bulk(), patch('elasticsearch_dsl.Index.create') as create:
+            self.reindex(resume=True)
+
+        create.assert_not_called()
+        self.assertEqual(self.indexed[:3], [(index_name, p.id) for p in self.premiers[2:]])
+
+    def test_resume_without_checkpoint(self):
+        with self.assertRaises(CommandError):
+            self.reindex(resume=True)
+
+
+@override_settings(PREMIERS_SEARCH_BACKEND='premiers.search_backends.PostgresSearchBackend')
+class TestPostgresSearch(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = self.create()
+        self.in_description = mixer.blend(Premier, is_active=True, premier_at=timezone.now(),
+                                          name='Revolutions', description='The last matrix movie')
+        self.in_name = mixer.blend(Premier, is_active=True, premier_at=timezone.now(), user=self.user,
+                                   name='The Matrix', description='Neo meets Morpheus')
+        self.inactive = mixer.blend(Premier, is_active=False, premier_at=timezone.now(), name='Matrix')
+
+    def search(self, **data):
+        return self.client.get(reverse('v1:premiers:premiers-search'), data=data)
+
+    def test_search(self):
+        resp = self.search(q='matrix')
+
+        self.assertEqual(resp.data['count'], 2)
+        self.assertEqual([result['id'] for result in resp.data['results']], [self.in_name.id, self.in_description.id])
+        self.assertEqual(resp.data['results'][0]['url'], self.in_name.url)
+
+    def test_search_vector_updated(self):
+        self.in_name.name = 'Reloaded'
+        self.in_name.save()
+
+        resp = self.search(q='matrix')
+        self.assertEqual([result['id'] for result in resp.data['results']], [self.in_description.id])
+
+    def test_search_filter_and_ordering(self):
+        resp = self.search(q='matrix', user=self.user.id)
+        self.assertEqual([result['id'] for result in resp.data['results']], [self.in_name.id])
+
+        resp = self.search(q='matrix', ordering='premier_at')
+        self.assertEqual([result['id'] for result in resp.data['results']], [self.in_description.id, self.in_name.id])
+
+    def test_search_next_page(self):
+        for ordering in ('relevance', '-premier_at', 'rating'):
+            resp = self.search(q='matrix', page_size=1, ordering=ordering)
+            first = resp.data['results']
+
+            resp = self.client.get(resp.data['next'])
+            self.assertEqual(len(resp.data['results']), 1)
+            self.assertNotEqual(resp.data['results'], first)
+
+    def test_search_after_forged(self):
+        for ordering, search_after in (('relevance', ['abc', 1]), ('relevance', [1]), ('rating', ['x', 'y']),
+                                       ('premier_at', [{'a': 1}, 2]), ('premier_at', ['abc', 1])):
+            resp = self.search(q='matrix', ordering=ordering, search_after=encode_search_after(search_after))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('search_after', resp.data)
+
+    def test_search_after_epoch_millis(self):
+        """Tokens of ElasticSearch sort dates by epoch millis"""
+        search_after = [int(self.in_description.premier_at.timestamp() * 1000), self.in_description.id]
+        resp = self.search(q='matrix', ordering='-premier_at', search_after=encode_search_after(search_after))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+class TestSearchCache(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.premier = mixer.blend(Premier, is_active=True, premier_at=timezone.now(), name='The Matrix')
+        self.breaker = CircuitBreaker(min_calls=2, cooldown=60)
+        patcher = patch('premiers.utils.search_breaker', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mock_execute(self, **kwargs):
+        return patch.object(Search, 'execute', autospec=True, **kwargs)
+
+    def es_response(self, search, *args, **kwargs):
+        return SearchResponse(search, {'hits': {'total': {'value': 1, 'relation': 'eq'}, 'hits': [
+            {'_index': 'premiers', '_id': '1', '_score': 1.0, 'sort': [1.0, 1], '_source': {'id': 1, 'name': 'ES'}},
+        ]}})
+
+    def test_cached(self):
+        with self.mock_execute(side_effect=self.es_response) as execute:
+            page = search('the matrix')
+            self.assertEqual(search('  The   MATRIX '), page)
+            self.assertEqual(execute.call_count, 1)
+
+            search('the matrix', ordering='rating')
+            self.assertEqual(execute.call_count, 2)
+
+            invalidate_search_cache()
+            search('the matrix')
+            self.assertEqual(execute.call_count, 3)
+
+    @override_settings(PREMIERS_SEARCH_CACHE_TIMEOUT=0)
+    def test_stale_served_on_error(self):
+        with self.mock_execute(side_effect=self.es_response):
+            page = search('matrix')
+        with self.mock_execute(side_effect=ESConnectionError('N/A', 'timeout', None)):
+            self.assertEqual(search('matrix'), page)
+
+    def test_fallback_backend(self):
+        with self.mock_execute(side_effect=ESConnectionError('N/A', 'timeout', None)) as execute:
+            page = search('matrix')
+            self.assertEqual([result['id'] for result in page['results']], [self.premier.id])
+
+            # The breaker is open, ES is not called anymore
+            search('matrix', offset=1)
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+            search('matrix', offset=2)
+            self.assertEqual(execute.call_count, 2)
+
+            resp = self.client.get(reverse('v1:premiers:premiers-search'),
+                                   data={'q': 'matrix', 'search_after': encode_search_after([1.0, 1])})
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @patch('cxbootcamp_django_example.circuit_breaker.time.monotonic', return_value=100)
+    def test_trial_resolved_on_unexpected_error(self, monotonic):
+        with self.mock_execute(side_effect=ESConnectionError('N/A', 'timeout', None)):
+            search('matrix')
+            search('matrix', offset=1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        monotonic.return_value = 160
+        with self.mock_execute(side_effect=TypeError), self.assertRaises(TypeError):
+            search('matrix', offset=2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        monotonic.return_value = 220
+        with self.mock_execute(side_effect=self.es_response):
+            self.assertEqual(search('matrix', offset=3)['results'][0]['name'], 'ES')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_client_error(self):
+        with self.mock_execute(side_effect=RequestError(400, 'parsing_exception', {})):
+            for _ in range(3):
+                resp = self.client.get(reverse('v1:premiers:premiers-search'), data={'q': 'matrix'})
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    @override_settings(PREMIERS_SEARCH_FALLBACK_BACKEND='')
+    def test_unavailable(self):
+        with self.mock_execute(side_effect=ESConnectionError('N/A', 'timeout', None)):
+            resp = self.client.get(reverse('v1:premiers:premiers-search'), data={'q': 'matrix'})
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class TestCircuitBreaker(BaseAPITest):
+    @patch('cxbootcamp_django_example.circuit_breaker.time.monotonic')
+    def test_states(self, monotonic):
+        monotonic.return_value = 100
+        breaker = CircuitBreaker(failure_rate=0.5, slow_call_seconds=1, window=30, min_calls=4, cooldown=15)
+
+        breaker.record(0.1)
+        breaker.record(2)
+        breaker.record(0.1, failed=True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        # Only one trial call after the cooldown, its failure opens the breaker again
+        monotonic.return_value = 115
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(0.1, failed=True)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        monotonic.return_value = 130
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.record(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    @patch('cxbootcamp_django_example.circuit_breaker.time.monotonic')
+    def test_window(self, monotonic):
+        breaker = CircuitBreaker(failure_rate=0.5, window=30, min_calls=2)
+        monotonic.return_value = 100
+        breaker.record(0.1, failed=True)
+        monotonic.return_value = 131
+        breaker.record(0.1, failed=True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+@override_settings(PREMIERS_SUGGEST_REFRESH_INTERVAL=0, PREMIERS_SUGGEST_SHORT_PREFIX_LENGTH=3)
+class TestPremierSuggest(BaseAPITest):
+    def setUp(self) -> None:
+        cache.clear()
+        self.matrix = mixer.blend(Premier, is_active=True, premier_at=timezone.now(), name='The Matrix')
+        self.reloaded = mixer.blend(Premier, is_active=True, premier_at=timezone.now(), name='Matrix Reloaded')
+        self.mad_max = mixer.blend(Premier, is_active=True, premier_at=timezone.now(), name='Mad Max')
+        mixer.blend(Premier, is_active=False, premier_at=timezone.now(), name='Matrix Resurrections')
+        Premier.objects.filter(pk=self.matrix.pk).update(rating_sum=5)
+        invalidate_premier_suggestions()
+
+        # The first index is built by the request
+        patcher = patch('premiers.search_backends.prefix_index', PrefixIndex())
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(min_calls=2, cooldown=60)
+        patcher = patch('premiers.search_backends.search_breaker', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def suggest(self, **data):
+        resp = self.client.get(reverse('v1:premiers:premiers-suggest'), data=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [suggestion['id'] for suggestion in resp.data]
+
+    def test_short_prefix_from_memory(self):
+        self.assertEqual(self.suggest(q='Ma'), [self.matrix.id, self.mad_max.id, self.reloaded.id])
+        self.assertEqual(self.suggest(q='ma', limit=1), [self.matrix.id])
+
+        with self.assertNumQueries(0), patch.object(Search, 'execute') as execute:
+            self.assertEqual(self.suggest(q='rel'), [self.reloaded.id])
+        execute.assert_not_called()
+
+    @override_settings(PREMIERS_SEARCH_BACKEND='premiers.search_backends.PostgresSearchBackend')
+    def test_long_prefix_from_memory(self):
+        self.assertEqual(self.suggest(q='matrix'), [self.matrix.id, self.reloaded.id])
+        self.assertEqual(self.suggest(q='matrix re'), [self.reloaded.id])
+        self.assertEqual(self.suggest(q='max'), [self.mad_max.id])
+        self.assertEqual(self.suggest(q='maxx'), [])
+
+    def test_refreshed_on_premier_change(self):
+        self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.mad_max.id, self.reloaded.id])
+        self.mad_max.is_active = False
+        self.mad_max.save()
+
+        # The previous index is served while the new one is built
+        with patch('premiers.suggest.threading.Thread') as thread, self.assertNumQueries(0):
+            self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.mad_max.id, self.reloaded.id])
+        thread.return_value.start.assert_called_once()
+
+        with patch('premiers.suggest.connection'):
+            thread.call_args[1]['target'](*thread.call_args[1]['args'])
+        self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.reloaded.id])
+
+    @override_settings(PREMIERS_SUGGEST_RATINGS_REFRESH_INTERVAL=60)
+    def test_refreshed_on_rating_change(self):
+        self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.mad_max.id, self.reloaded.id])
+        generation = get_premier_suggest_generation()
+        upsert_votes(Premier, [(self.create().id, self.reloaded.id, 1)])
+        self.assertEqual(get_premier_suggest_generation(), generation)
+
+        # Votes don't rebuild the index until the ratings refresh interval passes
+        with patch('premiers.suggest.threading.Thread') as thread:
+            self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.mad_max.id, self.reloaded.id])
+        thread.assert_not_called()
+
+        with patch('premiers.suggest.threading.Thread') as thread, \
+                patch('premiers.suggest.time.monotonic', return_value=time.monotonic() + 60):
+            self.suggest(q='ma')
+        thread.return_value.start.assert_called_once()
+        with patch('premiers.suggest.connection'):
+            thread.call_args[1]['target'](*thread.call_args[1]['args'])
+        self.assertEqual(self.suggest(q='ma'), [self.matrix.id, self.reloaded.id, self.mad_max.id])
+
+    def test_long_prefix_from_elasticsearch(self):
+        def execute(search, *args, **kwargs):
+            self.assertEqual(search.to_dict()['suggest']['names']['text'], 'matrix')
+            self.assertEqual(search._params['request_timeout'], settings.PREMIERS_SUGGEST_TIMEOUT)
+            return SearchResponse(search, {
+                'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []},
+                'suggest': {'names': [{'text': 'matrix', 'offset': 0, 'length': 6, 'options': [
+                    {'text': 'Matrix Reloaded', '_id': str(self.reloaded.id), '_score': 1.0,
+                     '_source': {'id': self.reloaded.id, 'name': 'Matrix Reloaded', 'url': self.reloaded.url}},
+                ]}]},
+            })
+
+        with patch.object(Search, 'execute', autospec=True, side_effect=execute):
+            self.assertEqual(self.suggest(q='Matrix'), [self.reloaded.id])
+
+    def test_elasticsearch_fallback(self):
+        with patch.object(Search, 'execute', side_effect=ESConnectionError('N/A', 'unavailable', None)) as execute:
+            self.assertEqual(self.suggest(q='matrix'), [self.matrix.id, self.reloaded.id])
+            self.assertEqual(self.suggest(q='matrix'), [self.matrix.id, self.reloaded.id])
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+            # ES is not waited for while the breaker is open
+            self.assertEqual(self.suggest(q='matrix'), [self.matrix.id, self.reloaded.id])
+        self.assertEqual(execute.call_count, 2)
@@ -13,6 +13,10 @@ router = SimpleRouter(trailing_slash=True)
 # So, for Premier endpoint it will be
 # List: GET /v1/premiers/ - reverse('v1:premiers:premiers-list')
 # Create: POST /v1/premiers/ - revers('v1:premiers:premiers-list')
+# Vote: POST /v1/premiers/<pk>/vote/ - reverse('v1:premiers:premiers-vote', args=[pk])
+#
+# Prefixed routes go before the empty one
+router.register('comments', views.CommentViewSet, basename='comments')
 router.register('', views.PremierViewSet, basename='premiers')
 
 urlpatterns = [
@@ -1,43 +1,128 @@
-from django.db.models import OuterRef, Subquery, Sum
+import binascii
+import datetime
+import json
+import math
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
 from elasticsearch_dsl import Q, SF
 from elasticsearch_dsl.query import MultiMatch
 
-from premiers.documents import ItemDocument
-from premiers.models import Premier, Comment
+from premiers.cache import get_search_cache_key
+from premiers.models import Premier
+from premiers.search_backends import SearchBadRequest, SearchUnavailable, get_search_backend, search_breaker
 
 
 def subquery_example():
     """An example of how to use Subquery in Django ORM.
 
-    Real world example are much harder
+    Running correlated subquery for every premier on each read is expensive,
+    so top comment is materialized in ``Premier.top_comment``. The Subquery
+    itself moved to ``PremierQuerySet.refresh_top_comment`` which runs on writes
+    """
+    return Premier.objects.filter(is_active=True).select_related('top_comment')
+
+
+def search(phrase, limit=20, offset=0, search_after=None, ordering='relevance', user_id=None):
+    """Search active premiers page by page with the backend selected by ``PREMIERS_SEARCH_BACKEND``
+    (see ``premiers.search_backends``).
+
+    Popular phrases are searched over and over, so pages are cached by normalized phrase
+    for ``PREMIERS_SEARCH_CACHE_TIMEOUT`` seconds. Expired page is kept ``PREMIERS_SEARCH_STALE_TIMEOUT``
+    seconds more: when the backend fails or ``search_breaker`` is open, it is served instead.
+    Without the stale page the first pages are searched by ``PREMIERS_SEARCH_FALLBACK_BACKEND``.
+
+    :param ordering: one of ``SEARCH_ORDERINGS``
+    :return: dict with total ``count``, ``results`` and ``search_after`` of the next page
+        (``None`` if it's the last page)
+    :raise SearchUnavailable: if there is neither stale page nor fallback
+    :raise SearchBadRequest: if the backend rejected the query
     """
-    subquery = Comment.objects.annotate(
-        rating=Sum('votes__rating')
-    ).filter(premier_id=OuterRef("id")).order_by('-rating').values('id')[:1]
-    qs = Premier.objects.filter(is_active=True).annotate(
-        top_comment_id=Subquery(subquery)
-    )
-    return qs
-
-
-def get_search_query(phrase):
-    query = {
-        "bool": {
-            "must": [
-                {
-                    "multi_match": {
-                        "query": phrase,
-                        "fields": ["name", "description"],
-                        "analyzer": "standard"
-                    }
-                }
-            ],
-        }
-    }
-    return ItemDocument.search().query(query)
-
-
-def search(phrase):
-    offset = 0
-    limit = 500
-    return get_search_query(phrase)[offset:limit].to_queryset()
+    params = {'limit': limit, 'offset': offset, 'search_after': search_after, 'ordering': ordering,
+              'user_id': user_id}
+    key = get_search_cache_key(phrase, params)
+    cached = cache.get(key)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+
+    backend = get_search_backend()
+    if search_breaker.allow():
+        start = time.monotonic()
+        # The outcome is recorded on any exit, otherwise the trial call of half-open breaker is never resolved.
+        # Unexpected errors count as failures
+        page, failed = None, True
+        try:
+            page = backend.search(phrase, **params)
+            failed = False
+        except backend.client_errors:
+            failed = False
+            raise SearchBadRequest()
+        except backend.errors:
+            pass
+        finally:
+            search_breaker.record(time.monotonic() - start, failed=failed)
+
+        if page is not None:
+            timeout = settings.PREMIERS_SEARCH_CACHE_TIMEOUT
+            cache.set(key, (time.time() + timeout, page), timeout + settings.PREMIERS_SEARCH_STALE_TIMEOUT)
+            return page
+
+    if cached is not None:
+        return cached[1]
+
+    # ``search_after`` holds sort values of the primary backend, the fallback can't continue from them
+    fallback_path = settings.PREMIERS_SEARCH_FALLBACK_BACKEND
+    if search_after or not fallback_path or fallback_path == settings.PREMIERS_SEARCH_BACKEND:
+        raise SearchUnavailable()
+    return import_string(fallback_path)().search(phrase, **params)
+
+
+def encode_search_after(search_after):
+    """Sort values of the hit are passed to the client as an opaque token"""
+    return urlsafe_b64encode(json.dumps(search_after).encode()).decode().rstrip('=')
+
+
+def decode_search_after(token, ordering='relevance'):
+    """Backends are given only the shape they return for the ordering: the value of the sort field
+    and the premier id. Dates are epoch millis in ElasticSearch and ISO strings in Postgres
+
+    :param ordering: one of ``SEARCH_ORDERINGS``
+    :raise ValueError: if token is not the one built by ``encode_search_after``
+    """
+    try:
+        search_after = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid token")
+    if not isinstance(search_after, list) or len(search_after) != 2:
+        raise ValueError("Invalid token")
+
+    value, premier_id = search_after
+    if ordering in ('premier_at', '-premier_at'):
+        valid = _is_datetime(value)
+    elif ordering == 'rating':
+        valid = isinstance(value, int) and _is_number(value)
+    else:
+        valid = _is_number(value)
+    if not valid:
+        raise ValueError("Invalid token")
+    if not (isinstance(premier_id, int) and _is_number(premier_id)):
+        raise ValueError("Invalid token")
+    return search_after
+
+
+def _is_number(value):
+    # JSON true is bool, which is int too. NaN and Infinity are parsed by ``json``, but can't be compared
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _is_datetime(value):
+    try:
+        if isinstance(value, str):
+            return parse_datetime(value) is not None
+        return _is_number(value) and bool(datetime.datetime.fromtimestamp(value / 1000, datetime.timezone.utc))
+    except (ValueError, OverflowError, OSError):
+        return False
@@ -1,38 +1,270 @@
-from django.db.models import Case, When
+import hashlib
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, Count, Max, Q, Subquery, When
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from drf_yasg.utils import swagger_auto_schema
 from rest_framework import mixins
+from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from cxbootcamp_django_example.cache import get_or_set_locked
+from cxbootcamp_django_example.filters import AliasOrderingFilter
+from cxbootcamp_django_example.paginators import ResultSetPagination, SwitchablePaginationMixin
+from premiers.cache import get_premier_list_cache_key
+from premiers.models import Comment, Premier, Vote
+from premiers import utils
+from premiers.search_backends import get_search_backend
+from premiers.serializers import (
+    PremierSearchPageSerializer, PremierSearchQuerySerializer, PremierSerializer, PremierSuggestionSerializer,
+    PremierSuggestQuerySerializer, VoteSerializer
+)
+from premiers.tasks import flush_votes_buffer
+from premiers.votes import upsert_votes, vote_buffer
+
+
+class VoteMixin:
+    """Adds ``vote`` action to the viewset of ``RatedModel``.
+
+    User has only one vote for the object, voting again changes its rating
+    """
+    lookup_value_regex = r'\d+'
+
+    @swagger_auto_schema(request_body=VoteSerializer, responses={200: VoteSerializer, 202: VoteSerializer})
+    @action(methods=['POST'], detail=True, permission_classes=(IsAuthenticated,))
+    def vote(self, request, *args, **kwargs):
+        """Vote is written by ``upsert_votes``, which returns the new rating as well.
+        So we don't fetch the object and don't aggregate its votes.
+
+        If ``VOTES_BUFFERED`` is enabled, the vote is only pushed to Redis buffer
+        and ``202 Accepted`` is returned without the new rating
+        """
+        serializer = VoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rating = serializer.validated_data['rating']
+        object_id = int(kwargs[self.lookup_field])
+        model = self.get_queryset().model
+
+        if settings.VOTES_BUFFERED:
+            if not self.get_queryset().filter(pk=object_id).exists():
+                raise NotFound()
+
+            content_type_id = ContentType.objects.get_for_model(model).id
+            buffered = vote_buffer.push(request.user.id, content_type_id, object_id, rating)
+            if buffered % settings.VOTES_BUFFER_BATCH_SIZE == 0:
+                flush_votes_buffer.delay()
+            return Response(VoteSerializer({'rating': rating}).data, status=status.HTTP_202_ACCEPTED)
+
+        counters = upsert_votes(model, [(request.user.id, object_id, rating)])
+        if object_id not in counters:
+            raise NotFound()
+
+        total_rating, vote_count = counters[object_id]
+        return Response(VoteSerializer({'rating': rating, 'total_rating': total_rating, 'vote_count': vote_count}).data)
+
+    @swagger_auto_schema(responses={200: VoteSerializer})
+    @vote.mapping.get
+    def get_vote(self, request, *args, **kwargs):
+        """The user's vote is read with ``VoteBuffer.get_user_vote``, so the buffered vote
+        and the rating including it are returned before the flush
+        """
+        object_id = int(kwargs[self.lookup_field])
+        counters = self.get_queryset().filter(pk=object_id).values_list('rating_sum', 'vote_count').first()
+        if counters is None:
+            raise NotFound()
 
-from cxbootcamp_django_example.paginators import ResultSetPagination
-from premiers.models import Premier
-from premiers.serializers import PremierSerializer
+        content_type_id = ContentType.objects.get_for_model(self.get_queryset().model).id
+        rating, total_rating, vote_count = vote_buffer.get_user_vote(request.user.id, content_type_id, object_id,
+                                                                     *counters)
+        return Response(VoteSerializer({'rating': rating, 'total_rating': total_rating, 'vote_count': vote_count}).data)
 
 
-class PremierViewSet(mixins.ListModelMixin,
+class PremierViewSet(VoteMixin,
+                     SwitchablePaginationMixin,
+                     mixins.ListModelMixin,
                      mixins.CreateModelMixin,
                      viewsets.GenericViewSet):
     """
     list:
     Get list of premiers
 
-    Get list of premiers
+    Get list of premiers. By default the list is paginated by page number.
+    Send `pagination=cursor` to switch to cursor pagination, which doesn't count
+    the premiers and costs the same for any page. Then follow `next` and `previous` links.
+
+    Use `ordering` to sort premiers: `-id` (default), `premier_at` or `hot` (trending first).
+    `hot` ordering is available only with page number pagination.
+
+    In page number mode response has `ETag` and `Last-Modified` headers. Send them back in `If-None-Match`
+    and `If-Modified-Since` headers to get `304 Not Modified` without body if nothing changed.
 
     create:
     Create new premier
 
     Create new premier
+
+    search:
+    Search premiers
+
+    Full-text search of premiers by `q` phrase, the most relevant first.
+    Use `ordering` to sort by `premier_at`, `-premier_at` or `rating` instead and `user` to filter by author.
+    Use `page_size` and `offset` for the first pages, then follow `next` link.
+
+    suggest:
+    Suggest premiers names
+
+    Names of premiers starting with `q`, or having a word starting with it. The top rated first.
+    Made for as-you-type suggestions.
+
+    vote:
+    Vote for premier
+
+    Vote for premier with `rating` -1, 0 or 1. Voting again changes the vote.
+    Returns the new rating of premier
+
+    get_vote:
+    Get own vote for premier
+
+    The user's vote for premier (`null` if the user didn't vote) and its rating.
+    Buffered vote is included right away
     """
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    queryset = Premier.objects.filter(is_active=True)
     serializer_class = PremierSerializer
     pagination_class = ResultSetPagination
+    filter_backends = (AliasOrderingFilter,)
+
+    ordering = ('-id',)
+    # Every ordering has the unique tiebreaker and is backed by index
+    ordering_aliases = {
+        '-id': ('-id',),
+        'premier_at': ('premier_at', 'id'),
+        'hot': ('-hot_score', '-id'),
+    }
+    # Hot scores are changed all the time, so they can't be cursor positions
+    cursor_excluded_orderings = ('hot',)
+
+    def get_ordering_aliases(self, request):
+        if self._is_cursor_mode(request):
+            return {key: value for key, value in self.ordering_aliases.items()
+                    if key not in self.cursor_excluded_orderings}
+        return self.ordering_aliases
 
     def get_queryset(self):
+        """``select_related`` fetches the premier's author and top comment in the same query.
+        Otherwise, serializer hits the DB once for each premier
+        """
         today = timezone.now()
-        return Premier.objects.filter(is_active=True).annotate(
+        return super().get_queryset().select_related('user', 'top_comment').annotate(
             is_future=Case(When(premier_at__gt=today, then=True), default=False)
         )
 
+    def list(self, request, *args, **kwargs):
+        """Before any serialization we check whether client already has
+        the actual list (conditional GET). Validators scan all the listed premiers,
+        so they are skipped in cursor pagination mode to keep the page cost constant.
+
+        Response for anonymous users is the same for everybody, so it is cached
+        together with its validators. Cache is invalidated when premiers or votes are changed
+        """
+        if request.user.is_authenticated:
+            etag, last_modified = self.get_list_validators(request)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = super().list(request, *args, **kwargs)
+        else:
+            def build():
+                validators = self.get_list_validators(request)
+                return (*validators, super(PremierViewSet, self).list(request, *args, **kwargs).data)
+
+            etag, last_modified, data = get_or_set_locked(
+                get_premier_list_cache_key(request), build, settings.PREMIERS_LIST_CACHE_TIMEOUT
+            )
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = Response(data)
+
+        if etag is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_list_validators(self, request):
+        """Calculate ``ETag`` and ``Last-Modified`` of the premiers list with one query.
+
+        The list is changed when premier is changed (its rating too,
+        see ``RatedModel.apply_votes``), added or removed, someone votes
+        or premier is released (``is_future`` flips).
+        """
+        if self._is_cursor_mode(request):
+            return None, None
+
+        today = timezone.now()
+        latest_vote = Vote.objects.order_by('-id').values('id')[:1]
+        state = super().get_queryset().aggregate(
+            last_updated_at=Max('last_updated_at'),
+            last_released_at=Max('premier_at', filter=Q(premier_at__lte=today)),
+            count=Count('id'),
+            future_count=Count('id', filter=Q(premier_at__gt=today)),
+            latest_vote_id=Max(Subquery(latest_vote)),
+        )
+
+        # ETag differs for different pages, orderings, versions etc.
+        query = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        source = f'{request.version}:{request.path}?{query}:{sorted(state.items())}'
+        etag = quote_etag(hashlib.md5(source.encode()).hexdigest())  # nosec
+
+        modified = [date for date in (state['last_updated_at'], state['last_released_at']) if date]
+        last_modified = int(max(modified).timestamp()) if modified else 0
+        return etag, last_modified
+
+    @swagger_auto_schema(query_serializer=PremierSearchQuerySerializer,
+                         responses={200: PremierSearchPageSerializer})
+    @action(methods=['GET'], detail=False, filter_backends=(), pagination_class=None)
+    def search(self, request, *args, **kwargs):
+        """Page is fetched from ElasticSearch and rendered from indexed fields without DB queries.
+
+        ``next`` link carries ``search_after`` token instead of offset,
+        so deep pages cost the same as the first one
+        """
+        params = PremierSearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+
+        page = utils.search(params['q'], limit=params['page_size'], offset=params['offset'],
+                            search_after=params.get('search_after'), ordering=params['ordering'],
+                            user_id=params.get('user'))
+
+        next_url = None
+        if page['search_after'] is not None:
+            next_url = remove_query_param(request.build_absolute_uri(), 'offset')
+            next_url = replace_query_param(next_url, 'search_after', utils.encode_search_after(page['search_after']))
+
+        return Response(PremierSearchPageSerializer({
+            'count': page['count'],
+            'next': next_url,
+            'results': page['results'],
+        }).data)
+
+    @swagger_auto_schema(query_serializer=PremierSuggestQuerySerializer,
+                         responses={200: PremierSuggestionSerializer(many=True)})
+    @action(methods=['GET'], detail=False, filter_backends=(), pagination_class=None)
+    def suggest(self, request, *args, **kwargs):
+        """Short prefixes are answered from in-process index, see ``premiers.suggest``"""
+        params = PremierSuggestQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        suggestions = get_search_backend().suggest(params.validated_data['q'], params.validated_data['limit'])
+        return Response(PremierSuggestionSerializer(suggestions, many=True).data)
+
     def perform_create(self, serializer):
         """Overriding perform_create method is an elegant solution on
         sharing dynamic data from view to serializer. Here to
@@ -40,3 +272,21 @@ class PremierViewSet(mixins.ListModelMixin,
         and we don't need to write ``create(...)`` method for PremierSerializer
         """
         serializer.save(user=self.request.user)
+
+
+class CommentViewSet(VoteMixin, viewsets.GenericViewSet):
+    """
+    vote:
+    Vote for comment
+
+    Vote for comment with `rating` -1, 0 or 1. Voting again changes the vote.
+    Returns the new rating of comment
+
+    get_vote:
+    Get own vote for comment
+
+    The user's vote for comment (`null` if the user didn't vote) and its rating.
+    Buffered vote is included right away
+    """
+    queryset = Comment.get_votable_queryset()
+    serializer_class = VoteSerializer
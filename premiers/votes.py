@@ -0,0 +1,230 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from cxbootcamp_django_example.redis import get_redis
+from premiers.cache import invalidate_premier_list_cache
+from premiers.models import Vote
+
+# New votes are inserted first. A concurrent transaction inserting the same vote
+# waits for this one and skips it, so each new vote is counted once. Votes of deleted
+# users (i. e. still buffered) and votes for objects missing in ``votable`` subquery
+# (i. e. inactive premiers) are skipped.
+INSERT_VOTES_SQL = """
+WITH incoming (user_id, object_id, rating) AS (
+    VALUES {values}
+)
+INSERT INTO votes (user_id, content_type_id, object_id, rating, created_at)
+SELECT incoming.user_id, %s, incoming.object_id, incoming.rating, NOW()
+FROM incoming
+JOIN {users} ON {users}.id = incoming.user_id
+WHERE incoming.object_id IN ({votable})
+ON CONFLICT (user_id, content_type_id, object_id) DO NOTHING
+RETURNING object_id, rating
+"""
+
+# Existing votes are locked before their old rating is read, so the concurrent change
+# of the same vote is seen and the counters are shifted by the difference exactly once
+UPDATE_VOTES_SQL = """
+WITH incoming (user_id, object_id, rating) AS (
+    VALUES {values}
+)
+UPDATE votes
+SET rating = locked.rating
+FROM (
+    SELECT votes.id, votes.rating AS old_rating, incoming.rating
+    FROM votes
+    JOIN incoming ON votes.user_id = incoming.user_id AND votes.object_id = incoming.object_id
+    WHERE votes.content_type_id = %s AND votes.rating <> incoming.rating AND votes.object_id IN ({votable})
+    ORDER BY votes.id
+    FOR UPDATE OF votes
+) locked
+WHERE votes.id = locked.id
+RETURNING votes.object_id, locked.rating - locked.old_rating
+"""
+
+# Counters of every voted object are returned, even if its votes didn't change
+UPDATE_COUNTERS_SQL = """
+UPDATE {table}
+SET rating_sum = {table}.rating_sum + deltas.rating_delta,
+    vote_count = {table}.vote_count + deltas.count_delta,
+    last_updated_at = NOW()
+FROM (VALUES {deltas}) AS deltas (object_id, rating_delta, count_delta)
+WHERE {table}.id = deltas.object_id AND {table}.id IN ({votable})
+RETURNING {table}.id, {table}.rating_sum, {table}.vote_count
+"""
+
+# Remove pending votes that were flushed, but only if user didn't change them meanwhile
+RELEASE_PENDING_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 0
+"""
+
+
+def upsert_votes(model, votes):
+    """Write votes for objects of ``model`` in one transaction.
+
+    Votes of a user for an object are unique, so voting again changes
+    the rating in place. Rating counters are updated in the same transaction
+    by the differences returned from INSERT and UPDATE of votes, it doesn't
+    send ``Vote`` signals, but calls ``ratings_changed`` hook.
+    Only objects of ``model.get_votable_queryset()`` are voted for.
+
+    :param model: ``RatedModel`` subclass, i. e. ``Premier``
+    :param votes: iterable of ``(user_id, object_id, rating)``, the last vote wins
+    :return: dict of ``object_id: (rating_sum, vote_count)`` of voted objects
+    """
+    # Postgres can't change the same row twice in one statement.
+    # Sorted votes are locked in the same order by concurrent transactions
+    votes = {(user_id, object_id): rating for user_id, object_id, rating in votes}
+    if not votes:
+        return {}
+    votes = sorted(votes.items())
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    users = connection.ops.quote_name(get_user_model()._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::integer, %s::smallint)'] * len(votes))
+    params = [value for (user_id, object_id), rating in votes for value in (user_id, object_id, rating)]
+    content_type_id = ContentType.objects.get_for_model(model).id
+    votable, votable_params = model.get_votable_queryset().order_by().values('pk').query.sql_with_params()
+
+    deltas = {object_id: [0, 0] for (_, object_id), _ in votes}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            INSERT_VOTES_SQL.format(values=values, users=users, votable=votable),  # nosec
+            [*params, content_type_id, *votable_params]
+        )
+        for object_id, rating in cursor.fetchall():
+            deltas[object_id][0] += rating
+            deltas[object_id][1] += 1
+
+        cursor.execute(
+            UPDATE_VOTES_SQL.format(values=values, votable=votable),  # nosec
+            [*params, content_type_id, *votable_params]
+        )
+        for object_id, rating_delta in cursor.fetchall():
+            deltas[object_id][0] += rating_delta
+
+        deltas_values = ', '.join(['(%s::integer, %s::integer, %s::integer)'] * len(deltas))
+        cursor.execute(
+            UPDATE_COUNTERS_SQL.format(table=table, votable=votable, deltas=deltas_values),  # nosec
+            [*(value for object_id, delta in deltas.items() for value in (object_id, *delta)), *votable_params]
+        )
+        counters = {object_id: (rating_sum, vote_count) for object_id, rating_sum, vote_count in cursor.fetchall()}
+
+    if counters:
+        model.ratings_changed(list(counters))
+    invalidate_premier_list_cache()
+    return counters
+
+
+class VoteBuffer:
+    """Votes are appended to Redis list and written to DB by batches.
+
+    When a premier goes live, users vote a lot. Instead of INSERT and
+    counter UPDATE per vote, ``flush`` writes the whole batch with
+    one transaction per voted model (see ``upsert_votes``).
+
+    Until the vote is flushed, it is kept in Redis hash too, so users
+    see their own votes immediately (see ``get_user_vote``).
+    """
+
+    def __init__(self, prefix='premiers:votes'):
+        self.queue_key = f'{prefix}:queue'
+        self.pending_key = f'{prefix}:pending'
+        self.lock_key = f'{prefix}:flush'
+
+    @staticmethod
+    def _pending_field(user_id, content_type_id, object_id):
+        return f'{user_id}:{content_type_id}:{object_id}'
+
+    def push(self, user_id, content_type_id, object_id, rating):
+        """Add vote to the buffer.
+
+        :return: the number of votes in the buffer. When it reaches
+            ``VOTES_BUFFER_BATCH_SIZE``, it's time to flush without waiting for the schedule
+        """
+        pipe = get_redis().pipeline()
+        pipe.rpush(self.queue_key, json.dumps([user_id, content_type_id, object_id, rating]))
+        pipe.hset(self.pending_key, self._pending_field(user_id, content_type_id, object_id), rating)
+        length, _ = pipe.execute()
+        return length
+
+    def get_pending_vote(self, user_id, content_type_id, object_id):
+        """Rating of the user's vote which is not flushed yet or ``None``"""
+        rating = get_redis().hget(self.pending_key, self._pending_field(user_id, content_type_id, object_id))
+        return None if rating is None else int(rating)
+
+    def get_user_vote(self, user_id, content_type_id, object_id, rating_sum=0, vote_count=0):
+        """Read-your-own-vote. The buffered vote is newer than the one in DB.
+
+        Counters of the object in DB don't include the buffered vote yet,
+        they are returned as if it's flushed already. Votes of other users show up after the flush
+
+        :return: ``(rating, rating_sum, vote_count)``, rating is ``None`` if the user didn't vote
+        """
+        saved = Vote.objects.filter(
+            user_id=user_id, content_type_id=content_type_id, object_id=object_id
+        ).values_list('rating', flat=True).first()
+        pending = self.get_pending_vote(user_id, content_type_id, object_id)
+        if pending is None:
+            return saved, rating_sum, vote_count
+        return pending, rating_sum + pending - (saved or 0), vote_count + (saved is None)
+
+    def __len__(self):
+        return get_redis().llen(self.queue_key)
+
+    def flush(self, batch_size=None, max_batches=None):
+        """Write buffered votes to DB.
+
+        Votes are removed from the buffer only after they are written,
+        so if the worker crashes, they are written again by the next flush.
+        It's safe as writing the same vote twice doesn't change anything.
+        Only one flush runs at a time.
+
+        :return: the number of flushed votes
+        """
+        batch_size = batch_size or settings.VOTES_BUFFER_BATCH_SIZE
+        client = get_redis()
+        lock = client.lock(self.lock_key, timeout=60)
+        if not lock.acquire(blocking=False):
+            return 0
+
+        flushed = 0
+        try:
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                raw_votes = client.lrange(self.queue_key, 0, batch_size - 1)
+                if not raw_votes:
+                    break
+                self._write(json.loads(raw) for raw in raw_votes)
+                client.ltrim(self.queue_key, len(raw_votes), -1)
+                flushed += len(raw_votes)
+                batches += 1
+        finally:
+            lock.release()
+        return flushed
+
+    def _write(self, votes):
+        by_content_type = {}
+        pending = {}
+        for user_id, content_type_id, object_id, rating in votes:
+            by_content_type.setdefault(content_type_id, []).append((user_id, object_id, rating))
+            pending[self._pending_field(user_id, content_type_id, object_id)] = rating
+
+        for content_type_id, model_votes in by_content_type.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            upsert_votes(model, model_votes)
+
+        args = [value for field, rating in pending.items() for value in (field, rating)]
+        get_redis().eval(RELEASE_PENDING_SCRIPT, 1, self.pending_key, *args)
+
+
+vote_buffer = VoteBuffer()
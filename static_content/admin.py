@@ -1,3 +1,22 @@
 from django.contrib import admin
 
-# Register your models here.
+from static_content import models
+
+
+@admin.register(models.ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'name', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('source', 'name', 'error')
+
+
+@admin.register(models.StoredImage)
+class StoredImageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'digest', 'created_at')
+    search_fields = ('name', 'digest')
+
+
+@admin.register(models.MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_at')
+    search_fields = ('name',)
@@ -0,0 +1,49 @@
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+SIGNING_SALT = 'static_content.direct_upload'
+
+
+def get_direct_upload_backend():
+    """Backend is selected by ``IMAGE_DIRECT_UPLOAD_BACKEND`` setting"""
+    return import_string(settings.IMAGE_DIRECT_UPLOAD_BACKEND)()
+
+
+class BaseDirectUploadBackend:
+    """Backend lets the client upload the raw image right to the storage, bypassing API workers.
+
+    The client sends the file to ``url`` by ``method``. For ``POST`` the file is the last field
+    of ``multipart/form-data`` named ``file``, after the given ``fields``. For ``PUT`` the body is the file
+    """
+    def create_upload(self, key):
+        """:return: dict with ``url``, ``method``, ``fields`` and ``expires_at``"""
+        raise NotImplementedError
+
+    @staticmethod
+    def get_expires_at():
+        return timezone.now() + datetime.timedelta(seconds=settings.IMAGE_DIRECT_UPLOAD_EXPIRES)
+
+
+class LocalDirectUploadBackend(BaseDirectUploadBackend):
+    """Stand-in for the storage without signed URLs (i. e. ``FileSystemStorage``) in development and tests.
+
+    The file is uploaded by ``PUT`` to ``LocalDirectUploadView``, which checks the signed key like the storage would
+    """
+    def create_upload(self, key):
+        token = signing.dumps(key, salt=SIGNING_SALT)
+        return {
+            'url': reverse('v1:static_content:image-direct-upload-local', kwargs={'token': token}),
+            'method': 'PUT',
+            'fields': {},
+            'expires_at': self.get_expires_at(),
+        }
+
+    @staticmethod
+    def get_key(token):
+        """:raise signing.BadSignature: if the token is forged or expired"""
+        return signing.loads(token, salt=SIGNING_SALT, max_age=settings.IMAGE_DIRECT_UPLOAD_EXPIRES)
@@ -0,0 +1,214 @@
+import json
+import platform
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import PIL
+from PIL import Image
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from static_content.models import StoredImage
+from static_content.utils import bytes_from_image, get_available_cores, get_variant_formats, resize_image, variant_name
+from static_content.views import ImageUploadView
+
+# Generated images: name -> (format, mode, width, height)
+CASES = {
+    'jpeg-2mp': ('jpeg', 'RGB', 1600, 1200),
+    'jpeg-12mp': ('jpeg', 'RGB', 4000, 3000),
+    'jpeg-40mp': ('jpeg', 'RGB', 7728, 5152),
+    'jpeg-panorama': ('jpeg', 'RGB', 24000, 3000),
+    'png-alpha-4mp': ('png', 'RGBA', 2000, 2000),
+}
+
+# Stages of the upload pipeline measured separately. ``full_decode`` is the reference without JPEG draft
+STAGES = ('full_decode', 'resize', 'encode', 'upload')
+
+
+class Command(BaseCommand):
+    help = "Measure latency, peak memory and throughput of uploaded image processing per image case and stage. " \
+           "Every case and stage is run by a separate process, so its peak RSS is not affected by the others. " \
+           "Results are saved as JSON baseline to compare the next runs with"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', default=','.join(CASES), help=f"Comma separated cases of {', '.join(CASES)}")
+        parser.add_argument('--stages', default=','.join(STAGES), help=f"Comma separated stages of {', '.join(STAGES)}")
+        parser.add_argument('--runs', type=int, default=10, help="The number of runs per case and stage")
+        parser.add_argument('--save-baseline', help="Write results to the JSON file")
+        parser.add_argument('--baseline', help="Compare results with the JSON file written by --save-baseline")
+        parser.add_argument('--threshold', type=float, default=10,
+                            help="Slowdown or memory growth (in percents) reported as regression")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit with error on any regression")
+        # Internal options of the worker process
+        parser.add_argument('--worker', help="Process the given image and print the measurements")
+        parser.add_argument('--stage', choices=STAGES, default='resize')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self._work(options['worker'], options['stage'], options['runs'])))
+            return
+
+        cases, stages = options['cases'].split(','), options['stages'].split(',')
+        unknown = set(cases) - set(CASES) | set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Unknown cases or stages: {', '.join(sorted(unknown))}")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+
+        results, regressions = {}, []
+        for case in cases:
+            img_format, mode, width, height = CASES[case]
+            with tempfile.NamedTemporaryFile(suffix=f'.{img_format}') as f:
+                self._make_image(mode, width, height).save(f, format=img_format)
+                f.flush()
+
+                for stage in stages:
+                    key = f'{case}:{stage}'
+                    results[key] = result = self._run_worker(f.name, stage, options['runs'])
+                    previous = baseline.get(key) if baseline else None
+                    comparison = self._compare(result, previous, options['threshold']) if previous else ''
+                    if '!' in comparison:
+                        regressions.append(key)
+                    self.stdout.write(
+                        f"{case:<14} {stage:<11} p50 {result['p50']:8.2f} ms, p95 {result['p95']:8.2f} ms, "
+                        f"p99 {result['p99']:8.2f} ms, {result['images_per_sec_per_core']:7.2f} img/s/core, "
+                        f"peak RSS +{result['peak_rss_mb']:7.1f} MB{comparison}"
+                    )
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'environment': self._environment(), 'runs': options['runs'], 'results': results}, f,
+                          indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline is saved to {options['save_baseline']}")
+
+        if regressions:
+            message = f"Regressions over {options['threshold']}%: {', '.join(regressions)}"
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+
+    @staticmethod
+    def _make_image(mode, width, height):
+        """Noise makes the image as heavy as a photo, gradient keeps it compressible"""
+        noise = Image.effect_noise((max(width // 8, 1), max(height // 8, 1)), 64).resize((width, height))
+        gradient = Image.linear_gradient('L').resize((width, height))
+        bands = (noise, gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT))
+        return Image.merge(mode, bands[:len(mode)])
+
+    @staticmethod
+    def _compare(result, previous, threshold):
+        """Changes of p50 latency and peak RSS, the ones over the threshold are marked by ``!``.
+        Values below 1 ms and 1 MB are noise, they are compared as 1
+        """
+        changes = []
+        for field, title in (('p50', 'p50'), ('peak_rss_mb', 'RSS')):
+            change = (max(result[field], 1) - max(previous[field], 1)) / max(previous[field], 1) * 100
+            changes.append(f"{title} {change:+.0f}%{'!' if change > threshold else ''}")
+        return f" ({', '.join(changes)})"
+
+    @staticmethod
+    def _environment():
+        return {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'machine': platform.machine(),
+            'cores': get_available_cores(),
+            'image_max_size': settings.IMAGE_MAX_SIZE,
+            'image_default_extension': settings.IMAGE_DEFAULT_EXTENSION,
+            'image_variant_widths': settings.IMAGE_VARIANT_WIDTHS,
+            'image_variant_formats': get_variant_formats() if settings.IMAGE_VARIANTS_PRECOMPUTE else [],
+        }
+
+    @staticmethod
+    def _run_worker(path, stage, runs):
+        command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_images',
+                   '--worker', path, '--stage', stage, '--runs', str(runs)]
+        process = subprocess.run(command, capture_output=True, text=True)  # nosec
+        if process.returncode:
+            raise CommandError(f"Worker failed on {stage}:\n{process.stderr}")
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def _work(self, path, stage, runs):
+        with open(path, 'rb') as f:
+            data = f.read()
+        run = getattr(self, f'_run_{stage}')
+        # Peak RSS is measured from the start, warm-up run is included. Its latency is not measured,
+        # as it loads Pillow plugins and Django modules
+        rss_before = self._peak_rss()
+        with transaction.atomic():
+            run(data)
+            transaction.set_rollback(True)
+
+        timings, cpu_seconds = [], 0
+        with transaction.atomic():
+            for _ in range(runs):
+                start, cpu_start = time.perf_counter(), time.process_time()
+                run(data)
+                timings.append((time.perf_counter() - start) * 1000)
+                cpu_seconds += time.process_time() - cpu_start
+            transaction.set_rollback(True)
+
+        # The process is single-threaded, so images per CPU second is images/sec/core
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive') if runs > 1 else timings * 99
+        return {
+            'p50': percentiles[49], 'p95': percentiles[94], 'p99': percentiles[98], 'max': max(timings),
+            'images_per_sec_per_core': runs / max(cpu_seconds, 1e-9),
+            'peak_rss_mb': (self._peak_rss() - rss_before) / 1024,
+        }
+
+    @staticmethod
+    def _run_full_decode(data):
+        im = Image.open(BytesIO(data))
+        im.load()
+        im.thumbnail((settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE), Image.ANTIALIAS)
+        return bytes_from_image(im, settings.IMAGE_DEFAULT_EXTENSION)
+
+    @staticmethod
+    def _run_resize(data):
+        # Images not larger than the max size are decoded only when they are saved
+        im = resize_image(BytesIO(data))
+        im.load()
+        return im
+
+    def _run_encode(self, data):
+        # Decoding is a separate stage, only the first image is decoded
+        if getattr(self, '_resized', None) is None:
+            self._resized = resize_image(BytesIO(data))
+        return bytes_from_image(self._resized, settings.IMAGE_DEFAULT_EXTENSION)
+
+    @staticmethod
+    def _run_upload(data):
+        """The whole ``ImageUploadView.post``: parsing, hashing, processing, variants and storage writes.
+        Stored image is forgotten after each run, so the next one is not deduplicated
+        """
+        request = APIRequestFactory().post('/', data=data, content_type='image/jpeg')
+        response = ImageUploadView.as_view()(request)
+        if response.status_code != 201:
+            raise CommandError(f"Upload failed: {response.data}")
+
+        name = response.data['name']
+        StoredImage.objects.filter(name=name).delete()
+        default_storage.delete(name)
+        for variant in response.data['variants']:
+            default_storage.delete(variant_name(name, variant['width'], variant['format']))
+
+    @staticmethod
+    def _peak_rss():
+        """Peak RSS of the process in KB. Unlike ``ru_maxrss``, it's reset by exec,
+        so the peak of the parent process (with generated images) is not inherited
+        """
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        raise RuntimeError("Peak RSS is measured on Linux only")
@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from static_content.models import MediaFile
+from static_content.utils import forget_media, record_media
+
+
+class Command(BaseCommand):
+    help = "Sync media files manifest with the storage: add files which are not in the manifest, " \
+           "remove names of deleted files. Raw uploads waiting for processing are skipped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the drift")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stored = set(self._walk(''))
+        known = set(MediaFile.objects.values_list('name', flat=True).iterator())
+        added, removed = sorted(stored - known), sorted(known - stored)
+
+        if not options['dry_run']:
+            batch_size = options['batch_size']
+            for i in range(0, len(added), batch_size):
+                record_media(*added[i:i + batch_size])
+            for i in range(0, len(removed), batch_size):
+                forget_media(*removed[i:i + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Found' if options['dry_run'] else 'Reconciled'}: {len(added)} files not in the manifest, "
+            f"{len(removed)} names of deleted files"
+        ))
+
+    def _walk(self, path):
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            yield os.path.join(path, name) if path else name
+        for directory in directories:
+            directory = os.path.join(path, directory) if path else directory
+            if directory != settings.IMAGE_UPLOADS_DIR:
+                yield from self._walk(directory)
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('source', models.CharField(help_text='Media name of the raw upload, deleted after processing', max_length=255)),
+                ('name', models.CharField(help_text='Media name of the processed image', max_length=255)),
+                ('error', models.TextField(blank=True, default='', help_text='Why processing failed')),
+                ('last_updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, help_text='The user that uploaded the image', null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'image_jobs',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
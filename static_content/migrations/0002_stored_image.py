@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('static_content', '0001_image_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(help_text='Media name of the processed image', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'stored_images',
+            },
+        ),
+        migrations.AddField(
+            model_name='imagejob',
+            name='digest',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the raw upload', max_length=64),
+        ),
+    ]
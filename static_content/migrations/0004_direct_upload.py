@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('static_content', '0003_media_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagejob',
+            name='digest',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the raw upload, direct uploads get it by the task', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+    ]
@@ -1,3 +1,60 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class ImageJob(models.Model):
+    """Uploaded image processed by ``static_content.tasks.process_image`` on ``images`` queue.
+
+    Direct uploads (see ``static_content.direct_upload``) wait for the client in ``uploading`` status
+    """
+    UPLOADING = 'uploading'
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (UPLOADING, 'Uploading'),
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('authentication.User', models.SET_NULL, null=True, blank=True,
+                             help_text="The user that uploaded the image")
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    source = models.CharField(max_length=255, help_text="Media name of the raw upload, deleted after processing")
+    name = models.CharField(max_length=255, help_text="Media name of the processed image")
+    error = models.TextField(blank=True, default='', help_text="Why processing failed")
+    digest = models.CharField(max_length=64, blank=True, default='',
+                              help_text="SHA-256 of the raw upload, direct uploads get it by the task")
+
+    last_updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'image_jobs'
+        ordering = ('-created_at',)
+
+
+class StoredImage(models.Model):
+    """Processed image by SHA-256 of its raw upload, so the same upload is not processed again"""
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, help_text="Media name of the processed image")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'stored_images'
+
+
+class MediaFile(models.Model):
+    """Manifest of media files written by the upload pipeline, so their existence is checked
+    without storage request. See ``static_content.utils.media_exists``
+    """
+    name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'media_files'
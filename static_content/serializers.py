@@ -1,10 +1,14 @@
 from django.core.files.storage import default_storage
 from django.db.models.fields.files import FieldFile
+from drf_yasg.utils import swagger_serializer_method
 from rest_framework import serializers
 from rest_framework.exceptions import NotFound
 from rest_framework.fields import SkipField
 from rest_framework.relations import PKOnlyObject
 
+from static_content.models import ImageJob
+from static_content.utils import get_image_variants, media_exists
+
 
 class ModelFileSerializer(serializers.ModelSerializer):
     """Parent serializer for ones that have models with File fields.
@@ -36,12 +40,72 @@ class ModelFileSerializer(serializers.ModelSerializer):
         return ret
 
 
+class ImageVariantSerializer(serializers.Serializer):
+    width = serializers.IntegerField()
+    format = serializers.CharField()
+    url = serializers.CharField()
+
+
 class ImageUploadSerializer(serializers.Serializer):
     name = serializers.CharField()
     url = serializers.URLField(read_only=True)
+    variants = ImageVariantSerializer(many=True, read_only=True)
 
     def validate_name(self, value):
-        if not default_storage.exists(value):
+        if not media_exists(value):
             error = f"Media file with the name {value} is not found"
             raise NotFound(error)
         return value
+
+
+class ImageBatchResultSerializer(serializers.Serializer):
+    file = serializers.CharField(help_text="The name of the uploaded file")
+    name = serializers.CharField(allow_null=True)
+    url = serializers.CharField(allow_null=True)
+    variants = ImageVariantSerializer(many=True)
+    error = serializers.CharField(allow_null=True, help_text="Why the file is not processed")
+
+
+class ImageFileSerializer(serializers.Serializer):
+    """Read-only image file field with the variants. Empty file is ``None``"""
+    name = serializers.CharField(read_only=True)
+    url = serializers.CharField(read_only=True)
+    variants = ImageVariantSerializer(many=True, read_only=True)
+
+    def to_representation(self, instance):
+        if not instance:
+            return None
+        return super().to_representation({
+            'name': instance.name,
+            'url': default_storage.url(instance.name),
+            'variants': get_image_variants(instance.name),
+        })
+
+
+class ImageJobSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField(help_text="URL of the processed image, when it's done")
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageJob
+        fields = ('id', 'status', 'name', 'url', 'variants', 'error')
+
+    def get_url(self, obj) -> str:
+        return default_storage.url(obj.name) if obj.status == ImageJob.DONE else None
+
+    @swagger_serializer_method(serializer_or_field=ImageVariantSerializer(many=True))
+    def get_variants(self, obj):
+        return get_image_variants(obj.name) if obj.status == ImageJob.DONE else []
+
+
+class DirectUploadTargetSerializer(serializers.Serializer):
+    url = serializers.CharField()
+    method = serializers.CharField(help_text="`PUT` with the image as the body or `POST` of multipart form")
+    fields = serializers.DictField(child=serializers.CharField(),
+                                   help_text="Form fields to send before the `file` field for `POST`")
+    expires_at = serializers.DateTimeField()
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    job = ImageJobSerializer()
+    upload = DirectUploadTargetSerializer()
@@ -0,0 +1,65 @@
+import datetime
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from static_content.models import ImageJob
+from static_content.utils import get_digest, get_stored_image, remember_stored_image, store_image
+
+logger = logging.getLogger("celery")
+
+
+@shared_task
+def process_image(job_id):
+    """Resize and re-encode the raw upload of the job. It runs on CPU-bound ``images`` queue,
+    so web workers only store the upload
+    """
+    # The job is claimed by a single UPDATE, so the task delivered twice processes it once
+    if not ImageJob.objects.filter(pk=job_id, status=ImageJob.PENDING).update(status=ImageJob.PROCESSING):
+        return
+    job = ImageJob.objects.get(pk=job_id)
+
+    try:
+        with default_storage.open(job.source) as f:
+            # Direct uploads bypass the API, so they are hashed here
+            stored_name = None
+            if not job.digest:
+                job.digest = get_digest(f)
+                stored_name = get_stored_image(job.digest)
+
+            if stored_name is None:
+                store_image(f, job.name)
+            else:
+                job.name = stored_name
+    except ValidationError as e:
+        job.status, job.error = ImageJob.FAILED, ' '.join(str(detail) for detail in e.detail)
+    except Exception:
+        logger.exception(f"Failed to process image {job.source}")
+        job.status, job.error = ImageJob.FAILED, "Internal error"
+    else:
+        job.status = ImageJob.DONE
+        if job.digest:
+            remember_stored_image(job.digest, job.name)
+    job.save(update_fields=('status', 'name', 'error', 'digest', 'last_updated_at'))
+    default_storage.delete(job.source)
+
+
+@shared_task
+def expire_direct_uploads():
+    """Fail direct uploads not completed in time and delete their raw files. It runs periodically by Celery Beat"""
+    expires = settings.IMAGE_DIRECT_UPLOAD_EXPIRES + settings.IMAGE_DIRECT_UPLOAD_GRACE
+    jobs = ImageJob.objects.filter(status=ImageJob.UPLOADING,
+                                   created_at__lt=timezone.now() - datetime.timedelta(seconds=expires))
+    expired = 0
+    for job in jobs.only('pk', 'source').iterator():
+        # The job completed meanwhile is left to ``process_image``
+        if ImageJob.objects.filter(pk=job.pk, status=ImageJob.UPLOADING).update(
+                status=ImageJob.FAILED, error="Upload expired", last_updated_at=timezone.now()):
+            default_storage.delete(job.source)
+            expired += 1
+    if expired:
+        logger.info(f"Expired {expired} direct uploads")
@@ -1,11 +1,36 @@
+import datetime
 import io
+import itertools
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
 
 from PIL import Image
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.reverse import reverse
 
 from cxbootcamp_django_example.tests import BaseAPITest
+from static_content import utils
+from static_content.models import ImageJob, MediaFile, StoredImage
+from static_content.serializers import ImageUploadSerializer
+from static_content.tasks import expire_direct_uploads, process_image
+from static_content.utils import (
+    forget_media, get_image_variants, get_variant_formats, media_exists, record_media, resize_image, variant_name
+)
+
+
+def delete_image(name):
+    default_storage.delete(name)
+    for width in settings.IMAGE_VARIANT_WIDTHS:
+        for img_format in get_variant_formats():
+            default_storage.delete(variant_name(name, width, img_format))
 
 
 class TeatImageUploadView(BaseAPITest):
@@ -23,7 +48,7 @@ class TeatImageUploadView(BaseAPITest):
         resp = self.client.post(reverse('v1:static_content:image-upload'), data=self.file, content_type='image/jpeg')
         with default_storage.open(resp.data['name']) as f:
             f.read()
-        default_storage.delete(resp.data['name'])
+        delete_image(resp.data['name'])
         self.assertEqual(resp.status_code, 201)
         self.assertIsNotNone(resp.data['name'])
         self.assertIsNotNone(resp.data['url'])
@@ -42,4 +67,484 @@ class TeatImageUploadView(BaseAPITest):
             im = Image.open(f)
             w, h = im.size
             self.assertLessEqual(w, settings.IMAGE_MAX_SIZE)
-        default_storage.delete(resp.data['name'])
+        delete_image(resp.data['name'])
+
+    @override_settings(IMAGE_MAX_PIXELS=100 * 100)
+    def test_too_many_pixels(self):
+        resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg',
+                                data=self.file)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_upload_png_with_alpha(self):
+        with io.BytesIO() as output:
+            Image.new('RGBA', (300, 200)).save(output, format='png')
+            resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/png',
+                                    data=output.getvalue())
+        self.assertEqual(resp.status_code, 201)
+
+        with default_storage.open(resp.data['name']) as f:
+            im = Image.open(f)
+            self.assertEqual((im.format, im.mode, im.size), ('JPEG', 'RGB', (300, 200)))
+        delete_image(resp.data['name'])
+
+
+class TestResizeImage(BaseAPITest):
+    def test_jpeg_draft(self):
+        with io.BytesIO() as output:
+            Image.new('RGB', (4000, 2000)).save(output, format='jpeg')
+            output.seek(0)
+            im = resize_image(output, size=400)
+
+        # Decoded at 1/8 scale (500x250), then resized
+        self.assertEqual(im.size, (400, 200))
+        self.assertEqual(im.decoderconfig, (8, 0))
+
+    def test_not_image(self):
+        with self.assertRaises(ValidationError):
+            resize_image(io.BytesIO(b'not an image'))
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=True)
+class TestImageProcessingAsync(BaseAPITest):
+    def setUp(self):
+        self.user = self.create_and_login()
+
+        with io.BytesIO() as output:
+            Image.new('RGB', (2000, 1000)).save(output, format='jpeg')
+            self.file = output.getvalue()
+
+    def upload(self, data):
+        with patch('static_content.tasks.process_image.delay', side_effect=process_image) as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg', data=data)
+        return resp, delay
+
+    def test_processed(self):
+        with patch('static_content.tasks.process_image.delay'):
+            resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg',
+                                    data=self.file)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.data['status'], ImageJob.PENDING)
+        self.assertIsNone(resp.data['url'])
+        job = ImageJob.objects.get(pk=resp.data['id'])
+        self.assertEqual(job.user, self.user)
+        self.assertTrue(default_storage.exists(job.source))
+
+        process_image(str(job.pk))
+        resp = self.client.get(resp['Location'])
+        self.assertEqual(resp.data['status'], ImageJob.DONE)
+        self.assertEqual(resp.data['url'], default_storage.url(job.name))
+        self.assertFalse(default_storage.exists(job.source))
+
+        with default_storage.open(job.name) as f:
+            self.assertEqual(Image.open(f).size, (settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE // 2))
+        delete_image(job.name)
+
+    def test_claimed_once(self):
+        with patch('static_content.tasks.process_image.delay'):
+            job_id = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg',
+                                      data=self.file).data['id']
+        ImageJob.objects.filter(pk=job_id).update(status=ImageJob.PROCESSING)
+
+        with patch('static_content.tasks.store_image') as store_image:
+            process_image(str(job_id))
+        store_image.assert_not_called()
+        self.assertEqual(ImageJob.objects.get(pk=job_id).status, ImageJob.PROCESSING)
+        default_storage.delete(ImageJob.objects.get(pk=job_id).source)
+
+    def test_task_queued_after_commit(self):
+        resp, delay = self.upload(self.file)
+        delay.assert_called_once_with(str(resp.data['id']))
+        self.assertEqual(ImageJob.objects.get(pk=resp.data['id']).status, ImageJob.DONE)
+        delete_image(resp.data['name'])
+
+    def test_not_image(self):
+        resp, delay = self.upload(b'not an image')
+        self.assertEqual(resp.status_code, 400)
+        delay.assert_not_called()
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_failed(self):
+        # The header is valid, the data is truncated
+        resp, _ = self.upload(self.file[:1000])
+        job = ImageJob.objects.get(pk=resp.data['id'])
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertIn('Wrong image format', job.error)
+        self.assertFalse(default_storage.exists(job.source))
+        self.assertFalse(default_storage.exists(job.name))
+
+
+class TestImageVariants(BaseAPITest):
+    def setUp(self):
+        with io.BytesIO() as output:
+            Image.new('RGB', (1000, 500)).save(output, format='jpeg')
+            self.file = output.getvalue()
+
+    def upload(self):
+        resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg', data=self.file)
+        self.addCleanup(delete_image, resp.data['name'])
+        return resp
+
+    @override_settings(IMAGE_VARIANT_WIDTHS=[320, 640, 1280], IMAGE_VARIANT_FORMATS=['jpeg', 'unknown'])
+    def test_precomputed(self):
+        resp = self.upload()
+        name = resp.data['name']
+
+        self.assertEqual(resp.data['variants'], [
+            {'width': width, 'format': 'jpeg', 'url': default_storage.url(variant_name(name, width, 'jpeg'))}
+            for width in (320, 640, 1280)
+        ])
+        for width, size in ((320, (320, 160)), (640, (640, 320)), (1280, (1000, 500))):
+            with default_storage.open(variant_name(name, width, 'jpeg')) as f:
+                self.assertEqual(Image.open(f).size, size)
+
+        # Variants added after the upload are generated on the first request
+        with override_settings(IMAGE_VARIANT_WIDTHS=[320, 480]):
+            variants = get_image_variants(name)
+            self.assertEqual([variant['url'] for variant in variants], [
+                default_storage.url(variant_name(name, 320, 'jpeg')),
+                reverse('v1:static_content:image-variant', kwargs={'name': name, 'width': 480, 'img_format': 'jpeg'}),
+            ])
+            self.addCleanup(default_storage.delete, variant_name(name, 480, 'jpeg'))
+            self.assertEqual(self.client.get(variants[1]['url']).status_code, 302)
+
+    @override_settings(IMAGE_VARIANTS_PRECOMPUTE=False, IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'])
+    def test_lazy(self):
+        resp = self.upload()
+        name = resp.data['name']
+        variant = variant_name(name, 320, 'jpeg')
+        self.assertFalse(default_storage.exists(variant))
+
+        url = resp.data['variants'][0]['url']
+        self.assertEqual(url, reverse('v1:static_content:image-variant',
+                                      kwargs={'name': name, 'width': 320, 'img_format': 'jpeg'}))
+        resp = self.client.get(url)
+        self.assertRedirects(resp, default_storage.url(variant), fetch_redirect_response=False)
+        with default_storage.open(variant) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+
+        # The stored variant is not generated again
+        with patch('static_content.views.save_image') as save_image:
+            self.client.get(url)
+        save_image.assert_not_called()
+
+    @override_settings(IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'])
+    def test_variant_not_found(self):
+        url = reverse('v1:static_content:image-variant', kwargs={'name': 'absent.jpeg', 'width': 320,
+                                                                 'img_format': 'jpeg'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('v1:static_content:image-variant', kwargs={'name': 'absent.jpeg', 'width': 321,
+                                                                 'img_format': 'jpeg'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TestImageDeduplication(BaseAPITest):
+    def setUp(self):
+        with io.BytesIO() as output:
+            Image.new('RGB', (300, 200)).save(output, format='jpeg')
+            self.file = output.getvalue()
+
+    def upload(self):
+        resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg', data=self.file)
+        self.addCleanup(delete_image, resp.data['name'])
+        return resp
+
+    def test_same_image(self):
+        name = self.upload().data['name']
+        self.assertEqual(StoredImage.objects.get().name, name)
+
+        with patch('static_content.views.store_image') as store_image:
+            resp = self.upload()
+        store_image.assert_not_called()
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['name'], name)
+        self.assertEqual(resp.data['url'], default_storage.url(name))
+
+    def test_deleted_image(self):
+        name = self.upload().data['name']
+        default_storage.delete(name)
+        forget_media(name)
+
+        resp = self.upload()
+        self.assertNotEqual(resp.data['name'], name)
+        self.assertEqual(StoredImage.objects.get().name, resp.data['name'])
+
+    @override_settings(IMAGE_PROCESSING_ASYNC=True)
+    def test_same_image_async(self):
+        with patch('static_content.tasks.process_image.delay', side_effect=process_image), \
+                self.captureOnCommitCallbacks(execute=True):
+            resp = self.upload()
+        self.assertEqual(resp.status_code, 202)
+
+        resp = self.upload()
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['name'], ImageJob.objects.get().name)
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'], IMAGE_BATCH_WORKERS=2)
+class TestImageBatchUpload(BaseAPITest):
+    def setUp(self):
+        self.user = self.create_and_login()
+        self.user.is_staff = True
+        self.user.save()
+
+    def image(self, filename, size):
+        with io.BytesIO() as output:
+            Image.new('RGB', size).save(output, format='jpeg')
+            file = io.BytesIO(output.getvalue())
+        file.name = filename
+        return file
+
+    def upload(self, files):
+        resp = self.client.post(reverse('v1:static_content:image-batch-upload'), data={'files': files},
+                                format='multipart')
+        for result in resp.data if resp.status_code == 200 else ():
+            if result['name']:
+                self.addCleanup(delete_image, result['name'])
+        return resp
+
+    def test_admin_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.upload([self.image('first.jpeg', (10, 10))]).status_code, 403)
+        self.logout()
+        self.assertEqual(self.upload([self.image('first.jpeg', (10, 10))]).status_code, 401)
+
+    def test_batch(self):
+        broken = io.BytesIO(b'not an image')
+        broken.name = 'broken.jpeg'
+        files = [self.image('wide.jpeg', (2000, 1000)), broken, self.image('small.jpeg', (200, 100))]
+
+        resp = self.upload(files)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([result['file'] for result in resp.data], ['wide.jpeg', 'broken.jpeg', 'small.jpeg'])
+
+        wide, broken, small = resp.data
+        self.assertIsNone(broken['name'])
+        self.assertIn('Wrong image format', broken['error'])
+        for result, size in ((wide, (settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE // 2)), (small, (200, 100))):
+            self.assertIsNone(result['error'])
+            self.assertEqual(result['url'], default_storage.url(result['name']))
+            with default_storage.open(result['name']) as f:
+                self.assertEqual(Image.open(f).size, size)
+            self.assertTrue(default_storage.exists(variant_name(result['name'], 320, 'jpeg')))
+
+    def test_same_images(self):
+        name = self.upload([self.image('first.jpeg', (300, 200))]).data[0]['name']
+
+        with patch('static_content.utils.get_process_pool') as get_process_pool:
+            resp = self.upload([self.image('second.jpeg', (300, 200)), self.image('third.jpeg', (300, 200))])
+        # Nothing to process, the pool is not even started
+        get_process_pool.assert_not_called()
+        self.assertEqual([result['name'] for result in resp.data], [name, name])
+
+    @override_settings(IMAGE_BATCH_MAX_FILES=1)
+    def test_too_many_files(self):
+        resp = self.upload([self.image('first.jpeg', (10, 10)), self.image('second.jpeg', (20, 20))])
+        self.assertEqual(resp.status_code, 400)
+
+    def test_too_large(self):
+        files = [self.image('first.jpeg', (10, 10)), self.image('second.jpeg', (20, 20))]
+        with override_settings(IMAGE_BATCH_MAX_SIZE=len(files[0].getvalue()) + len(files[1].getvalue()) - 1):
+            resp = self.upload(files)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_broken_pool(self):
+        broken = MagicMock()
+        broken.map.side_effect = BrokenProcessPool
+        with patch('static_content.utils._process_pool', broken):
+            resp = self.upload([self.image('first.jpeg', (10, 10))])
+            self.assertEqual(resp.status_code, 503)
+            self.assertIsNone(utils._process_pool)
+        broken.shutdown.assert_called_once_with(wait=False)
+
+    def test_failed_write_cleaned(self):
+        written, calls = [], itertools.count()
+
+        def save_file(name, content):
+            # Writes run in threads, so only the counter tells the first one reliably
+            if next(calls):
+                raise OSError("No space left on device")
+            written.append(default_storage.save(name, ContentFile(content)))
+            return written[-1]
+
+        with patch('static_content.views.save_file', side_effect=save_file), self.assertRaises(OSError):
+            self.upload([self.image('first.jpeg', (400, 200))])
+        self.assertEqual(len(written), 1)
+        self.assertFalse(default_storage.exists(written[0]))
+        self.assertFalse(MediaFile.objects.exists())
+
+
+class TestMediaManifest(BaseAPITest):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(IMAGE_VARIANT_WIDTHS=[320], IMAGE_VARIANT_FORMATS=['jpeg'])
+    def test_upload_recorded(self):
+        with io.BytesIO() as output:
+            Image.new('RGB', (500, 500)).save(output, format='jpeg')
+            resp = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg',
+                                    data=output.getvalue())
+        name = resp.data['name']
+        self.addCleanup(delete_image, name)
+
+        self.assertEqual(set(MediaFile.objects.values_list('name', flat=True)), {name, variant_name(name, 320, 'jpeg')})
+        with patch.object(default_storage, 'exists') as exists:
+            self.assertTrue(media_exists(name))
+        exists.assert_not_called()
+
+    def test_missing_cached(self):
+        with patch.object(default_storage, 'exists', return_value=False) as exists:
+            self.assertFalse(media_exists('absent.jpeg'))
+            self.assertFalse(media_exists('absent.jpeg'))
+        exists.assert_called_once_with('absent.jpeg')
+
+        record_media('absent.jpeg')
+        self.assertTrue(media_exists('absent.jpeg'))
+
+    def test_unknown_file_recorded(self):
+        with patch.object(default_storage, 'exists', return_value=True) as exists:
+            self.assertTrue(media_exists('logo.jpeg'))
+            self.assertTrue(media_exists('logo.jpeg'))
+        exists.assert_called_once_with('logo.jpeg')
+
+    def test_validate_name(self):
+        record_media('logo.jpeg')
+        with patch.object(default_storage, 'exists', return_value=False) as exists:
+            self.assertTrue(ImageUploadSerializer(data={'name': 'logo.jpeg'}).is_valid())
+            with self.assertRaises(NotFound):
+                ImageUploadSerializer(data={'name': 'absent.jpeg'}).is_valid()
+        exists.assert_called_once_with('absent.jpeg')
+
+    def test_reconcile(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for name in ('new.jpeg', 'known.jpeg', 'logos/new.jpeg', f'{settings.IMAGE_UPLOADS_DIR}/raw.jpeg'):
+                default_storage.save(name, ContentFile(b'image'))
+            record_media('known.jpeg', 'deleted.jpeg')
+
+            call_command('reconcile_media_manifest', dry_run=True, stdout=io.StringIO())
+            self.assertEqual(set(MediaFile.objects.values_list('name', flat=True)), {'known.jpeg', 'deleted.jpeg'})
+
+            call_command('reconcile_media_manifest', stdout=io.StringIO())
+            self.assertEqual(set(MediaFile.objects.values_list('name', flat=True)),
+                             {'new.jpeg', 'known.jpeg', 'logos/new.jpeg'})
+
+
+class TestDirectUpload(BaseAPITest):
+    def setUp(self):
+        self.user = self.create_and_login()
+
+        with io.BytesIO() as output:
+            Image.new('RGB', (2000, 1000)).save(output, format='jpeg')
+            self.file = output.getvalue()
+
+    def start(self):
+        resp = self.client.post(reverse('v1:static_content:image-direct-upload'))
+        self.addCleanup(default_storage.delete, ImageJob.objects.get(pk=resp.data['job']['id']).source)
+        return resp
+
+    def put(self, upload, data=None):
+        return self.client.put(upload['url'], data=self.file if data is None else data, content_type='image/jpeg')
+
+    def complete(self, job_id):
+        with patch('static_content.tasks.process_image.delay', side_effect=process_image) as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('v1:static_content:image-direct-upload-complete', args=(job_id,)))
+        return resp, delay
+
+    def test_uploaded(self):
+        resp = self.start()
+        self.assertEqual(resp.status_code, 201)
+        job, upload = resp.data['job'], resp.data['upload']
+        self.assertEqual(job['status'], ImageJob.UPLOADING)
+        self.assertEqual(upload['method'], 'PUT')
+
+        self.assertEqual(self.put(upload).status_code, 204)
+        self.assertEqual(self.put(upload).status_code, 400)
+
+        resp, delay = self.complete(job['id'])
+        self.assertEqual(resp.status_code, 202)
+        delay.assert_called_once_with(str(job['id']))
+        self.addCleanup(delete_image, job['name'])
+
+        resp = self.client.get(resp['Location'])
+        self.assertEqual(resp.data['status'], ImageJob.DONE)
+        self.assertFalse(default_storage.exists(ImageJob.objects.get(pk=job['id']).source))
+        with default_storage.open(job['name']) as f:
+            self.assertEqual(Image.open(f).size, (settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE // 2))
+
+        resp, delay = self.complete(job['id'])
+        self.assertEqual(resp.status_code, 404)
+        delay.assert_not_called()
+
+    def test_invalid_upload_url(self):
+        upload = self.start().data['upload']
+        forged = {**upload, 'url': upload['url'].replace(':', 'x:', 1)}
+        self.assertEqual(self.put(forged).status_code, 403)
+        with override_settings(IMAGE_DIRECT_UPLOAD_EXPIRES=-1):
+            self.assertEqual(self.put(upload).status_code, 403)
+        with override_settings(IMAGE_DIRECT_UPLOAD_MAX_SIZE=len(self.file) - 1):
+            self.assertEqual(self.put(upload).status_code, 400)
+        self.assertEqual(self.put(upload, b'').status_code, 400)
+
+    def test_renamed_upload_rejected(self):
+        upload = self.start().data['upload']
+        self.put(upload)
+        uploads = default_storage.listdir(settings.IMAGE_UPLOADS_DIR)
+
+        # The file is saved by another request after the check of the view
+        checks, exists = itertools.count(), default_storage.exists
+        with patch.object(default_storage, 'exists', side_effect=lambda name: next(checks) and exists(name)):
+            self.assertEqual(self.put(upload).status_code, 400)
+        self.assertEqual(default_storage.listdir(settings.IMAGE_UPLOADS_DIR), uploads)
+
+    def test_expired(self):
+        expired, pending = self.start().data, self.start().data
+        self.put(expired['upload'])
+        self.put(pending['upload'])
+        expires = settings.IMAGE_DIRECT_UPLOAD_EXPIRES + settings.IMAGE_DIRECT_UPLOAD_GRACE
+        ImageJob.objects.filter(pk=expired['job']['id']).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=expires + 1))
+
+        expire_direct_uploads()
+        job = ImageJob.objects.get(pk=expired['job']['id'])
+        self.assertEqual((job.status, job.error), (ImageJob.FAILED, "Upload expired"))
+        self.assertFalse(default_storage.exists(job.source))
+        job = ImageJob.objects.get(pk=pending['job']['id'])
+        self.assertEqual(job.status, ImageJob.UPLOADING)
+        self.assertTrue(default_storage.exists(job.source))
+
+        resp, delay = self.complete(expired['job']['id'])
+        self.assertEqual(resp.status_code, 404)
+        delay.assert_not_called()
+
+    def test_not_uploaded(self):
+        job = self.start().data['job']
+        resp, delay = self.complete(job['id'])
+        self.assertEqual(resp.status_code, 400)
+        delay.assert_not_called()
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.UPLOADING)
+
+    def test_other_user(self):
+        resp = self.start()
+        self.put(resp.data['upload'])
+
+        self.create_and_login(email='other@mail.com')
+        resp, delay = self.complete(resp.data['job']['id'])
+        self.assertEqual(resp.status_code, 404)
+        delay.assert_not_called()
+
+    def test_same_image(self):
+        name = self.client.post(reverse('v1:static_content:image-upload'), content_type='image/jpeg',
+                                data=self.file).data['name']
+        self.addCleanup(delete_image, name)
+
+        resp = self.start()
+        self.put(resp.data['upload'])
+        with patch('static_content.tasks.store_image') as store_image:
+            self.complete(resp.data['job']['id'])
+        store_image.assert_not_called()
+
+        job = ImageJob.objects.get(pk=resp.data['job']['id'])
+        self.assertEqual((job.status, job.name), (ImageJob.DONE, name))
+        self.assertFalse(default_storage.exists(job.source))
@@ -1,9 +1,19 @@
 from django.urls import path
 
-from static_content.views import ImageUploadView
+from static_content.views import (
+    DirectUploadCompleteView, DirectUploadView, ImageBatchUploadView, ImageJobView, ImageUploadView, ImageVariantView,
+    LocalDirectUploadView,
+)
 
 app_name = 'static_content'
 
 urlpatterns = [
     path('image/', ImageUploadView.as_view(), name='image-upload'),
+    path('image/batch/', ImageBatchUploadView.as_view(), name='image-batch-upload'),
+    path('image/direct/', DirectUploadView.as_view(), name='image-direct-upload'),
+    path('image/direct/<uuid:pk>/complete/', DirectUploadCompleteView.as_view(), name='image-direct-upload-complete'),
+    path('image/direct/local/<str:token>/', LocalDirectUploadView.as_view(), name='image-direct-upload-local'),
+    path('image/jobs/<uuid:pk>/', ImageJobView.as_view(), name='image-job'),
+    path('image/variants/<int:width>/<str:img_format>/<str:name>/', ImageVariantView.as_view(),
+         name='image-variant'),
 ]
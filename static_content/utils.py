@@ -1,11 +1,21 @@
+import hashlib
+import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 
 from PIL import Image
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.urls import reverse
 from django.utils import timezone
-from rest_framework.exceptions import ValidationError
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from static_content.models import MediaFile, StoredImage
 
 
 def filename_generator():
@@ -21,21 +31,124 @@ def upload_to(instance, filename):
     return f"{filename_generator()}.{ext}"
 
 
-def resize_image(image):
-    """Resize image to max width and return it
+def get_missing_media_key(name):
+    return f'media:missing:{hashlib.md5(name.encode()).hexdigest()}'  # nosec
+
+
+def media_exists(name):
+    """Whether the media file exists. Files written by the upload pipeline are found in ``MediaFile`` manifest,
+    missing ones are cached for ``MEDIA_MISSING_CACHE_TIMEOUT`` seconds. Storage is requested only
+    when neither knows the name, i. e. for files saved by model fields
+    """
+    if MediaFile.objects.filter(name=name).exists():
+        return True
+    key = get_missing_media_key(name)
+    if cache.get(key):
+        return False
+
+    if default_storage.exists(name):
+        record_media(name)
+        return True
+    cache.set(key, True, settings.MEDIA_MISSING_CACHE_TIMEOUT)
+    return False
+
+
+def record_media(*names):
+    """Add written files to the manifest"""
+    MediaFile.objects.bulk_create((MediaFile(name=name) for name in names), ignore_conflicts=True)
+    cache.delete_many([get_missing_media_key(name) for name in names])
+
+
+def forget_media(*names):
+    """Remove deleted files from the manifest"""
+    MediaFile.objects.filter(name__in=names).delete()
+
+
+def get_digest(file):
+    """SHA-256 of the uploaded file, which is read by chunks and rewound"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def get_stored_image(digest):
+    """Name of the image processed from the upload with the same digest, if it's still in the storage"""
+    stored = StoredImage.objects.filter(digest=digest).first()
+    if stored is None:
+        return None
+    if not media_exists(stored.name):
+        stored.delete()
+        return None
+    return stored.name
+
+
+def remember_stored_image(digest, name):
+    StoredImage.objects.get_or_create(digest=digest, defaults={'name': name})
+
+
+def open_image(image):
+    """Open image without decoding it. Pillow reads the header only, so the size is checked
+    before the bitmap is allocated
+
+    :raise ValidationError: if the file is not an image or has more pixels than ``IMAGE_MAX_PIXELS``
     """
     try:
         im = Image.open(image)
-        im.thumbnail((settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE), Image.ANTIALIAS)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValidationError(f"Wrong image format. {e}")
+
+    width, height = im.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(f"Image is too large ({width}x{height}), "
+                              f"max number of pixels is {settings.IMAGE_MAX_PIXELS}")
+    return im
+
+
+def resize_image(image, size=None):
+    """Resize image to max width and return it.
+
+    JPEG is decoded at the smallest DCT scale (1/2, 1/4 or 1/8) which is still not smaller
+    than the target size, so 40-megapixel photo never takes the memory of full bitmap
+    """
+    size = size or settings.IMAGE_MAX_SIZE
+    im = open_image(image)
+    # The size of the result, draft scale must keep both sides not smaller than it
+    ratio = min(size / im.width, size / im.height, 1)
+    try:
+        im.draft('RGB', (max(round(im.width * ratio), 1), max(round(im.height * ratio), 1)))
+        im.thumbnail((size, size), Image.ANTIALIAS)
     except OSError as e:
         raise ValidationError(f"Wrong image format. {e}")
 
     return im
 
 
+def save_image(image, name, img_format='jpeg'):
+    """Encode pillow image right into the storage file without extra copy in memory"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    with default_storage.open(name, 'wb') as f:
+        image.save(f, format=img_format)
+    record_media(name)
+    return name
+
+
+def save_file(name, content):
+    """Write bytes into the storage file. Unlike ``save_image``, it doesn't touch DB, so it's called from threads.
+    Caller records the file by ``record_media``
+    """
+    with default_storage.open(name, 'wb') as f:
+        f.write(content)
+    return name
+
+
 def bytes_from_image(image, img_format='jpeg'):
     """Converts pillow image file to bytes"""
-    image = image.convert('RGB')
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
 
     # Pay attention to io package
     # This is the elegant interface to file-buffers
@@ -44,3 +157,133 @@ def bytes_from_image(image, img_format='jpeg'):
         image.save(output, format=img_format)
         contents = output.getvalue()
     return contents
+
+
+def store_image(file, name):
+    """Resize uploaded image and save it. When ``IMAGE_VARIANTS_PRECOMPUTE`` is enabled,
+    the variants are made from the same decoded image
+    """
+    image = resize_image(file)
+    save_image(image, name, settings.IMAGE_DEFAULT_EXTENSION)
+    if settings.IMAGE_VARIANTS_PRECOMPUTE:
+        save_variants(image, name)
+    return image
+
+
+def get_variant_formats():
+    """Configured formats which Pillow can save, i. e. AVIF needs ``pillow-avif-plugin``"""
+    Image.init()
+    return [img_format for img_format in settings.IMAGE_VARIANT_FORMATS if img_format.upper() in Image.SAVE]
+
+
+def variant_name(name, width, img_format):
+    """Variants are stored next to the image"""
+    return f'{os.path.splitext(name)[0]}_{width}w.{img_format}'
+
+
+def make_variant(image, width):
+    """Resize image to the width, narrower images are not upscaled"""
+    if image.width <= width:
+        return image
+    return image.resize((width, max(round(image.height * width / image.width), 1)), Image.ANTIALIAS)
+
+
+def iter_variants(image):
+    """All the variants of the image as ``(width, format, image)``.
+    Each width is resized from the previous larger one
+    """
+    for width in sorted(settings.IMAGE_VARIANT_WIDTHS, reverse=True):
+        image = make_variant(image, width)
+        for img_format in get_variant_formats():
+            yield width, img_format, image
+
+
+def save_variants(image, name):
+    for width, img_format, variant in iter_variants(image):
+        save_image(variant, variant_name(name, width, img_format), img_format)
+
+
+def get_image_variants(name):
+    """URLs of all the variants of the image for ``srcset``.
+
+    Variants in ``MediaFile`` manifest are linked directly. The others (not precomputed or added
+    to ``IMAGE_VARIANT_WIDTHS`` after the upload) are generated by ``ImageVariantView`` on the first request
+    :return: list of ``{'width', 'format', 'url'}``
+    """
+    names = {(width, img_format): variant_name(name, width, img_format)
+             for width in sorted(settings.IMAGE_VARIANT_WIDTHS) for img_format in get_variant_formats()}
+    # One query for all the variants, the storage is not requested
+    stored = set(MediaFile.objects.filter(name__in=names.values()).values_list('name', flat=True))
+
+    variants = []
+    for (width, img_format), variant in names.items():
+        if variant in stored:
+            url = default_storage.url(variant)
+        else:
+            url = reverse('v1:static_content:image-variant',
+                          kwargs={'name': name, 'width': width, 'img_format': img_format})
+        variants.append({'width': width, 'format': img_format, 'url': url})
+    return variants
+
+
+def encode_image(data):
+    """Resize and encode the image and its variants (if ``IMAGE_VARIANTS_PRECOMPUTE``).
+    It runs in the process pool, so takes and returns bytes only
+
+    :return: dict with encoded ``image`` and ``variants`` - list of ``(width, format, bytes)``,
+        or with ``error`` if the data is not a valid image
+    """
+    try:
+        image = resize_image(BytesIO(data))
+    except ValidationError as e:
+        return {'error': ' '.join(str(detail) for detail in e.detail)}
+
+    encoded = {'image': bytes_from_image(image, settings.IMAGE_DEFAULT_EXTENSION), 'variants': []}
+    if settings.IMAGE_VARIANTS_PRECOMPUTE:
+        encoded['variants'] = [(width, img_format, bytes_from_image(variant, img_format))
+                               for width, img_format, variant in iter_variants(image)]
+    return encoded
+
+
+def get_available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+_process_pool = None
+
+
+def get_process_pool():
+    """Image processing pool of this web worker, it's started on the first use.
+
+    Its size is ``IMAGE_BATCH_WORKERS`` or the number of cores available to the process
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.IMAGE_BATCH_WORKERS or get_available_cores())
+    return _process_pool
+
+
+class ImageProcessingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Image processing is temporarily unavailable, try again later"
+    default_code = 'image_processing_unavailable'
+
+
+def map_in_process_pool(func, iterable):
+    """``map`` by the process pool of this web worker. When any of its processes dies (i. e. killed by OOM),
+    the pool is broken and fails every task. It's dropped, so the next call starts the new one
+
+    :raise ImageProcessingUnavailable: if the pool is broken
+    """
+    global _process_pool
+    pool = get_process_pool()
+    try:
+        yield from pool.map(func, iterable)
+    except BrokenProcessPool:
+        if _process_pool is pool:
+            _process_pool = None
+        pool.shutdown(wait=False)
+        raise ImageProcessingUnavailable()
@@ -1,15 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
 from django.conf import settings
+from django.core import signing
+from django.core.files import File
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.shortcuts import get_object_or_404, redirect
 from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg.utils import no_body, swagger_auto_schema
 from rest_framework import status
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.generics import RetrieveAPIView
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
+from static_content.direct_upload import LocalDirectUploadBackend, get_direct_upload_backend
+from static_content.models import ImageJob
 from static_content.parsers import ImageUploadParser
-from static_content.serializers import ImageUploadSerializer
-from static_content.utils import resize_image, bytes_from_image
+from static_content.serializers import (
+    DirectUploadSerializer, ImageBatchResultSerializer, ImageJobSerializer, ImageUploadSerializer
+)
+from static_content.tasks import process_image
+from static_content.utils import (
+    encode_image, filename_generator, get_digest, get_image_variants, get_stored_image, get_variant_formats,
+    make_variant, map_in_process_pool, media_exists, open_image, record_media, remember_stored_image, resize_image,
+    save_file, save_image, store_image, variant_name,
+)
 
 
 class ImageUploadView(APIView):
@@ -20,24 +40,245 @@ class ImageUploadView(APIView):
     You need to specify `Content-Type` header to `image/*` value, i. e. `image/jpeg`.
 
     Image is finally rescaled to have max width defined in settings (right now it's 600px).
+
+    When `IMAGE_PROCESSING_ASYNC` is enabled, the raw image is stored and processed by Celery.
+    The response is `202` with the job, poll its status by `GET /static/image/jobs/<id>/`.
+
+    Image which was already uploaded (the same bytes) is not processed again, `201` with the stored image is returned.
     """
     parser_classes = (ImageUploadParser, )
     serializer_class = ImageUploadSerializer
 
     @swagger_auto_schema(
         request_body=openapi.Schema('Image', 'image binary', type=openapi.TYPE_FILE, format=openapi.FORMAT_BINARY),
-        responses={201: ImageUploadSerializer}
+        responses={201: ImageUploadSerializer, 202: ImageJobSerializer}
     )
     def post(self, request):
         file: UploadedFile = request.data['file']
+        digest = get_digest(file)
+        name = get_stored_image(digest)
+        if name is None:
+            if settings.IMAGE_PROCESSING_ASYNC:
+                return self.post_async(request, file, digest)
+
+            store_image(file, file.name)
+            remember_stored_image(digest, file.name)
+            name = file.name
 
-        with default_storage.open(file.name, 'wb') as f:
-            f.write(self.preprocess_image(file))
-        url = default_storage.url(file.name)
-        serializer = self.serializer_class({'name': file.name, 'url': url})
+        url = default_storage.url(name)
+        serializer = self.serializer_class({'name': name, 'url': url, 'variants': get_image_variants(name)})
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
-    def preprocess_image(self, file):
-        """Preload image by Pillow and resize before uploading on S3"""
-        im = resize_image(file)
-        return bytes_from_image(im, settings.IMAGE_DEFAULT_EXTENSION)
+    def post_async(self, request, file, digest):
+        """Store the raw image as is. The header is still checked, so not images are rejected right away"""
+        open_image(file)
+        file.seek(0)
+        source = default_storage.save(f'{settings.IMAGE_UPLOADS_DIR}/{file.name}', file)
+
+        user = request.user if request.user.is_authenticated else None
+        job = ImageJob.objects.create(user=user, source=source, name=file.name, digest=digest)
+        transaction.on_commit(lambda: process_image.delay(str(job.pk)))
+
+        location = reverse('v1:static_content:image-job', args=(job.pk,), request=request)
+        return Response(data=ImageJobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+
+class ImageBatchUploadView(APIView):
+    """
+    Upload several images at once
+
+    Send images as `files` fields of `multipart/form-data`, up to `IMAGE_BATCH_MAX_FILES`
+    and `IMAGE_BATCH_MAX_SIZE` bytes in total.
+    They are processed in parallel, the result of every file is returned in the same order.
+    The file which is not a valid image has `error` instead of `name`.
+
+    It's admin tooling, the processing takes every core of the web worker.
+    """
+    parser_classes = (MultiPartParser, )
+    permission_classes = (IsAdminUser,)
+    # Storage writes are I/O-bound, they run in threads while the next images are processed
+    write_threads = 8
+
+    @swagger_auto_schema(
+        manual_parameters=[openapi.Parameter('files', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
+                                             description="Image, repeat the field for every image")],
+        responses={200: ImageBatchResultSerializer(many=True)}
+    )
+    def post(self, request):
+        files = request.FILES.getlist('files')
+        if not files:
+            raise ValidationError({'files': "No images are uploaded"})
+        if len(files) > settings.IMAGE_BATCH_MAX_FILES:
+            raise ValidationError({'files': f"No more than {settings.IMAGE_BATCH_MAX_FILES} images at once"})
+        # Images are read into memory to be sent to the process pool
+        if sum(file.size for file in files) > settings.IMAGE_BATCH_MAX_SIZE:
+            raise ValidationError({'files': f"Images must be up to {settings.IMAGE_BATCH_MAX_SIZE} bytes in total"})
+
+        # The same image is processed once, even if it's uploaded several times
+        digests = [get_digest(file) for file in files]
+        names, data = {}, {}
+        for digest, file in zip(digests, files):
+            if digest not in names and digest not in data:
+                name = get_stored_image(digest)
+                if name is None:
+                    data[digest] = file.read()
+                else:
+                    names[digest] = name
+
+        errors = self.process(data, names)
+
+        results = []
+        for digest, file in zip(digests, files):
+            name = names.get(digest)
+            results.append({
+                'file': file.name,
+                'name': name,
+                'url': default_storage.url(name) if name else None,
+                'variants': get_image_variants(name) if name else [],
+                'error': errors.get(digest),
+            })
+        return Response(data=ImageBatchResultSerializer(results, many=True).data, status=status.HTTP_200_OK)
+
+    def process(self, data, names):
+        """Encode images by the process pool and write them to storage as soon as each one is ready
+
+        :param data: raw images by digest
+        :param names: names of the stored images by digest, it's filled with the new ones
+        :return: errors by digest
+        :raise ImageProcessingUnavailable: if the process pool is broken
+        """
+        errors, new_names, writes = {}, {}, []
+        with ThreadPoolExecutor(max_workers=self.write_threads) as writer:
+            try:
+                for digest, encoded in zip(data, map_in_process_pool(encode_image, data.values())):
+                    if 'error' in encoded:
+                        errors[digest] = encoded['error']
+                        continue
+
+                    name = f"{filename_generator()}.{settings.IMAGE_DEFAULT_EXTENSION}"
+                    writes.append(writer.submit(save_file, name, encoded['image']))
+                    for width, img_format, content in encoded['variants']:
+                        writes.append(writer.submit(save_file, variant_name(name, width, img_format), content))
+                    new_names[digest] = name
+
+                written = [write.result() for write in writes]
+            except BaseException:
+                # Nothing is returned to the client, so the files written so far are garbage
+                wait(writes)
+                for write in writes:
+                    if write.exception() is None:
+                        default_storage.delete(write.result())
+                raise
+
+        record_media(*written)
+        for digest, name in new_names.items():
+            remember_stored_image(digest, name)
+        names.update(new_names)
+        return errors
+
+
+class DirectUploadView(APIView):
+    """
+    Start direct upload of the image
+
+    Image bytes don't pass through the API: the client sends the raw image right to the storage
+    by the signed `upload` until its `expires_at`. Then `POST /static/image/direct/<id>/complete/`
+    queues processing of the uploaded image.
+    """
+    @swagger_auto_schema(request_body=no_body, responses={201: DirectUploadSerializer})
+    def post(self, request):
+        user = request.user if request.user.is_authenticated else None
+        job = ImageJob.objects.create(
+            user=user, status=ImageJob.UPLOADING, source=f'{settings.IMAGE_UPLOADS_DIR}/{filename_generator()}',
+            name=f'{filename_generator()}.{settings.IMAGE_DEFAULT_EXTENSION}',
+        )
+        upload = get_direct_upload_backend().create_upload(job.source)
+        return Response(data=DirectUploadSerializer({'job': job, 'upload': upload}).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class DirectUploadCompleteView(APIView):
+    """
+    Complete direct upload of the image
+
+    The uploaded image is processed by Celery like the async upload, poll the job status by
+    `GET /static/image/jobs/<id>/`.
+    """
+    @swagger_auto_schema(request_body=no_body, responses={202: ImageJobSerializer})
+    def post(self, request, pk):
+        job = get_object_or_404(ImageJob, pk=pk, status=ImageJob.UPLOADING)
+        if job.user_id is not None and job.user_id != request.user.id:
+            raise NotFound()
+        # Storage is requested directly, the manifest doesn't know raw uploads
+        if not default_storage.exists(job.source):
+            raise ValidationError("The image is not uploaded yet")
+
+        # Only the first of concurrent completions queues the job
+        if not ImageJob.objects.filter(pk=job.pk, status=ImageJob.UPLOADING).update(status=ImageJob.PENDING):
+            raise NotFound()
+        job.status = ImageJob.PENDING
+        transaction.on_commit(lambda: process_image.delay(str(job.pk)))
+
+        location = reverse('v1:static_content:image-job', args=(job.pk,), request=request)
+        return Response(data=ImageJobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+
+class LocalDirectUploadView(APIView):
+    """Upload URL of ``LocalDirectUploadBackend``, which stands in for the storage. The signed key
+    authorizes the upload, so JWT is not needed
+    """
+    authentication_classes = ()
+    permission_classes = ()
+    swagger_schema = None
+
+    def put(self, request, token):
+        try:
+            key = LocalDirectUploadBackend.get_key(token)
+        except signing.BadSignature:
+            raise PermissionDenied("Upload URL is invalid or expired")
+
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if not 0 < length <= settings.IMAGE_DIRECT_UPLOAD_MAX_SIZE:
+            raise ValidationError(f"Image size must be up to {settings.IMAGE_DIRECT_UPLOAD_MAX_SIZE} bytes")
+        if default_storage.exists(key):
+            raise ValidationError("The image is already uploaded")
+
+        # Storage renames the file if the key is taken meanwhile, the job doesn't know the new name
+        name = default_storage.save(key, File(request.stream))
+        if name != key:
+            default_storage.delete(name)
+            raise ValidationError("The image is already uploaded")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ImageJobView(RetrieveAPIView):
+    """
+    Status of the image processing
+
+    `url` of the processed image is returned when `status` is `done`.
+    """
+    queryset = ImageJob.objects.all()
+    serializer_class = ImageJobSerializer
+
+
+class ImageVariantView(APIView):
+    """
+    Responsive variant of the image
+
+    Redirects to the image resized to one of `IMAGE_VARIANT_WIDTHS` in the given format.
+    Variants which are not precomputed on upload are generated on the first request and stored.
+    """
+    @swagger_auto_schema(responses={302: "Redirect to the variant"})
+    def get(self, request, name, width, img_format):
+        if width not in settings.IMAGE_VARIANT_WIDTHS or img_format not in get_variant_formats():
+            raise NotFound("Unknown image variant")
+
+        variant = variant_name(name, width, img_format)
+        if not media_exists(variant):
+            if not media_exists(name):
+                raise NotFound(f"Media file with the name {name} is not found")
+            with default_storage.open(name) as f:
+                save_image(make_variant(resize_image(f), width), variant, img_format)
+        return redirect(default_storage.url(variant))